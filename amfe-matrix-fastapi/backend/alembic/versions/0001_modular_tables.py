@@ -0,0 +1,27 @@
+"""Tablas normalizadas de las matrices modulares y backfill de las existentes
+
+Revision ID: 0001_modular_tables
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+from sqlalchemy.orm import Session
+
+from app.models import Base
+from app.services.modular_tables import NORMALIZED_MODELS, backfill_modular_tables
+
+revision = '0001_modular_tables'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    # La app también crea las tablas al arrancar (create_all): solo se crean las que falten
+    Base.metadata.create_all(bind, tables=[model.__table__ for model in reversed(NORMALIZED_MODELS)])
+    backfill_modular_tables(Session(bind=bind))
+
+
+def downgrade():
+    Base.metadata.drop_all(op.get_bind(), tables=[model.__table__ for model in NORMALIZED_MODELS])
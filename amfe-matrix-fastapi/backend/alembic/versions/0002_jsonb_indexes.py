@@ -0,0 +1,43 @@
+"""data como JSONB en Postgres e índices sobre los campos filtrables
+
+Revision ID: 0002_jsonb_indexes
+Revises: 0001_modular_tables
+Create Date: 2026-10-18
+"""
+from alembic import op
+from sqlalchemy.schema import CreateIndex, DropIndex
+
+from app.models import AMFEMatrix
+
+revision = '0002_jsonb_indexes'
+down_revision = '0001_modular_tables'
+branch_labels = None
+depends_on = None
+
+# Índices sobre `data` declarados en el modelo
+INDEXES = ('ix_amfe_matrices_type', 'ix_amfe_matrices_servicio', 'ix_amfe_matrices_area')
+POSTGRES_INDEXES = ('ix_amfe_matrices_data_gin',)
+
+
+def _indexes(dialect: str):
+    names = INDEXES + (POSTGRES_INDEXES if dialect == 'postgresql' else ())
+    return [index for index in AMFEMatrix.__table__.indexes if index.name in names]
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        # JSONB normaliza el documento: no conserva el orden de las claves ni los duplicados
+        op.execute("ALTER TABLE amfe_matrices ALTER COLUMN data TYPE jsonb USING data::jsonb")
+    # La app también crea los índices al arrancar (create_all). IF NOT EXISTS en
+    # lugar de checkfirst: SQLite no refleja los índices de expresión
+    for index in _indexes(bind.dialect.name):
+        op.execute(CreateIndex(index, if_not_exists=True))
+
+
+def downgrade():
+    bind = op.get_bind()
+    for index in _indexes(bind.dialect.name):
+        op.execute(DropIndex(index, if_exists=True))
+    if bind.dialect.name == 'postgresql':
+        op.execute("ALTER TABLE amfe_matrices ALTER COLUMN data TYPE json USING data::json")
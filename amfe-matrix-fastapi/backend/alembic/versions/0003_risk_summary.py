@@ -0,0 +1,27 @@
+"""Resumen de riesgo materializado por matriz y backfill de las existentes
+
+Revision ID: 0003_risk_summary
+Revises: 0002_jsonb_indexes
+Create Date: 2026-10-18
+"""
+from alembic import op
+from sqlalchemy.orm import Session
+
+from app.models import Base, MatrixRiskSummary
+from app.services.risk_summary import backfill_risk_summaries
+
+revision = '0003_risk_summary'
+down_revision = '0002_jsonb_indexes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    # La app también crea la tabla al arrancar (create_all): solo se crea si falta
+    Base.metadata.create_all(bind, tables=[MatrixRiskSummary.__table__])
+    backfill_risk_summaries(Session(bind=bind))
+
+
+def downgrade():
+    Base.metadata.drop_all(op.get_bind(), tables=[MatrixRiskSummary.__table__])
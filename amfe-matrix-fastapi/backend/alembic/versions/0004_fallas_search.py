@@ -0,0 +1,56 @@
+"""Búsqueda de texto en las fallas: search_text, índice tsvector (Postgres) o FTS5 (SQLite)
+
+Revision ID: 0004_fallas_search
+Revises: 0003_risk_summary
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateIndex, DropIndex
+
+from app.models import MatrixFalla, SEARCH_DDL_POSTGRESQL, SEARCH_DDL_SQLITE, SEARCH_FTS_TABLE
+from app.services.modular_tables import backfill_modular_tables
+
+revision = '0004_fallas_search'
+down_revision = '0003_risk_summary'
+branch_labels = None
+depends_on = None
+
+
+def _search_index():
+    return next(index for index in MatrixFalla.__table__.indexes if index.name == 'ix_amfe_fallas_search')
+
+
+def upgrade():
+    bind = op.get_bind()
+    # La app crea la columna al arrancar (create_all) solo en bases nuevas
+    columns = {column['name'] for column in sa.inspect(bind).get_columns('amfe_fallas')}
+    if 'search_text' not in columns:
+        op.add_column('amfe_fallas', sa.Column('search_text', sa.Text(), nullable=True))
+
+    # Reescribir las filas normalizadas completa search_text. En SQLite va
+    # antes de los triggers: borrar de una tabla FTS5 de contenido externo
+    # filas que no estaban indexadas la corrompe.
+    backfill_modular_tables(Session(bind=bind))
+
+    if bind.dialect.name == 'postgresql':
+        for statement in SEARCH_DDL_POSTGRESQL:
+            op.execute(statement)
+        op.execute(CreateIndex(_search_index(), if_not_exists=True))
+    elif bind.dialect.name == 'sqlite':
+        for statement in SEARCH_DDL_SQLITE:
+            op.execute(statement)
+        op.execute(f"INSERT INTO {SEARCH_FTS_TABLE}({SEARCH_FTS_TABLE}) VALUES ('rebuild')")
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        op.execute(DropIndex(_search_index(), if_exists=True))
+    elif bind.dialect.name == 'sqlite':
+        for suffix in ('ai', 'ad', 'au'):
+            op.execute(f"DROP TRIGGER IF EXISTS {SEARCH_FTS_TABLE}_{suffix}")
+        op.execute(f"DROP TABLE IF EXISTS {SEARCH_FTS_TABLE}")
+    with op.batch_alter_table('amfe_fallas') as batch:
+        batch.drop_column('search_text')
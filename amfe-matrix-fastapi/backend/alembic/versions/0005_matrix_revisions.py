@@ -0,0 +1,28 @@
+"""Historial de revisiones de las matrices (snapshots y deltas comprimidos)
+
+Revision ID: 0005_matrix_revisions
+Revises: 0004_fallas_search
+Create Date: 2026-10-18
+"""
+from alembic import op
+from sqlalchemy.orm import Session
+
+from app.models import Base, MatrixRevision
+from app.services.revisions import backfill_revisions
+
+revision = '0005_matrix_revisions'
+down_revision = '0004_fallas_search'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    # La app también crea la tabla al arrancar (create_all): solo se crea si falta
+    Base.metadata.create_all(bind, tables=[MatrixRevision.__table__])
+    # El documento actual de cada matriz queda como su revisión 1
+    backfill_revisions(Session(bind=bind))
+
+
+def downgrade():
+    Base.metadata.drop_all(op.get_bind(), tables=[MatrixRevision.__table__])
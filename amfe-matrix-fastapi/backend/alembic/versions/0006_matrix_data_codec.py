@@ -0,0 +1,26 @@
+"""Compresión opcional de los documentos de las matrices (MATRIX_DATA_CODEC)
+
+Revision ID: 0006_matrix_data_codec
+Revises: 0005_matrix_revisions
+Create Date: 2026-10-18
+"""
+from alembic import op
+from sqlalchemy.orm import Session
+
+from app.services.document_codec import recompress_documents
+
+revision = '0006_matrix_data_codec'
+down_revision = '0005_matrix_revisions'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Sin cambios de esquema: se reescriben los documentos con la configuración
+    # actual (con MATRIX_DATA_CODEC=none no se escribe nada)
+    recompress_documents(Session(bind=op.get_bind()))
+
+
+def downgrade():
+    # El código anterior espera los documentos en claro
+    recompress_documents(Session(bind=op.get_bind()), codec='none')
@@ -0,0 +1,29 @@
+"""Contador de versión de las matrices (If-Match y ETags)
+
+Revision ID: 0007_matrix_version
+Revises: 0006_matrix_data_codec
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0007_matrix_version'
+down_revision = '0006_matrix_data_codec'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # La app crea la columna al arrancar (create_all) solo en bases nuevas
+    columns = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('amfe_matrices')}
+    if 'version' not in columns:
+        op.add_column('amfe_matrices', sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        # DROP COLUMN nativo (SQLite 3.35+): batch_alter_table recrea la tabla y
+        # pierde los índices de expresión sobre `data`
+        op.execute("ALTER TABLE amfe_matrices DROP COLUMN version")
+    else:
+        op.drop_column('amfe_matrices', 'version')
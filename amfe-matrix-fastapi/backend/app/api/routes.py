@@ -1,9 +1,15 @@
-from fastapi import APIRouter, HTTPException, Depends
-from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
-from datetime import timedelta
-from typing import List
-from app.schemas import UserCreate, UserLogin, User, Token, Matrix, MatrixCreate, MatrixUpdate, MatrixModularCreate, MatrixModular
+from fastapi import APIRouter, HTTPException, Depends, File, Header, Request, Response, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timedelta
+from typing import List, Literal, Optional
+import asyncio
+import logging
+import os
+import time
+from app.schemas import UserCreate, UserLogin, User, Token, Matrix, MatrixSummary, MatrixCreate, MatrixUpdate, MatrixModularCreate, MatrixModular, BulkImportResult, RiskAnalytics, SearchHit, MatrixRevisionInfo, MatrixRevisionDocument, MatrixRevisionDiff, ExportJob, MatrixExportFilter, BulkExportRequest, FlatExportRequest
 from app.models import User as UserModel, AMFEMatrix
 from app.services.auth_service import (
     register_user, verify_user, get_user, test_password_hash, 
@@ -11,10 +17,35 @@ from app.services.auth_service import (
     get_current_user, get_current_admin_user
 )
 from app.services.matrix_service import (
-    get_matrices, get_matrix, create_matrix, update_matrix, 
-    delete_matrix, export_matrix_to_excel, export_modular_matrix_to_excel
+    get_matrices, get_matrix_summaries, get_matrix, get_matrix_version, get_matrices_version, create_matrix, update_matrix, 
+    create_modular_matrix, update_modular_matrix, save_modular_matrix_patch, MatrixVersionConflict, delete_matrix, get_matrices_for_export, get_matrix_ids_for_export, iter_matrices,
+    export_matrix_cached, export_cache_key,
+    export_filename, iter_file_chunks, EXCEL_MEDIA_TYPE
 )
-from app.database import get_db
+from app.services.export_cache import export_cache
+from app.services.export_jobs import export_jobs, ExportQueueFullError, ExportJobTimeout, JOB_DONE
+from app.services.flat_export import FLAT_WRITERS, FLAT_MEDIA_TYPES, parquet_available
+from app.services.bulk_export import (
+    bulk_export_parts, iter_bulk_zip, submit_bulk_workbook, discard_bulk_workbook, iter_rendered_file,
+    EXPORT_BULK_MAX_MATRICES, ZIP_MEDIA_TYPE
+)
+from app.services.db_metrics import db_metrics, DB_HEALTH_TIMEOUT, DB_HEALTH_SATURATION
+from app.services.pagination import NEXT_CURSOR_HEADER, decode_cursor, paginate, split_page
+from app.services.etags import (
+    REVALIDATE_CACHE_CONTROL, matrix_etag, etag_matches, etag_matches_weak, collection_etag, export_etag
+)
+from app.services.matrix_import import (
+    IMPORT_BATCH_SIZE, IMPORT_MAX_BATCH_SIZE, JSON_MEDIA_TYPE, NDJSON_MEDIA_TYPES,
+    import_modular_matrices, iter_json_array_documents, iter_ndjson_documents
+)
+from app.services.excel_import import iter_workbook_documents
+from app.services.search import SEARCH_MAX_LIMIT, search_fallas
+from app.services.revisions import RevisionNotFound, diff_revisions, get_revision, list_revisions
+from app.services.analytics import ANALYTICS_CACHE_TTL, ANALYTICS_MAX_TOP, MAX_RPN, analytics_cache, get_risk_analytics
+from app.services.matrix_patch import PATCH_MEDIA_TYPES, PatchError, PatchTestFailed, apply_patch, matrix_document
+from app.database import get_async_db, AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -27,18 +58,18 @@ async def test_hash(password: str):
 @router.post("/auth/register", response_model=User)
 async def register(
     user: UserCreate, 
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_admin: UserModel = Depends(get_current_admin_user)
 ):
     """Registrar un nuevo usuario (solo administradores)"""
-    created_user = register_user(db, user)
+    created_user = await register_user(db, user)
     if created_user is None:
         raise HTTPException(status_code=400, detail="Username or email already exists")
     return created_user
 
 @router.post("/auth/login", response_model=Token)
-async def login(user_credentials: UserLogin, db: Session = Depends(get_db)):
-    verified_user = verify_user(db, user_credentials.username, user_credentials.password)
+async def login(user_credentials: UserLogin, db: AsyncSession = Depends(get_async_db)):
+    verified_user = await verify_user(db, user_credentials.username, user_credentials.password)
     if verified_user is None:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
@@ -54,31 +85,54 @@ async def login(user_credentials: UserLogin, db: Session = Depends(get_db)):
     }
 
 @router.get("/users/{username}", response_model=User)
-async def read_user(username: str, db: Session = Depends(get_db)):
-    user = get_user(db, username)
+async def read_user(username: str, db: AsyncSession = Depends(get_async_db)):
+    user = await get_user(db, username)
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
+def _check_cursor(skip: int, cursor: Optional[str]):
+    if cursor is None:
+        return
+    if skip:
+        raise HTTPException(status_code=400, detail="Use either skip or cursor, not both")
+    try:
+        decode_cursor(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+
+def _page_response(response: Response, page):
+    # El cursor de la página siguiente va en un header; el cuerpo sigue siendo la lista
+    rows, next_cursor = page
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return rows
+
 @router.get("/users", response_model=List[User])
 async def list_users(
-    db: Session = Depends(get_db),
+    response: Response,
+    db: AsyncSession = Depends(get_async_db),
     current_admin: UserModel = Depends(get_current_admin_user),
     skip: int = 0,
-    limit: int = 100
+    limit: int = 100,
+    cursor: Optional[str] = None
 ):
-    """Listar todos los usuarios (solo administradores)"""
-    users = db.query(UserModel).offset(skip).limit(limit).all()
-    return users
+    """
+    Listar todos los usuarios (solo administradores), por id. Para recorrer
+    todas las páginas, pasar como cursor el header X-Next-Cursor de la anterior.
+    """
+    _check_cursor(skip, cursor)
+    query = paginate(select(UserModel).order_by(UserModel.id), UserModel.id, skip, limit, cursor)
+    return _page_response(response, split_page((await db.scalars(query)).all(), limit, lambda user: user.id))
 
 @router.delete("/users/{user_id}")
 async def delete_user(
     user_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_admin: UserModel = Depends(get_current_admin_user)
 ):
     """Eliminar un usuario (solo administradores)"""
-    user = db.query(UserModel).filter(UserModel.id == user_id).first()
+    user = await db.get(UserModel, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -86,51 +140,136 @@ async def delete_user(
     if user.id == current_admin.id:
         raise HTTPException(status_code=400, detail="Cannot delete your own account")
     
-    db.delete(user)
-    db.commit()
+    await db.delete(user)
+    await db.commit()
     return {"message": "User deleted successfully"}
 
+def _set_etag(response: Response, etag: str):
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = REVALIDATE_CACHE_CONTROL
+
+def _not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": REVALIDATE_CACHE_CONTROL})
+
+async def _matrix_not_modified(db: AsyncSession, matrix_id: int, if_none_match: Optional[str], etag_for,
+                               modular: bool = False) -> Optional[Response]:
+    """
+    304 si la versión actual de la matriz coincide con If-None-Match. Solo lee
+    id, version y type: una revalidación no transfiere `data`.
+    """
+    if not if_none_match:
+        return None
+    version = await get_matrix_version(db, matrix_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Matrix not found")
+    if modular and version.type != 'modular':
+        raise HTTPException(status_code=400, detail="This is not a modular matrix")
+    etag = etag_for(version)
+    return _not_modified(etag) if etag_matches_weak(if_none_match, etag) else None
+
+async def _list_matrices(fetch, request: Request, response: Response, if_none_match: Optional[str],
+                         db: AsyncSession, skip: int, limit: int, cursor: Optional[str], **filters):
+    """Página de un listado de matrices con el ETag del conjunto (304 si el cliente ya la tiene)"""
+    _check_cursor(skip, cursor)
+    version = await get_matrices_version(db, **filters)
+    etag = collection_etag(f"{request.url.path}?{request.url.query}", *version)
+    if etag_matches_weak(if_none_match, etag):
+        return _not_modified(etag)
+    page = await fetch(db, skip=skip, limit=limit, cursor=cursor, **filters)
+    _set_etag(response, etag)
+    return _page_response(response, page)
+
 @router.get("/matrices", response_model=List[Matrix])
 async def read_matrices(
+    request: Request,
+    response: Response,
     skip: int = 0, 
     limit: int = 100, 
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+    type: Optional[Literal["modular", "legacy"]] = None,
+    servicio: Optional[str] = None,
+    area: Optional[str] = None,
+    created_by: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_db),
     current_user: UserModel = Depends(get_current_user)
 ):
-    """Obtener todas las matrices AMFE"""
-    matrices = get_matrices(db, skip=skip, limit=limit)
-    return matrices
+    """
+    Obtener las matrices AMFE, por id. Los filtros (type=modular|legacy, servicio,
+    área del encabezado, creador) se resuelven en SQL con los índices sobre `data`.
+    Paginación: skip/limit, o cursor con el header X-Next-Cursor de la página anterior.
+    Con If-None-Match igual al ETag del listado se responde 304 sin cargar las matrices.
+    """
+    return await _list_matrices(
+        get_matrices, request, response, if_none_match, db, skip, limit, cursor,
+        type=type, servicio=servicio, area=area, created_by=created_by
+    )
+
+@router.get("/matrices/summary", response_model=List[MatrixSummary])
+async def read_matrix_summaries(
+    request: Request,
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+    type: Optional[Literal["modular", "legacy"]] = None,
+    servicio: Optional[str] = None,
+    area: Optional[str] = None,
+    created_by: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: UserModel = Depends(get_current_user)
+):
+    """
+    Listado resumido para la pantalla de matrices: mismos filtros, paginación
+    y ETag que GET /matrices, pero sin el documento `data` (solo encabezado y el
+    resumen de riesgo materializado: RPN máximo/promedio, fallas por tipo de riesgo,
+    acciones abiertas).
+    """
+    return await _list_matrices(
+        get_matrix_summaries, request, response, if_none_match, db, skip, limit, cursor,
+        type=type, servicio=servicio, area=area, created_by=created_by
+    )
 
 @router.post("/matrices", response_model=Matrix)
 async def create_new_matrix(
     matrix: MatrixCreate, 
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: UserModel = Depends(get_current_user)
 ):
     """Crear una nueva matriz AMFE"""
-    return create_matrix(db=db, matrix=matrix, user_id=current_user.id)
+    return await create_matrix(db=db, matrix=matrix, user_id=current_user.id)
 
 @router.get("/matrices/{matrix_id}", response_model=Matrix)
 async def read_matrix(
     matrix_id: int, 
-    db: Session = Depends(get_db),
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db),
     current_user: UserModel = Depends(get_current_user)
 ):
-    """Obtener una matriz específica"""
-    db_matrix = get_matrix(db, matrix_id=matrix_id)
+    """Obtener una matriz específica (304 si If-None-Match coincide con su ETag)"""
+    not_modified = await _matrix_not_modified(db, matrix_id, if_none_match, matrix_etag)
+    if not_modified:
+        return not_modified
+    db_matrix = await get_matrix(db, matrix_id=matrix_id)
     if db_matrix is None:
         raise HTTPException(status_code=404, detail="Matrix not found")
+    _set_etag(response, matrix_etag(db_matrix))
     return db_matrix
 
 @router.put("/matrices/{matrix_id}", response_model=Matrix)
 async def update_existing_matrix(
     matrix_id: int, 
     matrix: MatrixUpdate, 
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: UserModel = Depends(get_current_user)
 ):
     """Actualizar una matriz existente"""
-    db_matrix = update_matrix(db, matrix_id=matrix_id, matrix=matrix)
+    try:
+        db_matrix = await update_matrix(db, matrix_id=matrix_id, matrix=matrix, user_id=current_user.id)
+    except MatrixVersionConflict:
+        raise HTTPException(status_code=409, detail="Matrix was modified by another request")
     if db_matrix is None:
         raise HTTPException(status_code=404, detail="Matrix not found")
     return db_matrix
@@ -138,35 +277,123 @@ async def update_existing_matrix(
 @router.delete("/matrices/{matrix_id}")
 async def delete_existing_matrix(
     matrix_id: int, 
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: UserModel = Depends(get_current_user)
 ):
     """Eliminar una matriz"""
-    success = delete_matrix(db, matrix_id=matrix_id)
+    success = await delete_matrix(db, matrix_id=matrix_id)
     if not success:
         raise HTTPException(status_code=404, detail="Matrix not found")
     return {"message": "Matrix deleted successfully"}
 
+async def _revision_history(db: AsyncSession, matrix_id: int) -> List[dict]:
+    """Historial de una matriz existente (404 si la matriz no existe)"""
+    if await get_matrix_version(db, matrix_id) is None:
+        raise HTTPException(status_code=404, detail="Matrix not found")
+    return await list_revisions(db, matrix_id)
+
+@router.get("/matrices/{matrix_id}/revisions", response_model=List[MatrixRevisionInfo])
+async def read_matrix_revisions(
+    matrix_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: UserModel = Depends(get_current_user)
+):
+    """
+    Historial de revisiones de una matriz (clásica o modular), de la más
+    reciente a la más antigua: número, si es snapshot o delta, bytes
+    guardados, fecha y autor. La más reciente es la matriz actual.
+    """
+    return await _revision_history(db, matrix_id)
+
+@router.get("/matrices/{matrix_id}/revisions/diff", response_model=MatrixRevisionDiff)
+async def diff_matrix_revisions(
+    matrix_id: int,
+    from_revision: int,
+    to_revision: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: UserModel = Depends(get_current_user)
+):
+    """
+    Cambios de la revisión `from_revision` a `to_revision` (por defecto la
+    más reciente): add, remove, replace y order, con rutas JSON Pointer en las
+    que los elementos de procesos, subprocesos, fallas e items van por su id.
+    """
+    if to_revision is None:
+        history = await _revision_history(db, matrix_id)
+        if not history:
+            raise HTTPException(status_code=404, detail="Revision not found")
+        to_revision = history[0]["revision"]
+    try:
+        changes = await diff_revisions(db, matrix_id, from_revision, to_revision)
+    except RevisionNotFound:
+        raise HTTPException(status_code=404, detail="Revision not found")
+    return {"matrix_id": matrix_id, "from_revision": from_revision, "to_revision": to_revision, "changes": changes}
+
+@router.get("/matrices/{matrix_id}/revisions/{revision}", response_model=MatrixRevisionDocument)
+async def read_matrix_revision(
+    matrix_id: int,
+    revision: int,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: UserModel = Depends(get_current_user)
+):
+    """Documento (nombre, descripción y data) de una revisión de la matriz"""
+    try:
+        return await get_revision(db, matrix_id, revision)
+    except RevisionNotFound:
+        raise HTTPException(status_code=404, detail="Revision not found")
+
+def _excel_file_response(excel_file, filename: str, stream: bool, etag: Optional[str] = None) -> StreamingResponse:
+    """Respuesta de descarga para un .xlsx (BytesIO o archivo temporal en streaming)"""
+    headers = {"Content-Disposition": f"attachment; filename={filename}"}
+    if etag:
+        headers.update({"ETag": etag, "Cache-Control": REVALIDATE_CACHE_CONTROL})
+    if stream:
+        # Archivo temporal: se envía por bloques y se cierra (y borra) al terminar
+        excel_file.seek(0, os.SEEK_END)
+        headers["Content-Length"] = str(excel_file.tell())
+        excel_file.seek(0)
+        excel_file = iter_file_chunks(excel_file)
+    
+    return StreamingResponse(
+        excel_file,
+        media_type=EXCEL_MEDIA_TYPE,
+        headers=headers
+    )
+
 @router.get("/matrices/{matrix_id}/export")
 async def export_matrix(
     matrix_id: int,
-    db: Session = Depends(get_db),
+    stream: bool = False,
+    conditional: bool = False,
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db),
     current_user: UserModel = Depends(get_current_user)
 ):
-    """Exportar una matriz AMFE a Excel"""
-    db_matrix = get_matrix(db, matrix_id=matrix_id)
+    """
+    Exportar una matriz AMFE a Excel.
+    Con stream=true se usa el modo de memoria constante para matrices muy grandes.
+    Con conditional=true el color de RPN y tipo de riesgo va como formato
+    condicional de Excel (los umbrales se pueden editar en el archivo).
+    Con If-None-Match igual al ETag de la descarga anterior se responde 304 sin renderizar.
+    """
+    def etag_for(matrix):
+        return export_etag(export_cache_key(matrix, 'legacy', conditional), stream)
+
+    not_modified = await _matrix_not_modified(db, matrix_id, if_none_match, etag_for)
+    if not_modified:
+        return not_modified
+    db_matrix = await get_matrix(db, matrix_id=matrix_id)
     if db_matrix is None:
         raise HTTPException(status_code=404, detail="Matrix not found")
     
-    excel_file = export_matrix_to_excel(db_matrix)
+    # El render es CPU: fuera del event loop para no bloquear otras peticiones
+    excel_file = await run_in_threadpool(
+        export_matrix_cached, db_matrix, 'legacy', stream=stream, conditional=conditional
+    )
     
-    filename = f"AMFE_{db_matrix.name.replace(' ', '_')}_{db_matrix.id}.xlsx"
+    filename = export_filename(db_matrix, 'legacy')
     
-    return StreamingResponse(
-        excel_file,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
-    )
+    return _excel_file_response(excel_file, filename, stream, etag=etag_for(db_matrix))
 
 
 # ========================================
@@ -174,35 +401,85 @@ async def export_matrix(
 # ========================================
 
 @router.post("/matrices/modular", response_model=MatrixModular)
-async def create_modular_matrix(
+async def create_new_modular_matrix(
     matrix: MatrixModularCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: UserModel = Depends(get_current_user)
 ):
     """Crear una nueva matriz AMFE modular"""
-    # Convertir el objeto Pydantic a dict para almacenar en JSON
-    matrix_data = matrix.data.dict()
-    
-    db_matrix = AMFEMatrix(
-        name=matrix.name,
-        description=matrix.description,
-        data={"type": "modular", **matrix_data},  # Marcar como modular
-        created_by=current_user.id
-    )
-    db.add(db_matrix)
-    db.commit()
-    db.refresh(db_matrix)
-    
-    return db_matrix
+    return await create_modular_matrix(db, matrix, user_id=current_user.id)
+
+def _import_batch_size(batch_size: Optional[int]) -> int:
+    if batch_size is None:
+        return IMPORT_BATCH_SIZE
+    if not 1 <= batch_size <= IMPORT_MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"batch_size must be between 1 and {IMPORT_MAX_BATCH_SIZE}")
+    return batch_size
+
+async def _import_report(db: AsyncSession, documents, user_id: int, batch_size: int) -> dict:
+    report = await import_modular_matrices(db, documents, user_id, batch_size)
+    if report["aborted"] and not report["received"]:
+        raise HTTPException(status_code=400, detail=report["aborted"])
+    return report
+
+@router.post("/matrices/modular/import", response_model=BulkImportResult)
+async def import_modular_matrices_bulk(
+    request: Request,
+    batch_size: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: UserModel = Depends(get_current_user)
+):
+    """
+    Importar muchas matrices modulares en una petición: NDJSON
+    (application/x-ndjson, un MatrixModularCreate por línea) o un arreglo JSON
+    (application/json). Se validan a medida que llegan y se insertan en lotes
+    de batch_size (una transacción por lote); los documentos con error se
+    informan por posición sin detener la importación.
+    """
+    batch_size = _import_batch_size(batch_size)
+    media_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if media_type in NDJSON_MEDIA_TYPES:
+        documents = iter_ndjson_documents(request.stream())
+    elif media_type == JSON_MEDIA_TYPE:
+        documents = iter_json_array_documents(request.stream())
+    else:
+        raise HTTPException(status_code=415, detail="Unsupported import format, use application/x-ndjson or application/json")
+
+    return await _import_report(db, documents, current_user.id, batch_size)
+
+@router.post("/matrices/modular/import/excel", response_model=BulkImportResult)
+async def import_modular_matrices_excel(
+    file: UploadFile = File(...),
+    batch_size: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: UserModel = Depends(get_current_user)
+):
+    """
+    Importar matrices modulares desde Excel con el formato de Club Noel: un
+    .xlsx (una matriz por hoja) o un .zip con varios .xlsx. Cada workbook se
+    lee en streaming y los documentos se insertan en lotes como en
+    POST /matrices/modular/import; los errores se informan por archivo y hoja.
+    """
+    batch_size = _import_batch_size(batch_size)
+    try:
+        documents = iter_workbook_documents(file.file, file.filename or "upload.xlsx")
+        return await _import_report(db, documents, current_user.id, batch_size)
+    finally:
+        await file.close()
 
 @router.get("/matrices/modular/{matrix_id}", response_model=MatrixModular)
 async def read_modular_matrix(
     matrix_id: int,
-    db: Session = Depends(get_db),
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db),
     current_user: UserModel = Depends(get_current_user)
 ):
-    """Obtener una matriz modular específica"""
-    db_matrix = get_matrix(db, matrix_id=matrix_id)
+    """Obtener una matriz modular específica (304 si If-None-Match coincide con su ETag)"""
+    not_modified = await _matrix_not_modified(db, matrix_id, if_none_match, matrix_etag, modular=True)
+    if not_modified:
+        return not_modified
+    db_matrix = await get_matrix(db, matrix_id=matrix_id)
     if db_matrix is None:
         raise HTTPException(status_code=404, detail="Matrix not found")
     
@@ -210,17 +487,20 @@ async def read_modular_matrix(
     if db_matrix.data.get('type') != 'modular':
         raise HTTPException(status_code=400, detail="This is not a modular matrix")
     
+    # También es la versión para If-Match en PATCH
+    _set_etag(response, matrix_etag(db_matrix))
     return db_matrix
 
 @router.put("/matrices/modular/{matrix_id}", response_model=MatrixModular)
-async def update_modular_matrix(
+async def update_existing_modular_matrix(
     matrix_id: int,
     matrix: MatrixModularCreate,
-    db: Session = Depends(get_db),
+    response: Response,
+    db: AsyncSession = Depends(get_async_db),
     current_user: UserModel = Depends(get_current_user)
 ):
     """Actualizar una matriz modular existente"""
-    db_matrix = get_matrix(db, matrix_id=matrix_id)
+    db_matrix = await get_matrix(db, matrix_id=matrix_id)
     if db_matrix is None:
         raise HTTPException(status_code=404, detail="Matrix not found")
     
@@ -228,25 +508,90 @@ async def update_modular_matrix(
     if db_matrix.data.get('type') != 'modular':
         raise HTTPException(status_code=400, detail="This is not a modular matrix")
     
-    # Actualizar datos
-    matrix_data = matrix.data.dict()
-    db_matrix.name = matrix.name
-    db_matrix.description = matrix.description
-    db_matrix.data = {"type": "modular", **matrix_data}
-    
-    db.commit()
-    db.refresh(db_matrix)
-    
+    try:
+        db_matrix = await update_modular_matrix(db, db_matrix, matrix, user_id=current_user.id)
+    except MatrixVersionConflict:
+        raise HTTPException(status_code=409, detail="Matrix was modified by another request")
+    response.headers["ETag"] = matrix_etag(db_matrix)
+    return db_matrix
+
+@router.patch("/matrices/modular/{matrix_id}", response_model=MatrixModular)
+async def patch_existing_modular_matrix(
+    matrix_id: int,
+    request: Request,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: UserModel = Depends(get_current_user)
+):
+    """
+    Actualización parcial de una matriz modular con JSON Patch
+    (application/json-patch+json) o merge patch (application/merge-patch+json);
+    las listas se direccionan por el id de cada elemento (ver matrix_patch).
+    Requiere If-Match con el ETag de la última lectura: si la matriz cambió
+    entretanto se responde 412 y hay que volver a leerla. Un parche que no
+    cambia nada no guarda ni crea una revisión.
+    """
+    media_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if media_type not in PATCH_MEDIA_TYPES:
+        raise HTTPException(status_code=415, detail=f"Unsupported patch format, use one of: {', '.join(PATCH_MEDIA_TYPES)}")
+    try:
+        patch = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON body")
+
+    db_matrix = await get_matrix(db, matrix_id=matrix_id)
+    if db_matrix is None:
+        raise HTTPException(status_code=404, detail="Matrix not found")
+    if db_matrix.data.get('type') != 'modular':
+        raise HTTPException(status_code=400, detail="This is not a modular matrix")
+    if not if_match:
+        raise HTTPException(status_code=428, detail="If-Match header is required")
+    if not etag_matches(if_match, matrix_etag(db_matrix)):
+        raise HTTPException(status_code=412, detail="Matrix was modified by another request")
+
+    current = matrix_document(db_matrix)
+    try:
+        document = apply_patch(current, patch, media_type)
+    except PatchTestFailed as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except PatchError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if document == current:
+        # Parche sin cambios: no se escribe, así la versión, el ETag y la caché de exportaciones siguen valiendo
+        response.headers["ETag"] = matrix_etag(db_matrix)
+        return db_matrix
+
+    try:
+        db_matrix = await save_modular_matrix_patch(db, db_matrix, document, user_id=current_user.id)
+    except MatrixVersionConflict:
+        raise HTTPException(status_code=412, detail="Matrix was modified by another request")
+    response.headers["ETag"] = matrix_etag(db_matrix)
     return db_matrix
 
 @router.get("/matrices/modular/{matrix_id}/export")
 async def export_modular_matrix(
     matrix_id: int,
-    db: Session = Depends(get_db),
+    stream: bool = False,
+    conditional: bool = False,
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db),
     current_user: UserModel = Depends(get_current_user)
 ):
-    """Exportar una matriz AMFE modular a Excel con formato del hospital"""
-    db_matrix = get_matrix(db, matrix_id=matrix_id)
+    """
+    Exportar una matriz AMFE modular a Excel con formato del hospital.
+    Con stream=true se usa el modo de memoria constante para matrices muy grandes.
+    Con conditional=true el color de RPN y tipo de riesgo va como formato
+    condicional de Excel (los umbrales se pueden editar en el archivo).
+    Con If-None-Match igual al ETag de la descarga anterior se responde 304 sin renderizar.
+    """
+    def etag_for(matrix):
+        return export_etag(export_cache_key(matrix, 'modular', conditional), stream)
+
+    not_modified = await _matrix_not_modified(db, matrix_id, if_none_match, etag_for, modular=True)
+    if not_modified:
+        return not_modified
+    db_matrix = await get_matrix(db, matrix_id=matrix_id)
     if db_matrix is None:
         raise HTTPException(status_code=404, detail="Matrix not found")
     
@@ -254,12 +599,340 @@ async def export_modular_matrix(
     if db_matrix.data.get('type') != 'modular':
         raise HTTPException(status_code=400, detail="This is not a modular matrix")
     
-    excel_file = export_modular_matrix_to_excel(db_matrix)
+    excel_file = await run_in_threadpool(
+        export_matrix_cached, db_matrix, 'modular', stream=stream, conditional=conditional
+    )
     
-    filename = f"AMFE_Modular_{db_matrix.name.replace(' ', '_')}_{db_matrix.id}.xlsx"
+    filename = export_filename(db_matrix, 'modular')
+    
+    return _excel_file_response(excel_file, filename, stream, etag=etag_for(db_matrix))
+
+# ========================================
+# EXPORTACIONES EN SEGUNDO PLANO
+# ========================================
+
+def _submit_export_job(db_matrix: AMFEMatrix, kind: str, filename: str, user: UserModel, conditional: bool = False):
+    try:
+        return export_jobs.submit(kind, db_matrix, user.id, filename,
+                                  cache_key=export_cache_key(db_matrix, kind, conditional), conditional=conditional)
+    except ExportQueueFullError:
+        raise HTTPException(status_code=503, detail="Export queue is full, try again later")
+
+def _get_export_job(job_id: str, user: UserModel):
+    job = export_jobs.get(job_id)
+    # Cada usuario ve solo sus trabajos; los administradores, todos
+    if job is None or (job.user_id != user.id and user.role != 'admin'):
+        raise HTTPException(status_code=404, detail="Export job not found")
+    return job
+
+@router.post("/matrices/{matrix_id}/export/jobs", response_model=ExportJob, status_code=202)
+async def submit_matrix_export_job(
+    matrix_id: int,
+    conditional: bool = False,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: UserModel = Depends(get_current_user)
+):
+    """Encolar la exportación a Excel de una matriz; devuelve el trabajo para consultar su estado"""
+    db_matrix = await get_matrix(db, matrix_id=matrix_id)
+    if db_matrix is None:
+        raise HTTPException(status_code=404, detail="Matrix not found")
+    
+    filename = export_filename(db_matrix, 'legacy')
+    return _submit_export_job(db_matrix, 'legacy', filename, current_user, conditional)
+
+@router.post("/matrices/modular/{matrix_id}/export/jobs", response_model=ExportJob, status_code=202)
+async def submit_modular_matrix_export_job(
+    matrix_id: int,
+    conditional: bool = False,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: UserModel = Depends(get_current_user)
+):
+    """Encolar la exportación a Excel (formato del hospital) de una matriz modular"""
+    db_matrix = await get_matrix(db, matrix_id=matrix_id)
+    if db_matrix is None:
+        raise HTTPException(status_code=404, detail="Matrix not found")
+    
+    if db_matrix.data.get('type') != 'modular':
+        raise HTTPException(status_code=400, detail="This is not a modular matrix")
+    
+    filename = export_filename(db_matrix, 'modular')
+    return _submit_export_job(db_matrix, 'modular', filename, current_user, conditional)
+
+def _export_filters(request: MatrixExportFilter) -> dict:
+    return request.dict(include={'ids', 'servicio', 'area', 'created_by', 'created_from', 'created_to'})
+
+@router.post("/matrices/export/bulk")
+async def bulk_export_matrices(
+    request: BulkExportRequest,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: UserModel = Depends(get_current_user)
+):
+    """
+    Exportar varias matrices a la vez (p. ej. todas las de un servicio).
+    format=zip devuelve un .xlsx por matriz, enviado a medida que cada uno
+    termina de renderizarse; format=workbook, un solo .xlsx con una hoja por matriz.
+    Si alguno de los `ids` pedidos no existe se responde 404 con la lista.
+    """
+    if request.is_empty():
+        raise HTTPException(status_code=400, detail="Provide ids or at least one filter")
+    
+    # Primero solo los ids: el límite se comprueba antes de cargar los documentos
+    ids = await get_matrix_ids_for_export(db, **_export_filters(request))
+    if request.ids:
+        # Los ids pedidos que no existen se informan (los que no cumplen los otros filtros no)
+        missing = sorted(set(request.ids) - set(await get_matrix_ids_for_export(db, ids=request.ids)))
+        if missing:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Matrices not found: {', '.join(str(matrix_id) for matrix_id in missing)}"
+            )
+    if not ids:
+        raise HTTPException(status_code=404, detail="No matrices match the given criteria")
+    if len(ids) > EXPORT_BULK_MAX_MATRICES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many matrices ({len(ids)}), the limit is {EXPORT_BULK_MAX_MATRICES}"
+        )
+    
+    matrices = await get_matrices_for_export(db, ids=ids)
+    parts = bulk_export_parts(matrices, conditional=request.conditional)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    
+    if request.format == 'workbook':
+        # Se espera el render antes de responder para poder informar errores con su código
+        future, path = submit_bulk_workbook(parts)
+        try:
+            await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # Cliente desconectado: el worker puede terminar igual, el archivo se borra al final
+            discard_bulk_workbook(future, path)
+            raise
+        except ExportJobTimeout:
+            raise HTTPException(status_code=504, detail="Export timed out")
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Export failed: {e}")
+        return StreamingResponse(
+            iter_rendered_file(path),
+            media_type=EXCEL_MEDIA_TYPE,
+            headers={
+                "Content-Disposition": f"attachment; filename=AMFE_Matrices_{timestamp}.xlsx",
+                "Content-Length": str(os.path.getsize(path))
+            }
+        )
     
     return StreamingResponse(
-        excel_file,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
+        iter_bulk_zip(parts),
+        media_type=ZIP_MEDIA_TYPE,
+        headers={"Content-Disposition": f"attachment; filename=AMFE_Matrices_{timestamp}.zip"}
+    )
+
+def _flat_response(matrices, format: str, basename: str) -> StreamingResponse:
+    """Respuesta en streaming con los registros planos (FallaRecord) de las matrices"""
+    if format == 'parquet' and not parquet_available():
+        raise HTTPException(status_code=501, detail="Parquet export requires pyarrow")
+    return StreamingResponse(
+        FLAT_WRITERS[format](matrices),
+        media_type=FLAT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f"attachment; filename={basename}.{format}"}
+    )
+
+@router.get("/matrices/modular/{matrix_id}/export/flat")
+async def export_modular_matrix_flat(
+    matrix_id: int,
+    format: Literal["csv", "ndjson", "parquet"] = "csv",
+    db: AsyncSession = Depends(get_async_db),
+    current_user: UserModel = Depends(get_current_user)
+):
+    """Exportar una matriz modular como tabla plana (una fila por falla e índice) para análisis"""
+    db_matrix = await get_matrix(db, matrix_id=matrix_id)
+    if db_matrix is None:
+        raise HTTPException(status_code=404, detail="Matrix not found")
+    
+    if db_matrix.data.get('type') != 'modular':
+        raise HTTPException(status_code=400, detail="This is not a modular matrix")
+    
+    basename = f"AMFE_Modular_{db_matrix.name.replace(' ', '_')}_{db_matrix.id}"
+    return _flat_response([db_matrix], format, basename)
+
+@router.post("/matrices/export/flat")
+async def flat_export_matrices(
+    request: FlatExportRequest,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: UserModel = Depends(get_current_user)
+):
+    """
+    Exportar como tabla plana todas las matrices modulares que cumplen los
+    criterios. Las matrices se cargan por lotes mientras se envía la respuesta.
+    """
+    if request.is_empty():
+        raise HTTPException(status_code=400, detail="Provide ids or at least one filter")
+    
+    ids = await get_matrix_ids_for_export(db, type='modular', **_export_filters(request))
+    if not ids:
+        raise HTTPException(status_code=404, detail="No matrices match the given criteria")
+    
+    basename = f"AMFE_Matrices_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    return _flat_response(iter_matrices(ids), request.format, basename)
+
+@router.get("/exports/jobs/stats")
+async def export_jobs_stats(current_admin: UserModel = Depends(get_current_admin_user)):
+    """Ocupación de la cola de exportaciones (solo administradores)"""
+    return export_jobs.stats()
+
+@router.get("/exports/jobs/{job_id}", response_model=ExportJob)
+async def read_export_job(job_id: str, current_user: UserModel = Depends(get_current_user)):
+    """Consultar el estado de un trabajo de exportación"""
+    return _get_export_job(job_id, current_user)
+
+@router.get("/exports/jobs/{job_id}/download")
+async def download_export_job(job_id: str, current_user: UserModel = Depends(get_current_user)):
+    """Descargar el resultado de un trabajo de exportación terminado"""
+    job = _get_export_job(job_id, current_user)
+    if job.status != JOB_DONE:
+        raise HTTPException(status_code=409, detail=f"Export job is {job.status}")
+    
+    try:
+        excel_file = open(job.path, 'rb')
+    except OSError:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    
+    return _excel_file_response(excel_file, job.filename, stream=True)
+
+@router.delete("/exports/jobs/{job_id}")
+async def delete_export_job(job_id: str, current_user: UserModel = Depends(get_current_user)):
+    """Cancelar un trabajo pendiente o descartar el resultado de uno terminado"""
+    _get_export_job(job_id, current_user)
+    export_jobs.cancel(job_id)
+    return {"message": "Export job deleted successfully"}
+
+@router.get("/exports/cache/stats")
+async def export_cache_stats(current_admin: UserModel = Depends(get_current_admin_user)):
+    """Estadísticas de la caché de exportaciones (solo administradores)"""
+    return export_cache.stats()
+
+# ========================================
+# BÚSQUEDA
+# ========================================
+
+@router.get("/search", response_model=List[SearchHit])
+async def search_matrices(
+    q: str,
+    limit: int = 20,
+    servicio: Optional[str] = None,
+    area: Optional[str] = None,
+    created_by: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: UserModel = Depends(get_current_user)
+):
+    """
+    Buscar texto en las matrices modulares: descripción de las fallas,
+    efectos, causas, barreras, acciones, responsable y nombres de proceso y
+    subproceso, sin distinguir tildes. Devuelve las fallas más relevantes
+    primero, con la ruta proceso → subproceso → falla, un fragmento con los
+    términos marcados y el id de la matriz.
+    """
+    if not 1 <= limit <= SEARCH_MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {SEARCH_MAX_LIMIT}")
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="q must not be empty")
+    return await search_fallas(db, q, limit, servicio=servicio, area=area, created_by=created_by)
+
+# ========================================
+# ANALÍTICAS
+# ========================================
+
+@router.get("/analytics/risk", response_model=RiskAnalytics)
+async def read_risk_analytics(
+    response: Response,
+    group_by: Optional[Literal["servicio", "area", "month"]] = None,
+    top: int = 10,
+    bucket_size: int = 25,
+    min_rpn: Optional[int] = None,
+    servicio: Optional[str] = None,
+    area: Optional[str] = None,
+    created_by: Optional[int] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: UserModel = Depends(get_current_user)
+):
+    """
+    Riesgo de todas las matrices modulares (o de las que cumplen los filtros),
+    calculado en SQL: fallas por tipo de riesgo, RPN máximo y promedio,
+    histograma de RPN en tramos de bucket_size, los mismos agregados por
+    servicio, área o mes (fecha de emisión, o de creación si no tiene) y las
+    `top` fallas de mayor RPN con el id de su matriz. Los resultados se
+    cachean ANALYTICS_CACHE_TTL segundos.
+    """
+    if not 0 <= top <= ANALYTICS_MAX_TOP:
+        raise HTTPException(status_code=400, detail=f"top must be between 0 and {ANALYTICS_MAX_TOP}")
+    if not 1 <= bucket_size <= MAX_RPN:
+        raise HTTPException(status_code=400, detail=f"bucket_size must be between 1 and {MAX_RPN}")
+    result = await get_risk_analytics(
+        db, group_by=group_by, top=top, bucket_size=bucket_size, min_rpn=min_rpn,
+        servicio=servicio, area=area, created_by=created_by, created_from=created_from, created_to=created_to
     )
+    response.headers["Cache-Control"] = f"private, max-age={int(ANALYTICS_CACHE_TTL)}"
+    return result
+
+@router.get("/analytics/cache/stats")
+async def analytics_cache_stats(current_admin: UserModel = Depends(get_current_admin_user)):
+    """Estadísticas de la caché de analíticas (solo administradores)"""
+    return analytics_cache.stats()
+
+# ========================================
+# SALUD
+# ========================================
+
+async def _ping_database():
+    async with AsyncSessionLocal() as db:
+        await db.execute(text("SELECT 1"))
+
+async def _database_status() -> dict:
+    """Latencia de un SELECT 1 y estado de la base (ok, degraded o unavailable) con las métricas de los pools"""
+    start = time.perf_counter()
+    error = None
+    try:
+        # Con el pool agotado el checkout esperaría DB_POOL_TIMEOUT: se corta antes
+        await asyncio.wait_for(_ping_database(), timeout=DB_HEALTH_TIMEOUT)
+    except asyncio.TimeoutError:
+        error = f"No response within {DB_HEALTH_TIMEOUT} seconds"
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    ping_ms = (time.perf_counter() - start) * 1000
+    if error:
+        logger.warning("Health check de la base fallido: %s", error)
+    
+    engines = db_metrics.snapshot()
+    saturations = [e["pool"].get("saturation") or 0 for e in engines.values()]
+    if error:
+        status = "unavailable"
+    elif max(saturations, default=0) >= DB_HEALTH_SATURATION:
+        status = "degraded"
+    else:
+        status = "ok"
+    return {"status": status, "ping_ms": None if error else ping_ms, "error": error, "engines": engines}
+
+@router.get("/health/db")
+async def database_health():
+    """
+    Estado de la base de datos para monitoreo: ok, degraded (pool casi
+    saturado) o unavailable, y latencia de un SELECT 1. Responde 503 si la
+    base no contesta a tiempo. Es pública, así que no incluye el error del
+    driver (queda en el log) ni las métricas de los pools (ver /health/db/stats).
+    """
+    result = await _database_status()
+    error = "Database unavailable" if result["error"] else None
+    content = {"status": result["status"], "ping_ms": result["ping_ms"], "error": error}
+    return JSONResponse(content, status_code=503 if error else 200)
+
+@router.get("/health/db/stats")
+async def database_health_stats(current_admin: UserModel = Depends(get_current_admin_user)):
+    """
+    Estado detallado de la base para dimensionar los workers (solo
+    administradores): el error del driver, la ocupación de los pools
+    (saturation = conexiones en uso / pool_size + max_overflow) e histogramas
+    de latencia por sentencia y de espera del pool.
+    """
+    content = await _database_status()
+    return JSONResponse(content, status_code=503 if content["error"] else 200)
@@ -1,12 +1,72 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
+from app.services.db_metrics import db_metrics, timed_pool_class
 import os
 
 DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://user:password@db:5432/mydatabase")
 
-engine = create_engine(DATABASE_URL, echo=True)
+# Driver async de cada motor; DATABASE_URL sigue usando el driver sync (psycopg2)
+ASYNC_DRIVERS = {
+    'postgresql': 'asyncpg',
+    'sqlite': 'aiosqlite',
+}
+
+
+def _async_url(url: str) -> str:
+    """Misma base de datos que `url`, con el driver async correspondiente"""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No hay driver async configurado para {backend}; defina ASYNC_DATABASE_URL")
+    return parsed.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}").render_as_string(hide_password=False)
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _async_url(DATABASE_URL)
+
+# Pool de conexiones, por motor y por proceso. Cada worker de uvicorn tiene
+# dos motores (sync y async): en total se pueden abrir hasta
+# 2 * workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) conexiones, que deben caber
+# en max_connections de Postgres
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # Segundos esperando una conexión libre
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # Segundos; -1 = no reciclar
+# Loguear cada sentencia es síncrono y caro: solo para depurar (las latencias van a db_metrics)
+DB_ECHO = os.getenv("DB_ECHO", "false").lower() in ("1", "true", "yes")
+
+
+def _engine_options(url: str, name: str, is_async: bool = False) -> dict:
+    options = {"echo": DB_ECHO}
+    # SQLite (desarrollo, scripts) conserva el pool por defecto de SQLAlchemy
+    if make_url(url).get_backend_name() != 'sqlite':
+        options.update(
+            poolclass=timed_pool_class(name, is_async),
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_pre_ping=DB_POOL_PRE_PING,
+            pool_recycle=DB_POOL_RECYCLE,
+        )
+    return options
+
+
+# Motor sync: create_admin_user.py, Alembic, create_all y los hilos de exportación
+engine = create_engine(DATABASE_URL, **_engine_options(DATABASE_URL, 'sync'))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Motor async: las rutas de la API. Sin expire_on_commit los objetos siguen
+# legibles después del commit sin volver a consultar (no hay lazy loading en async)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **_engine_options(ASYNC_DATABASE_URL, 'async', is_async=True))
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+# Latencia por sentencia y espera del pool (ver GET /health/db/stats)
+db_metrics.instrument(engine, 'sync')
+db_metrics.instrument(async_engine.sync_engine, 'async')
+
 Base = declarative_base()
 
 def get_db():
@@ -14,4 +74,8 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
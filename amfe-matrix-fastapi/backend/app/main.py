@@ -2,6 +2,8 @@ from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from app.api.routes import router as api_router
 from app.database import engine
+from app.services.export_jobs import export_jobs
+from app.services.excel_assets import logo_cache
 from app.models import Base
 import traceback
 import logging
@@ -17,7 +19,7 @@ app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Permitir todos los orígenes temporalmente
     allow_credentials=True,
-    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+    allow_methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
     allow_headers=["*"],
     expose_headers=["*"]
 )
@@ -41,6 +43,16 @@ Base.metadata.create_all(bind=engine)
 # Incluir las rutas de la API
 app.include_router(api_router)
 
+# Cargar los logos de las exportaciones antes de atender
+@app.on_event("startup")
+def preload_export_assets():
+    logo_cache.preload()
+
+# Detener el pool de exportaciones y borrar sus resultados al apagar
+@app.on_event("shutdown")
+def shutdown_export_jobs():
+    export_jobs.shutdown()
+
 @app.get("/")
 def read_root():
     return {"message": "Bienvenido a la API de amfe-matrix!"}
\ No newline at end of file
@@ -1,5 +1,30 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, JSON, func
+from sqlalchemy import Column, Integer, Float, String, Text, DateTime, JSON, LargeBinary, ForeignKey, Index, DDL, event, func, literal_column
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import relationship
+from sqlalchemy.sql.expression import ColumnElement
+from sqlalchemy.sql.visitors import InternalTraversal
+from sqlalchemy.types import TypeDecorator
 from app.database import Base
+from app.services.document_codec import decode_document, encode_document
+
+class MatrixDocument(TypeDecorator):
+    """
+    JSON del documento de una matriz (JSONB en Postgres), comprimido por
+    encima de un umbral si MATRIX_DATA_CODEC lo pide (app/services/document_codec.py).
+    type y header quedan siempre en claro para las consultas con json_text.
+    """
+    impl = JSON
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        return dialect.type_descriptor(JSONB() if dialect.name == 'postgresql' else JSON())
+
+    def process_bind_param(self, value, dialect):
+        return encode_document(value)
+
+    def process_result_value(self, value, dialect):
+        return decode_document(value)
 
 class User(Base):
     __tablename__ = 'users'
@@ -18,8 +43,266 @@ class AMFEMatrix(Base):
     description = Column(Text, nullable=True)
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
-    data = Column(JSON, nullable=False)
+    # Contador de versión: +1 en cada escritura (matrix_service). Es el token de
+    # If-Match y de los ETags; updated_at solo tiene resolución de segundos en SQLite
+    version = Column(Integer, nullable=False, default=1, server_default='1')
+    # JSONB en Postgres (indexable, sin reparsear en cada consulta); JSON en SQLite.
+    # Los documentos grandes pueden guardarse comprimidos (MatrixDocument)
+    data = Column(MatrixDocument(), nullable=False)
     created_by = Column(Integer, nullable=True)
 
     def __repr__(self):
-        return f'<AMFEMatrix {self.name}>'
\ No newline at end of file
+        return f'<AMFEMatrix {self.name}>'
+
+
+class json_text(ColumnElement):
+    """
+    Texto de un campo de un documento JSON por su ruta, p. ej.
+    json_text(AMFEMatrix.data, 'header', 'servicio'). A diferencia de
+    data['header']['servicio'].as_string(), la ruta va como literal en el SQL
+    y no como parámetro: así la consulta coincide con el índice de expresión
+    (Postgres y SQLite no usan un índice si la ruta llega como parámetro).
+    """
+    type = String()
+    inherit_cache = True
+    _traverse_internals = [
+        ('column', InternalTraversal.dp_clauseelement),
+        ('path', InternalTraversal.dp_string_list),
+    ]
+
+    def __init__(self, column, *path: str):
+        self.column = column
+        self.path = path
+
+
+def _sql_string(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+@compiles(json_text, 'postgresql')
+def _json_text_postgresql(element, compiler, **kw):
+    keys = [_sql_string(key) for key in element.path]
+    path = ''.join(f" -> {key}" for key in keys[:-1])
+    return f"({compiler.process(element.column, **kw)}{path} ->> {keys[-1]})"
+
+
+@compiles(json_text)
+def _json_text_default(element, compiler, **kw):
+    # SQLite (JSON1): json_extract devuelve el texto sin comillas
+    path = '$' + ''.join(f'."{key}"' for key in element.path)
+    return f"json_extract({compiler.process(element.column, **kw)}, {_sql_string(path)})"
+
+
+class year_month(ColumnElement):
+    """Año y mes ('YYYY-MM') de una columna de fecha, para agrupar por mes en SQL"""
+    type = String()
+    inherit_cache = True
+    _traverse_internals = [('column', InternalTraversal.dp_clauseelement)]
+
+    def __init__(self, column):
+        self.column = column
+
+
+@compiles(year_month, 'postgresql')
+def _year_month_postgresql(element, compiler, **kw):
+    return f"to_char({compiler.process(element.column, **kw)}, 'YYYY-MM')"
+
+
+@compiles(year_month)
+def _year_month_default(element, compiler, **kw):
+    return f"strftime('%Y-%m', {compiler.process(element.column, **kw)})"
+
+
+# Campos de `data` por los que se filtra en SQL. Los filtros deben usar estas
+# mismas expresiones para que coincidan con los índices de expresión.
+matrix_type = json_text(AMFEMatrix.data, 'type')
+matrix_servicio = json_text(AMFEMatrix.data, 'header', 'servicio')
+matrix_area = json_text(AMFEMatrix.data, 'header', 'area')
+# Solo para el listado resumido y las analíticas (sin índice)
+matrix_equipo = json_text(AMFEMatrix.data, 'header', 'equipo')
+matrix_fecha_emision = json_text(AMFEMatrix.data, 'header', 'fechaEmision')
+
+Index('ix_amfe_matrices_type', matrix_type)
+Index('ix_amfe_matrices_servicio', matrix_servicio)
+Index('ix_amfe_matrices_area', matrix_area)
+# GIN (jsonb_path_ops) para consultas de contención sobre todo el documento (data @> '{...}'); solo Postgres.
+# En los documentos comprimidos solo alcanza a type y header
+Index(
+    'ix_amfe_matrices_data_gin', AMFEMatrix.data,
+    postgresql_using='gin', postgresql_ops={'data': 'jsonb_path_ops'},
+).ddl_if(dialect='postgresql')
+
+
+# ========================================
+# MATRICES MODULARES NORMALIZADAS
+# ========================================
+#
+# Copia relacional de los documentos modulares (`data.procesos`) para
+# consultar fallas sin cargar ni parsear la matriz completa. `data` sigue
+# siendo la fuente de verdad: estas tablas se reescriben en cada alta o
+# modificación de la matriz (app/services/modular_tables.py). Todas las filas
+# llevan matrix_id para borrar y filtrar por matriz sin joins. `ref` es el id
+# del elemento en el documento y `position` su orden en la lista.
+
+class MatrixProceso(Base):
+    __tablename__ = 'amfe_procesos'
+
+    id = Column(Integer, primary_key=True)
+    matrix_id = Column(Integer, ForeignKey('amfe_matrices.id', ondelete='CASCADE'), nullable=False, index=True)
+    position = Column(Integer, nullable=False)
+    ref = Column(String)
+    nombre = Column(String)
+    color = Column(String(16))
+
+    subprocesos = relationship('MatrixSubproceso', lazy='raise', order_by='MatrixSubproceso.position')
+
+class MatrixSubproceso(Base):
+    __tablename__ = 'amfe_subprocesos'
+
+    id = Column(Integer, primary_key=True)
+    matrix_id = Column(Integer, ForeignKey('amfe_matrices.id', ondelete='CASCADE'), nullable=False, index=True)
+    proceso_id = Column(Integer, ForeignKey('amfe_procesos.id', ondelete='CASCADE'), nullable=False, index=True)
+    position = Column(Integer, nullable=False)
+    ref = Column(String)
+    nombre = Column(String)
+
+    fallas = relationship('MatrixFalla', lazy='raise', order_by='MatrixFalla.position')
+
+class MatrixFalla(Base):
+    __tablename__ = 'amfe_fallas'
+
+    id = Column(Integer, primary_key=True)
+    matrix_id = Column(Integer, ForeignKey('amfe_matrices.id', ondelete='CASCADE'), nullable=False, index=True)
+    subproceso_id = Column(Integer, ForeignKey('amfe_subprocesos.id', ondelete='CASCADE'), nullable=False, index=True)
+    position = Column(Integer, nullable=False)
+    ref = Column(String)
+    descripcion = Column(Text)
+    responsable = Column(String, index=True)
+    severidad = Column(Integer, index=True)
+    detectabilidad = Column(Integer)
+    ocurrencia = Column(Integer)
+    rpn = Column(Integer, index=True)
+    tipo_riesgo = Column(String(16), index=True)  # Alto / Medio / Bajo (umbrales de modular_risk)
+    # Textos de la falla para la búsqueda: proceso, subproceso, descripción, items y responsable
+    search_text = Column(Text)
+
+    items = relationship('MatrixFallaItem', lazy='raise', order_by='MatrixFallaItem.position')
+
+class MatrixFallaItem(Base):
+    """Efectos, causas, barreras y acciones de una falla, distinguidos por `tipo`"""
+    __tablename__ = 'amfe_falla_items'
+    __table_args__ = (
+        Index('ix_amfe_falla_items_falla_tipo', 'falla_id', 'tipo'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    matrix_id = Column(Integer, ForeignKey('amfe_matrices.id', ondelete='CASCADE'), nullable=False, index=True)
+    falla_id = Column(Integer, ForeignKey('amfe_fallas.id', ondelete='CASCADE'), nullable=False)
+    tipo = Column(String(32), nullable=False)  # efecto, causa, barrera, accion_recomendada, accion_tomada
+    position = Column(Integer, nullable=False)
+    ref = Column(String)
+    descripcion = Column(Text)
+
+
+# ==================== BÚSQUEDA DE TEXTO ====================
+#
+# Postgres: índice GIN sobre to_tsvector(amfe_es, search_text), donde amfe_es
+# es la configuración 'spanish' con unaccent (sin distinguir tildes). Las
+# consultas deben usar la misma expresión (fallas_search_vector) para usar el índice.
+# SQLite: tabla FTS5 amfe_fallas_fts (contenido externo: amfe_fallas),
+# sin tildes (remove_diacritics) y mantenida por triggers.
+# En ambos casos search_text se escribe junto con las filas normalizadas.
+
+SEARCH_CONFIG = 'amfe_es'
+SEARCH_FTS_TABLE = 'amfe_fallas_fts'
+
+fallas_search_vector = func.to_tsvector(literal_column(f"'{SEARCH_CONFIG}'::regconfig"), MatrixFalla.search_text)
+
+Index('ix_amfe_fallas_search', fallas_search_vector, postgresql_using='gin').ddl_if(dialect='postgresql')
+
+SEARCH_DDL_POSTGRESQL = (
+    "CREATE EXTENSION IF NOT EXISTS unaccent",
+    f"""
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = '{SEARCH_CONFIG}') THEN
+            CREATE TEXT SEARCH CONFIGURATION {SEARCH_CONFIG} (COPY = spanish);
+            ALTER TEXT SEARCH CONFIGURATION {SEARCH_CONFIG}
+                ALTER MAPPING FOR hword, hword_part, word WITH unaccent, spanish_stem;
+        END IF;
+    END
+    $$
+    """,
+)
+
+SEARCH_DDL_SQLITE = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_FTS_TABLE} USING fts5("
+    f"search_text, content='amfe_fallas', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    f"CREATE TRIGGER IF NOT EXISTS {SEARCH_FTS_TABLE}_ai AFTER INSERT ON amfe_fallas BEGIN "
+    f"INSERT INTO {SEARCH_FTS_TABLE}(rowid, search_text) VALUES (new.id, new.search_text); END",
+    f"CREATE TRIGGER IF NOT EXISTS {SEARCH_FTS_TABLE}_ad AFTER DELETE ON amfe_fallas BEGIN "
+    f"INSERT INTO {SEARCH_FTS_TABLE}({SEARCH_FTS_TABLE}, rowid, search_text) VALUES ('delete', old.id, old.search_text); END",
+    f"CREATE TRIGGER IF NOT EXISTS {SEARCH_FTS_TABLE}_au AFTER UPDATE ON amfe_fallas BEGIN "
+    f"INSERT INTO {SEARCH_FTS_TABLE}({SEARCH_FTS_TABLE}, rowid, search_text) VALUES ('delete', old.id, old.search_text); "
+    f"INSERT INTO {SEARCH_FTS_TABLE}(rowid, search_text) VALUES (new.id, new.search_text); END",
+)
+
+# La configuración de Postgres debe existir antes que el índice; la tabla FTS5 va después de amfe_fallas
+for _statement in SEARCH_DDL_POSTGRESQL:
+    event.listen(MatrixFalla.__table__, 'before_create', DDL(_statement).execute_if(dialect='postgresql'))
+for _statement in SEARCH_DDL_SQLITE:
+    event.listen(MatrixFalla.__table__, 'after_create', DDL(_statement).execute_if(dialect='sqlite'))
+
+
+# ========================================
+# RESUMEN DE RIESGO MATERIALIZADO
+# ========================================
+#
+# Una fila por matriz modular con los totales que muestran los listados, para
+# no recorrer `data` ni agregar amfe_fallas en cada consulta. Se recalcula en
+# la misma transacción que cada escritura de la matriz
+# (app/services/risk_summary.py). Las matrices clásicas no tienen fila.
+
+class MatrixRiskSummary(Base):
+    __tablename__ = 'amfe_matrix_risk'
+
+    matrix_id = Column(Integer, ForeignKey('amfe_matrices.id', ondelete='CASCADE'), primary_key=True)
+    procesos = Column(Integer, nullable=False, default=0)
+    subprocesos = Column(Integer, nullable=False, default=0)
+    fallas = Column(Integer, nullable=False, default=0)
+    # Fallas por tipo de riesgo (umbrales de modular_risk); sin_evaluar = sin RPN
+    riesgo_alto = Column(Integer, nullable=False, default=0, index=True)
+    riesgo_medio = Column(Integer, nullable=False, default=0)
+    riesgo_bajo = Column(Integer, nullable=False, default=0)
+    sin_evaluar = Column(Integer, nullable=False, default=0)
+    max_rpn = Column(Integer, index=True)
+    mean_rpn = Column(Float)
+    acciones_recomendadas = Column(Integer, nullable=False, default=0)
+    # Acciones recomendadas sin acción tomada: por falla, recomendadas - tomadas (mínimo 0)
+    acciones_abiertas = Column(Integer, nullable=False, default=0, index=True)
+
+
+# ========================================
+# HISTORIAL DE REVISIONES
+# ========================================
+#
+# Cada escritura de una matriz agrega una revisión con el documento completo
+# (name, description, data) o con las diferencias estructurales respecto de
+# la anterior, comprimidos con zlib (app/services/revisions.py). Cada
+# REVISION_SNAPSHOT_INTERVAL revisiones se guarda el documento completo
+# (snapshot), así reconstruir cualquier revisión aplica a lo sumo ese número
+# de deltas. La revisión más reciente es siempre igual a la matriz actual.
+
+class MatrixRevision(Base):
+    __tablename__ = 'amfe_matrix_revisions'
+    __table_args__ = (
+        Index('ix_amfe_matrix_revisions_matrix_revision', 'matrix_id', 'revision', unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    matrix_id = Column(Integer, ForeignKey('amfe_matrices.id', ondelete='CASCADE'), nullable=False)
+    revision = Column(Integer, nullable=False)  # 1, 2, ... por matriz
+    kind = Column(String(8), nullable=False)    # snapshot (documento completo) o delta (cambios desde la anterior)
+    payload = Column(LargeBinary, nullable=False)  # JSON comprimido con zlib
+    created_at = Column(DateTime, server_default=func.now())
+    created_by = Column(Integer, nullable=True)
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, validator
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Literal
 from datetime import datetime
 
 class UserBase(BaseModel):
@@ -50,6 +50,31 @@ class Matrix(MatrixBase):
     class Config:
         from_attributes = True
 
+class MatrixSummary(BaseModel):
+    """Fila del listado de matrices: sin `data`, con campos del encabezado resueltos en SQL"""
+    id: int
+    name: str
+    description: Optional[str] = None
+    type: Optional[str] = None
+    servicio: Optional[str] = None
+    area: Optional[str] = None
+    equipo: Optional[str] = None
+    # Resumen de riesgo (amfe_matrix_risk): solo matrices modulares
+    max_rpn: Optional[int] = None
+    mean_rpn: Optional[float] = None
+    procesos: Optional[int] = None
+    subprocesos: Optional[int] = None
+    fallas: Optional[int] = None
+    riesgo_alto: Optional[int] = None
+    riesgo_medio: Optional[int] = None
+    riesgo_bajo: Optional[int] = None
+    sin_evaluar: Optional[int] = None
+    acciones_recomendadas: Optional[int] = None
+    acciones_abiertas: Optional[int] = None       # Recomendadas sin acción tomada
+    created_by: Optional[int] = None
+    created_at: datetime
+    updated_at: datetime
+
 # ========================================
 # Esquemas para Matriz AMFE Modular
 # ========================================
@@ -162,3 +187,200 @@ class MatrixModular(BaseModel):
 
     class Config:
         from_attributes = True
+
+class BulkImportError(BaseModel):
+    """Documento rechazado por la importación masiva"""
+    index: int                           # Posición en el cuerpo (línea NDJSON o elemento del arreglo, desde 0)
+    name: Optional[str] = None
+    errors: List[str]
+
+class BulkImportResult(BaseModel):
+    """Informe de POST /matrices/modular/import"""
+    received: int
+    imported: int
+    failed: int
+    ids: List[int]                       # Matrices creadas, en el orden del cuerpo
+    errors: List[BulkImportError]
+    errors_truncated: bool = False       # Hubo más errores que IMPORT_MAX_ERRORS
+    aborted: Optional[str] = None        # Motivo si el cuerpo dejó de poder leerse
+    elapsed_s: float
+    matrices_per_second: Optional[float] = None
+
+def _source_type(model, field: str, optional: bool = False):
+    """Tipo de un campo de los modelos de MatrixModularData (Optional si el registro puede no tenerlo)"""
+    annotation = model.model_fields[field].annotation
+    return Optional[annotation] if optional else annotation
+
+class FallaRecord(BaseModel):
+    """
+    Registro plano de una matriz modular para análisis (CSV / NDJSON / Parquet).
+    Una fila por falla e índice de sus listas de efectos, causas, barreras y
+    acciones. Los tipos salen de los modelos de MatrixModularData; los valores
+    de la lista más corta o de `data` sin validar pueden faltar (None).
+    """
+    matrix_id: int
+    matrix_name: str
+    servicio: _source_type(MatrixHeaderModular, 'servicio')
+    area: _source_type(MatrixHeaderModular, 'area')
+    equipo: _source_type(MatrixHeaderModular, 'equipo')
+    proceso_id: _source_type(Proceso, 'id')
+    proceso: _source_type(Proceso, 'nombre')
+    subproceso_id: _source_type(Subproceso, 'id')
+    subproceso: _source_type(Subproceso, 'nombre')
+    falla_id: _source_type(FallaPotencial, 'id')
+    falla: _source_type(FallaPotencial, 'descripcion')
+    indice: int                          # Posición en las listas de la falla (desde 0)
+    efecto: _source_type(EfectoPotencial, 'descripcion', optional=True) = None
+    causa: _source_type(CausaPotencial, 'descripcion', optional=True) = None
+    barrera: _source_type(BarreraExistente, 'descripcion', optional=True) = None
+    accion_recomendada: _source_type(AccionRecomendada, 'descripcion', optional=True) = None
+    accion_tomada: _source_type(AccionTomada, 'descripcion', optional=True) = None
+    responsable: _source_type(FallaPotencial, 'responsable') = None
+    severidad: _source_type(Evaluacion, 'severidad', optional=True) = None
+    detectabilidad: _source_type(Evaluacion, 'detectabilidad', optional=True) = None
+    ocurrencia: _source_type(Evaluacion, 'ocurrencia', optional=True) = None
+    rpn: _source_type(Evaluacion, 'rpn') = None
+    tipo_riesgo: Optional[str] = None    # Calculado a partir del RPN
+
+# ========================================
+# Esquemas para exportaciones en segundo plano
+# ========================================
+
+class ExportJob(BaseModel):
+    """Estado de un trabajo de exportación a Excel"""
+    id: str
+    kind: str
+    matrix_id: int
+    status: str  # pending, running, done, failed, cancelled
+    error: Optional[str] = None
+    size: Optional[int] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+class MatrixExportFilter(BaseModel):
+    """Selección de matrices a exportar: por ids y/o filtros (se combinan con AND)"""
+    ids: Optional[List[int]] = None
+    servicio: Optional[str] = None
+    area: Optional[str] = None
+    created_by: Optional[int] = None
+    created_from: Optional[datetime] = None
+    created_to: Optional[datetime] = None
+
+    def is_empty(self) -> bool:
+        return not (self.ids or self.servicio or self.area or self.created_by is not None
+                    or self.created_from or self.created_to)
+
+class BulkExportRequest(MatrixExportFilter):
+    """Exportación de varias matrices a Excel"""
+    format: Literal["zip", "workbook"] = "zip"  # zip: un .xlsx por matriz; workbook: una hoja por matriz
+    conditional: bool = False  # Color de RPN y tipo de riesgo como formato condicional
+
+class FlatExportRequest(MatrixExportFilter):
+    """Exportación plana (FallaRecord) de varias matrices modulares"""
+    format: Literal["csv", "ndjson", "parquet"] = "csv"
+
+# ========================================
+# Esquemas para analíticas de riesgo
+# ========================================
+
+class RpnBucket(BaseModel):
+    """Tramo del histograma de RPN (límites incluidos)"""
+    min: int
+    max: int
+    count: int
+
+class RiskAggregate(BaseModel):
+    """Agregados de las fallas de un conjunto de matrices (total o un grupo)"""
+    key: Optional[str] = None            # Valor del grupo (servicio, área o 'YYYY-MM'); None en el total
+    matrices: int
+    fallas: int
+    riesgo_alto: int
+    riesgo_medio: int
+    riesgo_bajo: int
+    sin_evaluar: int
+    max_rpn: Optional[int] = None
+    mean_rpn: Optional[float] = None
+    histogram: List[RpnBucket]
+
+class TopFalla(BaseModel):
+    """Falla de mayor RPN, con la matriz a la que pertenece"""
+    matrix_id: int
+    matrix_name: str
+    matrix_url: str                      # GET de la matriz modular
+    servicio: Optional[str] = None
+    area: Optional[str] = None
+    proceso: Optional[str] = None
+    subproceso: Optional[str] = None
+    falla_ref: Optional[str] = None      # id de la falla en el documento
+    descripcion: Optional[str] = None
+    responsable: Optional[str] = None
+    severidad: Optional[int] = None
+    detectabilidad: Optional[int] = None
+    ocurrencia: Optional[int] = None
+    rpn: int
+    tipo_riesgo: Optional[str] = None
+
+class RiskAnalytics(BaseModel):
+    """Analíticas de riesgo entre matrices (GET /analytics/risk)"""
+    group_by: Optional[str] = None
+    bucket_size: int
+    totals: RiskAggregate
+    groups: List[RiskAggregate]
+    top_fallas: List[TopFalla]
+    generated_at: datetime               # Momento del cálculo (la respuesta puede venir de la caché)
+
+# ========================================
+# Esquemas para búsqueda de texto
+# ========================================
+
+class SearchHit(BaseModel):
+    """Falla que coincide con una búsqueda de texto"""
+    matrix_id: int
+    matrix_name: str
+    matrix_url: str                      # GET de la matriz modular
+    servicio: Optional[str] = None
+    area: Optional[str] = None
+    proceso: Optional[str] = None
+    subproceso: Optional[str] = None
+    falla_ref: Optional[str] = None      # id de la falla en el documento
+    falla: Optional[str] = None
+    path: str                            # proceso → subproceso → falla
+    rpn: Optional[int] = None
+    tipo_riesgo: Optional[str] = None
+    rank: float                          # Mayor = más relevante (solo comparable dentro de una búsqueda)
+    snippet: Optional[str] = None        # Fragmento con los términos entre <b></b>
+
+# ========================================
+# Esquemas para el historial de revisiones
+# ========================================
+
+class MatrixRevisionInfo(BaseModel):
+    """Revisión de una matriz en el listado del historial"""
+    revision: int
+    kind: Literal['snapshot', 'delta']   # Documento completo o cambios desde la anterior
+    size: int                            # Bytes guardados (comprimidos)
+    created_at: Optional[datetime] = None
+    created_by: Optional[int] = None
+
+class MatrixRevisionDocument(MatrixRevisionInfo):
+    """Documento reconstruido de una revisión"""
+    name: str
+    description: Optional[str] = None
+    data: Dict[str, Any]
+
+class MatrixRevisionChange(BaseModel):
+    """Cambio entre dos revisiones (ver app/services/revisions.py)"""
+    op: Literal['add', 'remove', 'replace', 'order']
+    path: str                            # JSON Pointer; en listas con id, el id del elemento
+    value: Optional[Any] = None          # Valor nuevo (en order, los ids en el nuevo orden)
+    old: Optional[Any] = None            # Valor anterior (remove y replace)
+
+class MatrixRevisionDiff(BaseModel):
+    """Diferencias entre dos revisiones de una matriz"""
+    matrix_id: int
+    from_revision: int
+    to_revision: int
+    changes: List[MatrixRevisionChange]
@@ -0,0 +1,217 @@
+"""
+Analíticas de riesgo entre matrices (GET /analytics/risk).
+
+Todo se agrega en SQL sobre las tablas normalizadas (amfe_fallas con su
+matriz, subproceso y proceso), con los mismos filtros que los listados
+(filter_matrices): totales por tipo de riesgo, histograma de RPN, los mismos
+agregados por servicio, área o mes y las N fallas de mayor RPN. Los
+resultados se cachean unos segundos (ANALYTICS_CACHE_TTL), así que un
+tablero que se refresca seguido no repite las consultas.
+"""
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional
+import os
+import threading
+import time
+
+from sqlalchemy import Integer, case, func, literal_column, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import (
+    AMFEMatrix, MatrixFalla, MatrixSubproceso, MatrixProceso,
+    matrix_servicio, matrix_area, matrix_fecha_emision, year_month,
+)
+from app.services.matrix_service import filter_matrices
+
+ANALYTICS_CACHE_TTL = float(os.getenv("ANALYTICS_CACHE_TTL", "60"))
+ANALYTICS_CACHE_MAX_ENTRIES = int(os.getenv("ANALYTICS_CACHE_MAX_ENTRIES", "256"))
+ANALYTICS_MAX_TOP = 100
+
+MAX_RPN = 125  # 5 x 5 x 5
+
+# Las constantes de las expresiones agrupadas van como literales: en Postgres
+# un GROUP BY con parámetros distintos a los del SELECT no coincide con la columna
+_ONE = literal_column('1', Integer)
+
+# Mes de una matriz: el de la fecha de emisión del encabezado o, si no tiene, el de creación
+_matrix_month = func.coalesce(
+    func.nullif(func.substr(matrix_fecha_emision, _ONE, literal_column('7')), literal_column("''")),
+    year_month(AMFEMatrix.created_at),
+)
+
+GROUP_EXPRESSIONS = {
+    'servicio': matrix_servicio,
+    'area': matrix_area,
+    'month': _matrix_month,
+}
+
+
+class AnalyticsCache:
+    """Caché en memoria de resultados con vencimiento (TTL) y tamaño acotado (LRU)"""
+
+    def __init__(self, ttl: float = ANALYTICS_CACHE_TTL, max_entries: int = ANALYTICS_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value: dict):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "ttl_s": self.ttl, "hits": self.hits, "misses": self.misses}
+
+
+analytics_cache = AnalyticsCache()
+
+
+# ==================== CONSULTAS ====================
+
+def _fallas_query(columns, min_rpn: Optional[int], **filters):
+    """select() de columnas sobre amfe_fallas unida a su matriz, con los filtros de las matrices"""
+    query = select(*columns).select_from(MatrixFalla).join(AMFEMatrix, AMFEMatrix.id == MatrixFalla.matrix_id)
+    if min_rpn is not None:
+        query = query.where(MatrixFalla.rpn >= min_rpn)
+    return filter_matrices(query, **filters).order_by(None)
+
+
+def _count_tipo(tipo: str):
+    return func.sum(case((MatrixFalla.tipo_riesgo == tipo, 1), else_=0))
+
+
+_AGGREGATES = (
+    func.count(func.distinct(MatrixFalla.matrix_id)).label('matrices'),
+    func.count(MatrixFalla.id).label('fallas'),
+    _count_tipo('Alto').label('riesgo_alto'),
+    _count_tipo('Medio').label('riesgo_medio'),
+    _count_tipo('Bajo').label('riesgo_bajo'),
+    func.sum(case((MatrixFalla.rpn.is_(None), 1), else_=0)).label('sin_evaluar'),
+    func.max(MatrixFalla.rpn).label('max_rpn'),
+    func.avg(MatrixFalla.rpn).label('mean_rpn'),
+)
+
+
+def _aggregate(row, key=None) -> dict:
+    values = row._asdict()
+    mean = values['mean_rpn']
+    return {
+        'key': key,
+        'matrices': values['matrices'] or 0,
+        'fallas': values['fallas'] or 0,
+        'riesgo_alto': values['riesgo_alto'] or 0,
+        'riesgo_medio': values['riesgo_medio'] or 0,
+        'riesgo_bajo': values['riesgo_bajo'] or 0,
+        'sin_evaluar': values['sin_evaluar'] or 0,
+        'max_rpn': values['max_rpn'],
+        'mean_rpn': round(float(mean), 2) if mean is not None else None,
+        'histogram': [],
+    }
+
+
+def _empty_histogram(bucket_size: int) -> List[dict]:
+    return [
+        {'min': start, 'max': min(start + bucket_size - 1, MAX_RPN), 'count': 0}
+        for start in range(1, MAX_RPN + 1, bucket_size)
+    ]
+
+
+async def compute_risk_analytics(db: AsyncSession, group_by: Optional[str] = None, top: int = 10,
+                                 bucket_size: int = 25, min_rpn: Optional[int] = None, **filters) -> dict:
+    """
+    Agregados de riesgo de las fallas de las matrices que cumplen `filters`
+    (ver filter_matrices): totales, histograma de RPN en tramos de
+    `bucket_size`, los mismos agregados por `group_by` ('servicio', 'area' o
+    'month') y las `top` fallas de mayor RPN con el id de su matriz.
+    """
+    group = GROUP_EXPRESSIONS[group_by].label('key') if group_by else None
+    bucket = ((MatrixFalla.rpn - _ONE) // literal_column(str(int(bucket_size)), Integer)).label('bucket')
+
+    totals_row = (await db.execute(_fallas_query(_AGGREGATES, min_rpn, **filters))).one()
+    totals = _aggregate(totals_row)
+    totals['histogram'] = _empty_histogram(bucket_size)
+
+    groups: Dict[object, dict] = {}
+    if group is not None:
+        query = _fallas_query((group, *_AGGREGATES), min_rpn, **filters).group_by(group).order_by(group)
+        for row in await db.execute(query):
+            groups[row.key] = _aggregate(row, row.key)
+            groups[row.key]['histogram'] = _empty_histogram(bucket_size)
+
+    # Histograma (total y por grupo) en una sola consulta
+    histogram_columns = (group, bucket) if group is not None else (bucket,)
+    query = (
+        _fallas_query((*histogram_columns, func.count(MatrixFalla.id).label('count')), min_rpn, **filters)
+        .where(MatrixFalla.rpn.between(1, MAX_RPN))
+        .group_by(*histogram_columns)
+    )
+    for row in await db.execute(query):
+        totals['histogram'][row.bucket]['count'] += row.count
+        if group is not None:
+            groups[row.key]['histogram'][row.bucket]['count'] += row.count
+
+    top_fallas = []
+    if top:
+        query = (
+            _fallas_query((
+                MatrixFalla.matrix_id, AMFEMatrix.name.label('matrix_name'),
+                matrix_servicio.label('servicio'), matrix_area.label('area'),
+                MatrixProceso.nombre.label('proceso'), MatrixSubproceso.nombre.label('subproceso'),
+                MatrixFalla.ref.label('falla_ref'), MatrixFalla.descripcion, MatrixFalla.responsable,
+                MatrixFalla.severidad, MatrixFalla.detectabilidad, MatrixFalla.ocurrencia,
+                MatrixFalla.rpn, MatrixFalla.tipo_riesgo,
+            ), min_rpn, **filters)
+            .join(MatrixSubproceso, MatrixSubproceso.id == MatrixFalla.subproceso_id)
+            .join(MatrixProceso, MatrixProceso.id == MatrixSubproceso.proceso_id)
+            .where(MatrixFalla.rpn.isnot(None))
+            .order_by(MatrixFalla.rpn.desc(), MatrixFalla.severidad.desc(), MatrixFalla.matrix_id, MatrixFalla.id)
+            .limit(top)
+        )
+        top_fallas = [
+            {**row._asdict(), 'matrix_url': f"/matrices/modular/{row.matrix_id}"}
+            for row in await db.execute(query)
+        ]
+
+    return {
+        'group_by': group_by,
+        'bucket_size': bucket_size,
+        'totals': totals,
+        'groups': list(groups.values()),
+        'top_fallas': top_fallas,
+        'generated_at': datetime.utcnow(),
+    }
+
+
+async def get_risk_analytics(db: AsyncSession, **params) -> dict:
+    """compute_risk_analytics con la caché de resultados (clave: todos los parámetros)"""
+    key = tuple(sorted((name, tuple(value) if isinstance(value, list) else value) for name, value in params.items()))
+    result = analytics_cache.get(key)
+    if result is None:
+        result = await compute_risk_analytics(db, **params)
+        analytics_cache.set(key, result)
+    return result
@@ -1,12 +1,14 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 import bcrypt
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
 from fastapi import HTTPException, Depends, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from app.models import User
 from app.schemas import UserCreate
-from app.database import get_db
+from app.database import get_async_db
 import os
 
 # Configuración JWT
@@ -47,27 +49,29 @@ def test_password_hash(password: str) -> bool:
     print(f"DEBUG TEST: Password '{password}' -> Hash correcto: {verified}")
     return verified
 
-def register_user(db: Session, user: UserCreate):
-    existing_user = db.query(User).filter(
+# bcrypt es CPU a propósito (~0,25 s por hash): corre en el threadpool para no bloquear el event loop
+
+async def register_user(db: AsyncSession, user: UserCreate):
+    existing_user = await db.scalar(select(User).where(
         (User.username == user.username) | (User.email == user.email)
-    ).first()
+    ).limit(1))
 
     if existing_user:
         return None
 
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await run_in_threadpool(get_password_hash, user.password)
     new_user = User(username=user.username, email=user.email, password=hashed_password, role=user.role)
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
     return new_user
 
-def verify_user(db: Session, username: str, password: str):
+async def verify_user(db: AsyncSession, username: str, password: str):
     print(f"DEBUG: Intentando login con username: {username}")
-    user = db.query(User).filter_by(username=username).first()
+    user = await get_user(db, username)
     if user:
         print(f"DEBUG: Usuario encontrado: {user.username}")
-        password_match = verify_password(password, user.password)
+        password_match = await run_in_threadpool(verify_password, password, user.password)
         print(f"DEBUG: Contraseña coincide: {password_match}")
         if password_match:
             return user
@@ -78,8 +82,8 @@ def verify_user(db: Session, username: str, password: str):
         print("DEBUG: Usuario no encontrado")
         return None
 
-def get_user(db: Session, username: str):
-    return db.query(User).filter_by(username=username).first()
+async def get_user(db: AsyncSession, username: str):
+    return await db.scalar(select(User).filter_by(username=username).limit(1))
 
 def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Verificar y decodificar el token JWT"""
@@ -105,10 +109,10 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-def get_current_user(username: str = Depends(verify_token), db: Session = Depends(get_db)):
+async def get_current_user(username: str = Depends(verify_token), db: AsyncSession = Depends(get_async_db)):
     """Obtener el usuario actual a partir del token"""
     print(f"DEBUG: Buscando usuario: {username}")
-    user = get_user(db, username)
+    user = await get_user(db, username)
     if user is None:
         print(f"DEBUG: Usuario no encontrado: {username}")
         raise HTTPException(
@@ -118,7 +122,7 @@ def get_current_user(username: str = Depends(verify_token), db: Session = Depend
     print(f"DEBUG: Usuario encontrado: {user.username} ({user.role})")
     return user
 
-def get_current_admin_user(current_user: User = Depends(get_current_user)):
+async def get_current_admin_user(current_user: User = Depends(get_current_user)):
     """Verificar que el usuario current es administrador"""
     if current_user.role != "admin":
         raise HTTPException(
@@ -0,0 +1,184 @@
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import IO, Iterator, List, NamedTuple, Tuple
+import os
+import tempfile
+import time
+import zipfile
+
+from app.models import AMFEMatrix
+from app.services.chunk_sink import ChunkSink
+from app.services.export_cache import export_cache, ExportKey
+from app.services.export_jobs import export_jobs, render_to_path
+from app.services.matrix_service import (
+    export_kind, export_filename, export_cache_key, render_multi_sheet_file, iter_file_chunks
+)
+
+# Máximo de matrices por exportación masiva
+EXPORT_BULK_MAX_MATRICES = int(os.getenv("EXPORT_BULK_MAX_MATRICES", "500"))
+
+ZIP_MEDIA_TYPE = "application/zip"
+
+
+class BulkPart(NamedTuple):
+    """Una matriz de la exportación masiva, sin depender de la sesión de BD"""
+    matrix_id: int
+    kind: str
+    filename: str
+    title: str
+    data: dict
+    cache_key: ExportKey
+    conditional: bool = False
+
+
+def bulk_export_parts(matrices: List[AMFEMatrix], conditional: bool = False) -> List[BulkPart]:
+    """Extraer de las matrices lo necesario para exportarlas fuera de la petición"""
+    parts = []
+    for matrix in matrices:
+        kind = export_kind(matrix)
+        parts.append(BulkPart(
+            matrix_id=matrix.id,
+            kind=kind,
+            filename=export_filename(matrix, kind),
+            title=f"{matrix.id} {matrix.name}",
+            data=matrix.data,
+            cache_key=export_cache_key(matrix, kind, conditional),
+            conditional=conditional,
+        ))
+    return parts
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _temp_path() -> str:
+    fd, path = tempfile.mkstemp(prefix="amfe-bulk-", suffix=".xlsx")
+    os.close(fd)
+    return path
+
+
+# ==================== ZIP ====================
+
+def _zip_entry(zf: zipfile.ZipFile, sink: ChunkSink, name: str, file: IO[bytes]) -> Iterator[bytes]:
+    # Los .xlsx ya vienen comprimidos: se guardan sin recomprimir
+    info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+    info.compress_type = zipfile.ZIP_STORED
+    with zf.open(info, 'w') as entry:
+        for chunk in iter_file_chunks(file):
+            entry.write(chunk)
+            data = sink.drain()
+            if data:
+                yield data
+    data = sink.drain()
+    if data:
+        yield data
+
+
+def iter_bulk_zip(parts: List[BulkPart]) -> Iterator[bytes]:
+    """
+    ZIP con un .xlsx por matriz. Las matrices que no están en la caché se
+    renderizan en paralelo en el pool de export_jobs y cada una se agrega
+    al ZIP (y se envía) en cuanto termina, en orden de llegada. Solo hay
+    tantos renders en vuelo como workers tiene el pool: el siguiente se
+    encola cuando termina uno, así una exportación masiva no llena la cola
+    del pool. Las que fallan se listan en ERRORES.txt al final del archivo.
+    """
+    sink = ChunkSink()
+    cached = []
+    to_render = deque()
+    futures = {}
+    errors = []
+
+    def submit_next():
+        part = to_render.popleft()
+        path = _temp_path()
+        futures[export_jobs.run(render_to_path, part.kind, part.data, path, part.conditional)] = (part, path)
+
+    try:
+        for part in parts:
+            file = export_cache.open(part.cache_key)
+            if file is not None:
+                cached.append((part, file))
+            else:
+                to_render.append(part)
+        while to_render and len(futures) < export_jobs.max_workers:
+            submit_next()
+
+        with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED, allowZip64=True) as zf:
+            while cached:
+                part, file = cached.pop(0)
+                yield from _zip_entry(zf, sink, part.filename, file)
+
+            while futures:
+                done, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+                for future in done:
+                    part, path = futures.pop(future)
+                    if to_render:
+                        submit_next()
+                    try:
+                        future.result()
+                    except Exception as e:
+                        errors.append(f"{part.filename}: {type(e).__name__} {e}".rstrip())
+                        _remove(path)
+                        continue
+                    try:
+                        with open(path, 'rb') as file:
+                            export_cache.put_file(part.cache_key, file)
+                        yield from _zip_entry(zf, sink, part.filename, open(path, 'rb'))
+                    finally:
+                        _remove(path)
+
+            if errors:
+                zf.writestr("ERRORES.txt", "No se pudieron exportar:\n" + "\n".join(errors) + "\n")
+        yield sink.drain()
+    finally:
+        # Cliente desconectado o error: no dejar trabajos ni archivos huérfanos
+        for part, file in cached:
+            file.close()
+        for future, (part, path) in futures.items():
+            future.cancel()
+            future.add_done_callback(lambda f, path=path: _remove(path))
+
+
+# ==================== WORKBOOK MULTI-HOJA ====================
+
+def render_workbook_to_path(items, path: str, conditional: bool = False) -> int:
+    """Se ejecuta en un proceso del pool: un workbook con una hoja por matriz"""
+    try:
+        with open(path, 'w+b') as f:
+            render_multi_sheet_file(items, f, conditional)
+        return os.path.getsize(path)
+    except BaseException:
+        _remove(path)
+        raise
+
+
+def submit_bulk_workbook(parts: List[BulkPart]) -> Tuple[Future, str]:
+    """
+    Encolar el workbook multi-hoja en el pool. Todas las hojas van al mismo
+    archivo, así que se renderiza en un solo worker: el paralelismo entre
+    núcleos aplica a la exportación en ZIP. Devuelve (futuro, ruta).
+    """
+    path = _temp_path()
+    items = [(part.kind, part.title, part.data) for part in parts]
+    conditional = any(part.conditional for part in parts)
+    future = export_jobs.run(render_workbook_to_path, items, path, conditional)
+    return future, path
+
+
+def discard_bulk_workbook(future: Future, path: str):
+    """Abandonar un workbook de submit_bulk_workbook (p. ej. cliente desconectado) sin dejar su archivo"""
+    future.cancel()
+    future.add_done_callback(lambda f: _remove(path))
+
+
+def iter_rendered_file(path: str) -> Iterator[bytes]:
+    """Enviar un archivo ya renderizado por bloques y borrarlo al terminar"""
+    try:
+        yield from iter_file_chunks(open(path, 'rb'))
+    finally:
+        _remove(path)
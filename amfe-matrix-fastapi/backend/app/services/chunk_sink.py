@@ -0,0 +1,31 @@
+class ChunkSink:
+    """
+    Archivo de solo escritura que acumula bytes para ir cediéndolos en una
+    respuesta en streaming (ZIP de bulk_export, Parquet de flat_export).
+    Tiene tell() pero no seek(): ZipFile lo trata como no posicionable y
+    escribe en modo streaming (descriptores de datos tras cada entrada).
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
@@ -0,0 +1,224 @@
+from bisect import bisect_left
+from typing import Dict, Optional, Tuple
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+logger = logging.getLogger(__name__)
+
+# Sentencias más lentas que esto (ms) se registran con logger.warning; 0 = nunca
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "500"))
+
+# GET /health/db: tiempo máximo del SELECT 1 (s) y ocupación del pool a partir de la cual se informa "degraded"
+DB_HEALTH_TIMEOUT = float(os.getenv("DB_HEALTH_TIMEOUT", "2"))
+DB_HEALTH_SATURATION = float(os.getenv("DB_HEALTH_SATURATION", "0.9"))
+
+# Límites superiores (ms) de los buckets de los histogramas; el último bucket es +inf
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Tipos de sentencia que se miden por separado; el resto va a OTHER y las que fallan, a ERROR
+STATEMENT_KINDS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE')
+ERROR_KIND = 'ERROR'
+
+
+class Histogram:
+    """Histograma de latencias con buckets fijos (en ms), seguro entre hilos"""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, ms: float):
+        i = bisect_left(self.buckets, ms)
+        with self._lock:
+            self._counts[i] += 1
+            self._count += 1
+            self._sum += ms
+            if ms > self._max:
+                self._max = ms
+
+    def _quantile(self, counts, count: int, q: float) -> Optional[float]:
+        # Límite superior del bucket donde cae el cuantil (el máximo observado si es el último)
+        if not count:
+            return None
+        target = q * count
+        seen = 0
+        for i, n in enumerate(counts):
+            seen += n
+            if seen >= target:
+                return self.buckets[i] if i < len(self.buckets) else self._max
+        return self._max
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counts, count, total, maximum = list(self._counts), self._count, self._sum, self._max
+        labels = [f"le_{b}" for b in self.buckets] + ["le_inf"]
+        return {
+            "count": count,
+            "mean_ms": total / count if count else None,
+            "max_ms": maximum if count else None,
+            "p50_ms": self._quantile(counts, count, 0.50),
+            "p95_ms": self._quantile(counts, count, 0.95),
+            "p99_ms": self._quantile(counts, count, 0.99),
+            # Acumulados, como los buckets de Prometheus
+            "buckets": dict(zip(labels, _cumulative(counts))),
+        }
+
+
+def _cumulative(counts):
+    total = 0
+    for n in counts:
+        total += n
+        yield total
+
+
+def _statement_kind(statement: str) -> str:
+    words = statement.lstrip().split(None, 1)
+    kind = words[0].upper() if words else ''
+    return kind if kind in STATEMENT_KINDS else 'OTHER'
+
+
+class DBMetrics:
+    """
+    Latencia por sentencia y espera para obtener una conexión del pool, por
+    motor ('sync', 'async'). instrument() engancha los eventos de SQLAlchemy
+    a un motor; los pools creados con timed_pool_class() informan la espera
+    del checkout.
+    """
+
+    def __init__(self):
+        self._statements: Dict[Tuple[str, str], Histogram] = {}
+        self._checkouts: Dict[str, Histogram] = {}
+        self._timeouts: Dict[str, int] = {}
+        self._engines = {}
+        self._lock = threading.Lock()
+
+    def instrument(self, engine, name: str):
+        """Medir las sentencias de `engine` (para un AsyncEngine, pasar engine.sync_engine)"""
+        self._engines[name] = engine
+        event.listen(engine, "before_cursor_execute", self._before_execute)
+        event.listen(engine, "after_cursor_execute", self._after_execute(name))
+        event.listen(engine, "handle_error", self._handle_error(name))
+
+    def observe_statement(self, engine_name: str, kind: str, ms: float):
+        self._histogram(self._statements, (engine_name, kind)).observe(ms)
+
+    def observe_checkout(self, engine_name: str, ms: float):
+        self._histogram(self._checkouts, engine_name).observe(ms)
+
+    def observe_checkout_timeout(self, engine_name: str):
+        with self._lock:
+            self._timeouts[engine_name] = self._timeouts.get(engine_name, 0) + 1
+
+    def pool_status(self, name: str) -> dict:
+        """Ocupación del pool de un motor; saturation = conexiones en uso / máximo posible"""
+        pool = self._engines[name].pool
+        status = {"pool": type(pool).__name__}
+        if isinstance(pool, QueuePool):
+            capacity = pool.size() + max(pool._max_overflow, 0)
+            checked_out = pool.checkedout()
+            status.update({
+                "size": pool.size(),
+                "max_overflow": pool._max_overflow,
+                "timeout": pool.timeout(),
+                "checked_out": checked_out,
+                "checked_in": pool.checkedin(),
+                "overflow": max(pool.overflow(), 0),
+                "saturation": checked_out / capacity if capacity else None,
+                "checkout_timeouts": self._timeouts.get(name, 0),
+            })
+        return status
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            statements = dict(self._statements)
+            checkouts = dict(self._checkouts)
+        return {
+            name: {
+                "pool": self.pool_status(name),
+                "checkout_wait": checkouts[name].snapshot() if name in checkouts else Histogram().snapshot(),
+                "statements": {
+                    kind: histogram.snapshot()
+                    for (engine_name, kind), histogram in sorted(statements.items())
+                    if engine_name == name
+                },
+            }
+            for name in self._engines
+        }
+
+    # ==================== INTERNOS ====================
+
+    def _histogram(self, histograms: dict, key) -> Histogram:
+        histogram = histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = histograms.setdefault(key, Histogram())
+        return histogram
+
+    @staticmethod
+    def _before_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    def _after_execute(self, name: str):
+        def after_execute(conn, cursor, statement, parameters, context, executemany):
+            starts = conn.info.get('query_start')
+            if not starts:
+                return
+            ms = (time.perf_counter() - starts.pop()) * 1000
+            self.observe_statement(name, _statement_kind(statement), ms)
+            if DB_SLOW_QUERY_MS and ms >= DB_SLOW_QUERY_MS:
+                logger.warning("Sentencia lenta (%.0f ms, %s): %s", ms, name, statement[:500])
+        return after_execute
+
+    def _handle_error(self, name: str):
+        def handle_error(exception_context):
+            # Solo los errores al ejecutar una sentencia pasaron por before_cursor_execute
+            # (no los de conexión); sin sacar su inicio, la lista de conn.info crecería con cada fallo
+            conn = exception_context.connection
+            if conn is None or exception_context.execution_context is None:
+                return
+            starts = conn.info.get('query_start')
+            if not starts:
+                return
+            ms = (time.perf_counter() - starts.pop()) * 1000
+            self.observe_statement(name, ERROR_KIND, ms)
+        return handle_error
+
+
+# Instancia compartida por el proceso
+db_metrics = DBMetrics()
+
+
+class _TimedPoolMixin:
+    """Mide cuánto espera cada checkout por una conexión libre (incluye abrir una nueva)"""
+
+    _metrics_name = None
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            db_metrics.observe_checkout_timeout(self._metrics_name)
+            raise
+        finally:
+            db_metrics.observe_checkout(self._metrics_name, (time.perf_counter() - start) * 1000)
+
+
+def timed_pool_class(name: str, is_async: bool = False):
+    """
+    Clase de pool (QueuePool o su variante async) que informa a db_metrics con
+    el nombre `name`. El nombre va en la clase porque engine.dispose() crea
+    un pool nuevo de la misma clase.
+    """
+    base = AsyncAdaptedQueuePool if is_async else QueuePool
+    return type(f"Timed{base.__name__}", (_TimedPoolMixin, base), {'_metrics_name': name})
@@ -0,0 +1,155 @@
+"""
+Compresión opcional de los documentos de las matrices (AMFEMatrix.data).
+
+Con MATRIX_DATA_CODEC=zlib o zstd, un documento cuyo JSON supera
+MATRIX_DATA_COMPRESS_THRESHOLD bytes se guarda como:
+
+    {"type": ..., "header": {...}, "$compressed": {"codec": "zlib", "size": 123456, "payload": "<base64>"}}
+
+`type` y `header` quedan en claro porque los leen en SQL los filtros, los
+índices de expresión y los listados (json_text); el resto (procesos, filas de
+las matrices clásicas) va comprimido en `payload`. La columna sigue siendo
+JSON (JSONB en Postgres). El tipo MatrixDocument de app/models.py comprime al
+escribir y descomprime al leer, así que el resto del código ve siempre el
+documento completo. Los documentos comprimidos se leen con cualquier
+configuración (también con MATRIX_DATA_CODEC=none).
+
+Las filas existentes se reescriben con la configuración actual con
+recompress_documents (migración 0006 o recompress_matrices.py).
+"""
+from typing import Optional
+import base64
+import json
+import logging
+import os
+
+from sqlalchemy import JSON, column, select, table, update
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+CODECS = ('none', 'zlib', 'zstd')
+
+MATRIX_DATA_CODEC = os.getenv("MATRIX_DATA_CODEC", "none").lower()
+MATRIX_DATA_COMPRESS_THRESHOLD = int(os.getenv("MATRIX_DATA_COMPRESS_THRESHOLD", str(64 * 1024)))
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+COMPRESSED_KEY = '$compressed'
+# Claves que se guardan sin comprimir (las consultas las leen en SQL)
+PLAIN_KEYS = ('type', 'header')
+
+
+class DocumentCodecError(Exception):
+    """Documento comprimido que no se puede leer (códec desconocido o no instalado)"""
+
+
+def zstd_available() -> bool:
+    """zstd necesita el paquete zstandard, que es opcional"""
+    try:
+        import zstandard  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+if MATRIX_DATA_CODEC not in CODECS:
+    raise ValueError(f"MATRIX_DATA_CODEC must be one of: {', '.join(CODECS)}")
+if MATRIX_DATA_CODEC == 'zstd' and not zstd_available():
+    logger.warning("MATRIX_DATA_CODEC=zstd pero zstandard no está instalado: se usa zlib")
+    MATRIX_DATA_CODEC = 'zlib'
+
+
+def _compress(codec: str, raw: bytes) -> bytes:
+    if codec == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+    import zlib
+    return zlib.compress(raw, ZLIB_LEVEL)
+
+
+def _decompress(codec: str, payload: bytes) -> bytes:
+    if codec == 'zlib':
+        import zlib
+        return zlib.decompress(payload)
+    if codec == 'zstd':
+        if not zstd_available():
+            raise DocumentCodecError("Document is compressed with zstd but zstandard is not installed")
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(payload)
+    raise DocumentCodecError(f"Unknown document codec '{codec}'")
+
+
+def is_compressed(value) -> bool:
+    return isinstance(value, dict) and COMPRESSED_KEY in value
+
+
+def encode_document(data, codec: Optional[str] = None, threshold: Optional[int] = None):
+    """
+    Valor a guardar en la columna: `data` tal cual, o comprimido si el códec
+    no es none y el JSON de la parte comprimible supera el umbral. Un valor
+    ya comprimido se devuelve sin cambios.
+    """
+    codec = codec or MATRIX_DATA_CODEC
+    threshold = MATRIX_DATA_COMPRESS_THRESHOLD if threshold is None else threshold
+    if codec == 'none' or not isinstance(data, dict) or is_compressed(data):
+        return data
+    rest = {key: value for key, value in data.items() if key not in PLAIN_KEYS}
+    raw = json.dumps(rest, ensure_ascii=False, separators=(',', ':')).encode()
+    if len(raw) <= threshold:
+        return data
+    envelope = {key: data[key] for key in PLAIN_KEYS if key in data}
+    envelope[COMPRESSED_KEY] = {
+        "codec": codec,
+        "size": len(raw),
+        "payload": base64.b64encode(_compress(codec, raw)).decode('ascii'),
+    }
+    return envelope
+
+
+def decode_document(value):
+    """Documento completo a partir del valor guardado (de encode_document)"""
+    if not is_compressed(value):
+        return value
+    compressed = value[COMPRESSED_KEY]
+    rest = json.loads(_decompress(compressed["codec"], base64.b64decode(compressed["payload"])))
+    document = {key: item for key, item in value.items() if key != COMPRESSED_KEY}
+    document.update(rest)
+    return document
+
+
+# ==================== REESCRITURA (sync) ====================
+
+# amfe_matrices con `data` como JSON sin el tipo MatrixDocument: lee y escribe el valor guardado tal cual
+_stored_matrices = table(
+    'amfe_matrices', column('id'), column('data', JSON().with_variant(JSONB(), 'postgresql')),
+)
+
+
+def recompress_documents(db: Session, codec: Optional[str] = None, threshold: Optional[int] = None,
+                         batch_size: int = 100) -> dict:
+    """
+    Reescribir el `data` de todas las matrices con `codec` y `threshold` (por
+    defecto, la configuración actual); codec='none' descomprime todo. Solo se
+    escriben las filas cuyo valor guardado cambia, sin tocar updated_at (el
+    documento es el mismo y los ETags siguen valiendo), con un commit por lote.
+    """
+    codec = codec or MATRIX_DATA_CODEC
+    report = {"matrices": 0, "rewritten": 0, "compressed": 0}
+    ids = db.scalars(select(_stored_matrices.c.id).order_by(_stored_matrices.c.id)).all()
+    for i in range(0, len(ids), batch_size):
+        rows = db.execute(
+            select(_stored_matrices.c.id, _stored_matrices.c.data).where(_stored_matrices.c.id.in_(ids[i:i + batch_size]))
+        ).all()
+        for matrix_id, stored in rows:
+            value = encode_document(decode_document(stored), codec, threshold)
+            report["compressed"] += is_compressed(value)
+            if value != stored:
+                db.execute(update(_stored_matrices).where(_stored_matrices.c.id == matrix_id).values(data=value))
+                report["rewritten"] += 1
+        db.commit()
+        report["matrices"] += len(rows)
+        logger.info("Recompresión de documentos (%s): %d/%d matrices", codec, report["matrices"], len(ids))
+    return report
+
@@ -0,0 +1,62 @@
+from typing import Optional
+import hashlib
+
+# Las respuestas con ETag se pueden guardar en el navegador, pero siempre se
+# revalidan (If-None-Match) antes de reusarlas
+REVALIDATE_CACHE_CONTROL = "private, no-cache"
+
+
+def matrix_etag(matrix) -> str:
+    """
+    ETag fuerte de una matriz (o de una fila con id y version, ver
+    get_matrix_version): cambia con cada escritura porque `version` se
+    incrementa en cada UPDATE. No se usa updated_at: en SQLite tiene
+    resolución de segundos y dos escrituras en el mismo segundo no lo cambian.
+    """
+    return f'"{matrix.id}-{matrix.version}"'
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """
+    Comparación fuerte de If-Match: `*` o alguno de los ETags de la lista.
+    Los ETags débiles (W/) no coinciden nunca.
+    """
+    if not header:
+        return False
+    candidates = [candidate.strip() for candidate in header.split(',')]
+    return '*' in candidates or etag in candidates
+
+
+def etag_matches_weak(header: Optional[str], etag: str) -> bool:
+    """
+    Comparación débil de If-None-Match: W/"x" coincide con "x" y `*` con
+    cualquier versión existente
+    """
+    if not header:
+        return False
+    def opaque(tag: str) -> str:
+        tag = tag.strip()
+        return tag[2:] if tag.startswith('W/') else tag
+    candidates = [opaque(candidate) for candidate in header.split(',')]
+    return '*' in candidates or opaque(etag) in candidates
+
+
+def collection_etag(resource: str, count: int, version_sum, max_id) -> str:
+    """
+    ETag de un listado: la URL (filtros y paginación) y la cantidad, la suma
+    de los `version` y el mayor id de las matrices que cumplen los filtros.
+    Editar una matriz del conjunto incrementa la suma (aunque sea en el mismo
+    segundo que la lectura anterior); crear o borrar cambia la cantidad.
+    """
+    digest = hashlib.sha1(f"{resource}|{count}|{version_sum or 0}|{max_id}".encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def export_etag(cache_key: tuple, stream: bool) -> str:
+    """
+    ETag débil de una exportación, a partir de la clave de caché
+    (export_cache_key) y del modo: dos renders de la misma versión son
+    equivalentes pero no idénticos byte a byte (fechas dentro del .xlsx)
+    """
+    digest = hashlib.sha1(repr((cache_key, stream)).encode()).hexdigest()
+    return f'W/"{digest}"'
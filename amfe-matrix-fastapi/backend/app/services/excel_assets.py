@@ -0,0 +1,148 @@
+from io import BytesIO
+from typing import Dict, Optional, Tuple
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from openpyxl.drawing.image import Image
+
+logger = logging.getLogger(__name__)
+
+# Configuración de los logos de las exportaciones
+EXPORT_ASSETS_DIR = os.getenv(
+    "EXPORT_ASSETS_DIR",
+    os.path.join(os.path.dirname(__file__), '..', '..', 'assets')
+)
+EXPORT_DEFAULT_LOGO = os.getenv("EXPORT_DEFAULT_LOGO", "club.jpg")  # Vacío = sin logo por defecto
+# Logo por fundación, p. ej. {"Fundación Clínica Infantil Club Noel": "club.jpg"}; rutas relativas a EXPORT_ASSETS_DIR
+EXPORT_LOGOS = os.getenv("EXPORT_LOGOS", "{}")
+
+# Tamaño con que se muestra el logo en A1
+LOGO_WIDTH = 80
+LOGO_HEIGHT = 60
+# Píxeles por punto: el logo se guarda al doble de resolución para que no se vea borroso al imprimir
+LOGO_SCALE = 2
+
+
+class EmbeddedImage(Image):
+    """
+    Imagen ya codificada, lista para insertar en una hoja. A diferencia de
+    openpyxl.drawing.image.Image no abre nada con Pillow: ni al crearla ni
+    al guardar el workbook.
+    """
+
+    def __init__(self, data: bytes, format: str, width: int, height: int):
+        self.ref = None
+        self._bytes = data
+        self.format = format
+        self.width = width
+        self.height = height
+
+    def _data(self):
+        return self._bytes
+
+
+def _normalize(fundacion: str) -> str:
+    return ' '.join(fundacion.split()).casefold()
+
+
+def _parse_logos(raw: str) -> Dict[str, str]:
+    try:
+        logos = json.loads(raw or "{}")
+        if not isinstance(logos, dict):
+            raise ValueError("se esperaba un objeto JSON")
+    except ValueError as e:
+        logger.warning("EXPORT_LOGOS inválido, se ignora: %s", e)
+        return {}
+    return {_normalize(str(name)): str(path) for name, path in logos.items()}
+
+
+class LogoCache:
+    """
+    Logos de encabezado por fundación, cargados una sola vez por proceso.
+
+    Cada archivo se abre, se redimensiona y se vuelve a codificar la primera
+    vez que se pide (o en preload(), al arrancar); después cada exportación
+    recibe los bytes en memoria sin tocar el disco ni Pillow. Cada worker del
+    pool de exportaciones la carga al arrancar (export_jobs._init_worker).
+    """
+
+    def __init__(self, assets_dir: str = EXPORT_ASSETS_DIR, default_logo: str = EXPORT_DEFAULT_LOGO,
+                 logos: Optional[Dict[str, str]] = None):
+        self.assets_dir = assets_dir
+        self.default_logo = default_logo or None
+        self.logos = _parse_logos(EXPORT_LOGOS) if logos is None else {
+            _normalize(name): path for name, path in logos.items()
+        }
+        self._encoded: Dict[str, Optional[Tuple[bytes, str]]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def version(self) -> str:
+        """Huella de la configuración de logos, para la clave de la caché de exportaciones"""
+        config = json.dumps([self.assets_dir, self.default_logo, sorted(self.logos.items())])
+        return hashlib.sha256(config.encode('utf-8')).hexdigest()[:8]
+
+    def image(self, fundacion: Optional[str] = None) -> Optional[EmbeddedImage]:
+        """Logo de una fundación (o el logo por defecto) listo para ws.add_image, o None"""
+        path = self._path_for(fundacion)
+        if path is None:
+            return None
+        encoded = self._get(path)
+        if encoded is None:
+            return None
+        data, format = encoded
+        return EmbeddedImage(data, format, LOGO_WIDTH, LOGO_HEIGHT)
+
+    def preload(self):
+        """Cargar todos los logos configurados (para llamar al arrancar)"""
+        for path in {self.default_logo, *self.logos.values()}:
+            if path:
+                self._get(path)
+
+    def clear(self):
+        with self._lock:
+            self._encoded.clear()
+
+    # ==================== INTERNOS ====================
+
+    def _path_for(self, fundacion: Optional[str]) -> Optional[str]:
+        if fundacion:
+            path = self.logos.get(_normalize(fundacion))
+            if path:
+                return path
+        return self.default_logo
+
+    def _get(self, path: str) -> Optional[Tuple[bytes, str]]:
+        with self._lock:
+            if path in self._encoded:
+                return self._encoded[path]
+        encoded = self._load(path)
+        with self._lock:
+            self._encoded[path] = encoded
+        return encoded
+
+    def _load(self, path: str) -> Optional[Tuple[bytes, str]]:
+        # Un logo que no se puede cargar se recuerda como None: la exportación sigue sin él
+        full_path = path if os.path.isabs(path) else os.path.join(self.assets_dir, path)
+        try:
+            from PIL import Image as PILImage
+            with PILImage.open(full_path) as img:
+                has_alpha = img.mode in ('RGBA', 'LA', 'P')
+                img = img.convert('RGBA' if has_alpha else 'RGB')
+                img = img.resize((LOGO_WIDTH * LOGO_SCALE, LOGO_HEIGHT * LOGO_SCALE), PILImage.LANCZOS)
+                out = BytesIO()
+                if has_alpha:
+                    img.save(out, format='PNG', optimize=True)
+                    return out.getvalue(), 'png'
+                img.save(out, format='JPEG', quality=90, optimize=True)
+                return out.getvalue(), 'jpeg'
+        except Exception as e:
+            logger.warning("No se pudo cargar el logo %s: %s", full_path, e)
+            return None
+
+
+# Instancia compartida por el proceso
+logo_cache = LogoCache()
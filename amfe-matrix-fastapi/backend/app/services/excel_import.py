@@ -0,0 +1,432 @@
+"""
+Importación de matrices modulares desde workbooks .xlsx con el formato de
+Club Noel (el que genera export_modular_matrix_to_excel).
+
+Cada hoja se lee con openpyxl en modo read-only (filas en streaming, sin
+cargar la hoja entera) y se reconstruye el documento MatrixModularData:
+  - Filas 1-4: header (fundación, código, versión, página, fecha de
+    emisión, servicio, área, elaborado por, equipo, modelo/marca), buscando
+    cada valor junto a su rótulo.
+  - Fila de encabezados (PROCESO, SUBPROCESO, ...) y luego los datos: un
+    proceso, subproceso o falla empieza en la fila donde su columna (A, B o
+    C) tiene valor o empieza un rango combinado; D, E, F, L y M aportan un
+    elemento por fila y G, H, I y N se leen en la primera fila de la falla.
+    El RPN y el tipo de riesgo (J, K) se recalculan al validar.
+En modo read-only openpyxl no expone los rangos combinados: se buscan los
+<mergeCell> en el XML de la hoja leyéndolo por bloques.
+
+Un .zip puede traer muchos workbooks; se descomprimen y procesan de a uno.
+Los documentos resultantes (o DocumentError) alimentan
+import_modular_matrices, que valida e inserta por lotes como en
+POST /matrices/modular/import.
+"""
+from datetime import date, datetime
+from typing import AsyncIterator, Dict, IO, List, Optional, Set, Tuple
+import os
+import re
+import tempfile
+import unicodedata
+import zipfile
+
+from fastapi.concurrency import run_in_threadpool
+from openpyxl import load_workbook
+from openpyxl.utils import column_index_from_string
+from pydantic import ValidationError
+
+from app.schemas import MatrixModularData
+from app.services.export_plan import MODULAR_COLUMN_WIDTHS
+from app.services.matrix_import import DocumentError, ImportFormatError, MAX_ERRORS_PER_DOCUMENT
+
+# Workbooks por .zip, tamaño descomprimido de cada uno y filas de datos por hoja
+EXCEL_IMPORT_MAX_FILES = int(os.getenv("EXCEL_IMPORT_MAX_FILES", "500"))
+EXCEL_IMPORT_MAX_WORKBOOK_BYTES = int(os.getenv("EXCEL_IMPORT_MAX_WORKBOOK_BYTES", str(50 * 1024 * 1024)))
+EXCEL_IMPORT_MAX_ROWS = int(os.getenv("EXCEL_IMPORT_MAX_ROWS", "100000"))
+
+WORKBOOK_EXTENSIONS = ('.xlsx', '.xlsm')
+
+# Filas donde se busca el encabezado de la tabla
+HEADER_SCAN_ROWS = 20
+# Un workbook descomprimido se mantiene en memoria hasta este tamaño; más grande va a disco
+_SPOOL_MAX_BYTES = 8 * 1024 * 1024
+_CHUNK_BYTES = 1024 * 1024
+
+_N_COLUMNS = len(MODULAR_COLUMN_WIDTHS)  # A-Q
+
+# Columnas de la tabla (índices desde 0)
+COL_PROCESO, COL_SUBPROCESO, COL_FALLA = 0, 1, 2
+COL_SEVERIDAD, COL_DETECTABILIDAD, COL_OCURRENCIA = 6, 7, 8
+COL_RESPONSABLE = 13
+ITEM_COLUMNS = {
+    3: ('efectosPotenciales', 'efecto'),
+    4: ('causasPotenciales', 'causa'),
+    5: ('barrerasExistentes', 'barrera'),
+    11: ('accionesRecomendadas', 'accion-rec'),
+    12: ('accionesTomadas', 'accion-tom'),
+}
+
+# Rótulos del header (sin tildes, mayúsculas, sin ':') -> campo de MatrixHeaderModular
+HEADER_LABELS = {
+    'CODIGO': 'codigo',
+    'VERSION': 'version',
+    'PAGINA': 'pagina',
+    'SERVICIO': 'servicio',
+    'AREA': 'area',
+    'ELABORADO POR': 'elaboradoPor',
+    'EQUIPO BIOMEDICO': 'equipo',
+    'MODELO/MARCA': 'modeloMarca',
+}
+# Rótulos de la fecha de emisión: el valor va en la fila de abajo
+DATE_LABELS = {'DIA': 'dia', 'MES': 'mes', 'ANO': 'año'}
+OTHER_LABELS = {'FECHA DE EMISION'}
+
+# Nombre de archivo de export_filename: AMFE_Modular_<nombre>_<id>.xlsx
+_EXPORT_FILENAME_RE = re.compile(r'^AMFE_Modular_(.+)_\d+$')
+# Título de hoja de la exportación multi-hoja: "<id> <nombre>"
+_EXPORT_SHEET_RE = re.compile(r'^\d+ (.+)$')
+_MERGE_CELL_RE = re.compile(rb'<(?:\w+:)?mergeCell\b[^>]*?\bref="([A-Z]{1,3})(\d+):([A-Z]{1,3})(\d+)"')
+
+
+# ==================== CELDAS ====================
+
+def _text(value) -> str:
+    """Valor de una celda como texto (vacío si no tiene valor)"""
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    elif isinstance(value, datetime):
+        value = value.date()
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value).strip()
+
+
+def _number(value):
+    """Entero de una celda de evaluación; si no lo es, el valor queda para que lo rechace la validación"""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value.strip())
+    return value
+
+
+def _label(value) -> str:
+    text = unicodedata.normalize('NFKD', _text(value))
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return ' '.join(text.upper().rstrip(':').split())
+
+
+def _is_label(value) -> bool:
+    label = _label(value)
+    return label in HEADER_LABELS or label in DATE_LABELS or label in OTHER_LABELS
+
+
+def _fill_color(cell) -> Optional[str]:
+    """Color de relleno sólido de una celda como #RRGGBB (None si no tiene)"""
+    fill = getattr(cell, 'fill', None)
+    if fill is None or fill.fill_type != 'solid':
+        return None
+    rgb = fill.fgColor.rgb
+    if isinstance(rgb, str) and len(rgb) == 8 and rgb[2:] != '000000':
+        return f"#{rgb[2:].upper()}"
+    return None
+
+
+# ==================== RANGOS COMBINADOS ====================
+
+def _merge_starts(ws) -> Dict[int, Set[int]]:
+    """
+    Filas donde empieza un rango combinado vertical de las columnas A, B y
+    C: {índice de columna: filas}. Se leen los <mergeCell> del XML de la hoja
+    por bloques (van después de los datos), sin cargar la hoja en memoria.
+    """
+    starts = {COL_PROCESO: set(), COL_SUBPROCESO: set(), COL_FALLA: set()}
+    get_source = getattr(ws, '_get_source', None)
+    if get_source is None:
+        return starts
+    carry = b''
+    with get_source() as source:
+        while True:
+            chunk = source.read(_CHUNK_BYTES)
+            if not chunk:
+                break
+            buffer = carry + chunk
+            last_end = 0
+            for match in _MERGE_CELL_RE.finditer(buffer):
+                last_end = match.end()
+                start_col, start_row, end_col, end_row = match.groups()
+                column = column_index_from_string(start_col.decode()) - 1
+                if column in starts and start_col == end_col and int(end_row) > int(start_row):
+                    starts[column].add(int(start_row))
+            # Conservar el final del bloque por si un <mergeCell> quedó partido
+            carry = buffer[max(last_end, len(buffer) - 256):]
+    return starts
+
+
+# ==================== HEADER ====================
+
+def _parse_header(rows: List[tuple]) -> dict:
+    """Header de la matriz a partir de las filas anteriores a la tabla"""
+    header = {}
+    if rows:
+        fundacion = next((value for value in rows[0] if _text(value)), None)
+        if fundacion is not None and not _is_label(fundacion):
+            header['fundacion'] = _text(fundacion)
+
+    fecha = {}
+    for row_index, row in enumerate(rows):
+        for col, value in enumerate(row):
+            label = _label(value)
+            if label in HEADER_LABELS:
+                # Valor: primera celda con dato a la derecha, antes del próximo rótulo
+                for candidate in row[col + 1:]:
+                    if _is_label(candidate):
+                        break
+                    if _text(candidate):
+                        header[HEADER_LABELS[label]] = _text(candidate)
+                        break
+            elif label in DATE_LABELS and row_index + 1 < len(rows):
+                below = rows[row_index + 1]
+                fecha[DATE_LABELS[label]] = _text(below[col]) if col < len(below) else ''
+
+    dia, mes, año = fecha.get('dia', ''), fecha.get('mes', ''), fecha.get('año', '')
+    try:
+        header['fechaEmision'] = date(int(año), int(mes), int(dia)).isoformat()
+    except ValueError:
+        if mes:
+            header['mes'] = mes
+        if año:
+            header['año'] = año
+    return header
+
+
+def _is_table_header(values: tuple) -> bool:
+    return (len(values) > COL_SUBPROCESO and _label(values[COL_PROCESO]) == 'PROCESO'
+            and _label(values[COL_SUBPROCESO]) == 'SUBPROCESO')
+
+
+# ==================== TABLA ====================
+
+def _new_falla(key: str, values: tuple) -> dict:
+    return {
+        'id': f"falla-{key}",
+        'descripcion': _text(values[COL_FALLA]),
+        'efectosPotenciales': [],
+        'causasPotenciales': [],
+        'barrerasExistentes': [],
+        'evaluacion': {
+            'severidad': _number(values[COL_SEVERIDAD]),
+            'detectabilidad': _number(values[COL_DETECTABILIDAD]),
+            'ocurrencia': _number(values[COL_OCURRENCIA]),
+        },
+        'accionesRecomendadas': [],
+        'accionesTomadas': [],
+        'responsable': _text(values[COL_RESPONSABLE]) or None,
+    }
+
+
+def _parse_table(rows, first_row: int, merge_starts: Dict[int, Set[int]]) -> Tuple[List[dict], Dict[tuple, int]]:
+    """
+    Procesos a partir de las filas de datos (celdas read-only desde
+    `first_row`). Devuelve también la fila de Excel donde empieza cada
+    proceso (p,), subproceso (p, s) y falla (p, s, f), para los errores.
+    """
+    procesos: List[dict] = []
+    origin: Dict[tuple, int] = {}
+    proceso = subproceso = falla = falla_key = None
+    for row_number, cells in enumerate(rows, start=first_row):
+        values = tuple(cell.value for cell in cells) + (None,) * (_N_COLUMNS - len(cells))
+        if not any(_text(value) for value in values[:COL_RESPONSABLE + 1]):
+            continue
+        if row_number - first_row >= EXCEL_IMPORT_MAX_ROWS:
+            raise DocumentError(None, [f"The sheet has more than {EXCEL_IMPORT_MAX_ROWS} data rows"])
+
+        new_proceso = bool(_text(values[COL_PROCESO])) or row_number in merge_starts[COL_PROCESO]
+        new_subproceso = new_proceso or bool(_text(values[COL_SUBPROCESO])) or row_number in merge_starts[COL_SUBPROCESO]
+        new_falla = new_subproceso or bool(_text(values[COL_FALLA])) or row_number in merge_starts[COL_FALLA]
+        if proceso is None and not new_proceso:
+            raise DocumentError(None, [f"Row {row_number}: data before the first PROCESO"])
+
+        if new_proceso:
+            p = len(procesos)
+            proceso = {'id': f"proc-{p}", 'nombre': _text(values[COL_PROCESO]), 'subprocesos': []}
+            color = _fill_color(cells[COL_PROCESO])
+            if color:
+                proceso['color'] = color
+            procesos.append(proceso)
+            origin[(p,)] = row_number
+        if new_subproceso:
+            p, s = len(procesos) - 1, len(proceso['subprocesos'])
+            subproceso = {'id': f"subproc-{p}-{s}", 'nombre': _text(values[COL_SUBPROCESO]), 'fallasPotenciales': []}
+            proceso['subprocesos'].append(subproceso)
+            origin[(p, s)] = row_number
+        if new_falla:
+            p, s = len(procesos) - 1, len(proceso['subprocesos']) - 1
+            f = len(subproceso['fallasPotenciales'])
+            falla_key = f"{p}-{s}-{f}"
+            falla = _new_falla(falla_key, values)
+            subproceso['fallasPotenciales'].append(falla)
+            origin[(p, s, f)] = row_number
+
+        for col, (field, prefix) in ITEM_COLUMNS.items():
+            descripcion = _text(values[col])
+            if descripcion:
+                items = falla[field]
+                items.append({'id': f"{prefix}-{falla_key}-{len(items)}", 'descripcion': descripcion})
+    return procesos, origin
+
+
+def _validation_errors(exc: ValidationError, origin: Dict[tuple, int]) -> List[str]:
+    """Errores de validación con la fila de Excel del proceso/subproceso/falla donde ocurren"""
+    messages = []
+    for error in exc.errors()[:MAX_ERRORS_PER_DOCUMENT]:
+        loc = error['loc']
+        indices = tuple(loc[i + 1] for i, part in enumerate(loc[:-1])
+                        if part in ('procesos', 'subprocesos', 'fallasPotenciales') and isinstance(loc[i + 1], int))
+        path = '/'.join(str(part) for part in loc)
+        row = origin.get(indices)
+        messages.append(f"Row {row}, {path}: {error['msg']}" if row else f"{path}: {error['msg']}")
+    return messages
+
+
+def parse_modular_sheet(ws) -> dict:
+    """
+    Documento MatrixModularData validado de una hoja con el formato de Club
+    Noel. Lanza DocumentError (sin nombre) si la hoja no tiene ese formato o
+    no pasa la validación.
+    """
+    rows = ws.iter_rows(max_col=_N_COLUMNS)
+    header_rows = []
+    for cells in rows:
+        values = tuple(cell.value for cell in cells)
+        if _is_table_header(values):
+            break
+        header_rows.append(values)
+        if len(header_rows) >= HEADER_SCAN_ROWS:
+            raise DocumentError(None, ["Not a modular AMFE sheet (no PROCESO / SUBPROCESO header row)"])
+    else:
+        raise DocumentError(None, ["Not a modular AMFE sheet (no PROCESO / SUBPROCESO header row)"])
+
+    first_row = len(header_rows) + 2
+    procesos, origin = _parse_table(rows, first_row, _merge_starts(ws))
+    data = {'header': _parse_header(header_rows), 'procesos': procesos}
+    try:
+        MatrixModularData.model_validate(data)
+    except ValidationError as exc:
+        raise DocumentError(None, _validation_errors(exc, origin))
+    return data
+
+
+# ==================== WORKBOOKS ====================
+
+def _matrix_name(filename: str, sheet_title: str, multi_sheet: bool) -> str:
+    """Nombre de la matriz: el título de la hoja (multi-hoja) o el nombre del archivo"""
+    if multi_sheet:
+        match = _EXPORT_SHEET_RE.match(sheet_title)
+        return match.group(1) if match else sheet_title
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    match = _EXPORT_FILENAME_RE.match(stem)
+    return (match.group(1) if match else stem).replace('_', ' ').strip() or sheet_title
+
+
+def parse_workbook(file: IO[bytes], filename: str) -> List[object]:
+    """
+    Documentos MatrixModularCreate de un .xlsx, uno por hoja (o
+    DocumentError por cada hoja que no se pudo importar)
+    """
+    try:
+        wb = load_workbook(file, read_only=True, data_only=True)
+    except Exception as exc:
+        return [DocumentError(filename, [f"Not a valid .xlsx workbook: {type(exc).__name__} {exc}".rstrip()])]
+    documents = []
+    try:
+        multi_sheet = len(wb.worksheets) > 1
+        for ws in wb.worksheets:
+            source = f"{filename} / {ws.title}" if multi_sheet else filename
+            try:
+                data = parse_modular_sheet(ws)
+            except DocumentError as exc:
+                documents.append(DocumentError(source, exc.errors))
+                continue
+            documents.append({
+                "name": _matrix_name(filename, ws.title, multi_sheet),
+                "description": f"Importada de {source}",
+                "data": data,
+            })
+    finally:
+        wb.close()
+    return documents
+
+
+def _extract(zf: zipfile.ZipFile, info: zipfile.ZipInfo) -> IO[bytes]:
+    """Descomprimir una entrada del .zip a un archivo temporal, cortando en EXCEL_IMPORT_MAX_WORKBOOK_BYTES"""
+    spool = tempfile.SpooledTemporaryFile(max_size=_SPOOL_MAX_BYTES)
+    size = 0
+    try:
+        with zf.open(info) as entry:
+            while True:
+                chunk = entry.read(_CHUNK_BYTES)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > EXCEL_IMPORT_MAX_WORKBOOK_BYTES:
+                    raise DocumentError(info.filename, [f"Workbook exceeds {EXCEL_IMPORT_MAX_WORKBOOK_BYTES} bytes"])
+                spool.write(chunk)
+    except Exception:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+
+def _parse_zip_entry(zf: zipfile.ZipFile, info: zipfile.ZipInfo) -> List[object]:
+    if not info.filename.lower().endswith(WORKBOOK_EXTENSIONS):
+        return [DocumentError(info.filename, ["Not an .xlsx workbook"])]
+    if info.file_size > EXCEL_IMPORT_MAX_WORKBOOK_BYTES:
+        return [DocumentError(info.filename, [f"Workbook exceeds {EXCEL_IMPORT_MAX_WORKBOOK_BYTES} bytes"])]
+    try:
+        file = _extract(zf, info)
+    except DocumentError as exc:
+        return [exc]
+    except (zipfile.BadZipFile, OSError, RuntimeError) as exc:
+        return [DocumentError(info.filename, [f"Cannot extract: {exc}"])]
+    with file:
+        return parse_workbook(file, info.filename)
+
+
+def _is_workbook_entry(info: zipfile.ZipInfo) -> bool:
+    # Carpetas, metadatos de macOS y archivos de bloqueo de Excel (~$)
+    base = os.path.basename(info.filename)
+    return not (info.is_dir() or info.filename.startswith('__MACOSX/') or base.startswith(('~$', '.')))
+
+
+async def iter_workbook_documents(file: IO[bytes], filename: str) -> AsyncIterator[Tuple[int, object]]:
+    """
+    (posición, documento) de un .xlsx (una matriz por hoja) o de un .zip
+    con varios .xlsx, para import_modular_matrices. Cada workbook se
+    descomprime y se lee en un thread, de a uno, mientras se insertan los
+    lotes anteriores.
+    """
+    try:
+        zf = await run_in_threadpool(zipfile.ZipFile, file)
+    except zipfile.BadZipFile:
+        raise ImportFormatError("The file is not an .xlsx workbook or a .zip archive")
+
+    index = 0
+    with zf:
+        names = set(zf.namelist())
+        if 'xl/workbook.xml' in names:
+            zf.close()
+            file.seek(0)
+            for document in await run_in_threadpool(parse_workbook, file, filename):
+                yield index, document
+                index += 1
+            return
+
+        entries = [info for info in zf.infolist() if _is_workbook_entry(info)]
+        if len(entries) > EXCEL_IMPORT_MAX_FILES:
+            raise ImportFormatError(f"The archive has more than {EXCEL_IMPORT_MAX_FILES} files")
+        for info in entries:
+            for document in await run_in_threadpool(_parse_zip_entry, zf, info):
+                yield index, document
+                index += 1
@@ -0,0 +1,284 @@
+from copy import copy
+from functools import lru_cache
+from typing import List, NamedTuple, Optional
+from openpyxl.formatting.rule import CellIsRule, FormulaRule, Rule
+from openpyxl.styles import Font, PatternFill, Alignment, Border, Side, NamedStyle
+from openpyxl.styles.fonts import DEFAULT_FONT
+
+
+class StyleBundle(NamedTuple):
+    """Conjunto inmutable de estilos que se aplica a una celda en una sola asignación"""
+    font: Optional[Font] = None
+    fill: Optional[PatternFill] = None
+    border: Optional[Border] = None
+    alignment: Optional[Alignment] = None
+
+
+def solid_fill(color: str) -> PatternFill:
+    """Relleno sólido a partir de un color hex sin '#'"""
+    return PatternFill(start_color=color, end_color=color, fill_type="solid")
+
+
+# ==================== PRIMITIVAS ====================
+FONT_CELL = Font(size=9, name='Arial')
+
+ALIGN_CENTER = Alignment(horizontal="center", vertical="center", wrap_text=True)
+ALIGN_LEFT = Alignment(horizontal="left", vertical="center", wrap_text=True)
+
+# La exportación clásica usa bordes sin color explícito; la modular, negro
+BORDER_THIN = Border(
+    left=Side(style='thin'),
+    right=Side(style='thin'),
+    top=Side(style='thin'),
+    bottom=Side(style='thin')
+)
+BORDER_THIN_BLACK = Border(
+    left=Side(style='thin', color="000000"),
+    right=Side(style='thin', color="000000"),
+    top=Side(style='thin', color="000000"),
+    bottom=Side(style='thin', color="000000")
+)
+
+GREEN_LIGHT = "C6E0B4"
+
+
+# ==================== ROLES: EXPORTACIÓN CLÁSICA (tableData) ====================
+_LEGACY_HEADER_FILL = solid_fill("CCCCCC")
+_LEGACY_LABEL_FONT = Font(bold=True, size=8, name='Arial')
+
+LEGACY_STYLES = {
+    'legacy-fundacion': StyleBundle(Font(bold=True, size=11, name='Arial'), None, BORDER_THIN, ALIGN_CENTER),
+    'legacy-titulo': StyleBundle(Font(bold=True, size=10, name='Arial'), None, BORDER_THIN, ALIGN_CENTER),
+    'legacy-label': StyleBundle(_LEGACY_LABEL_FONT, None, BORDER_THIN, ALIGN_CENTER),
+    'legacy-label-fill': StyleBundle(_LEGACY_LABEL_FONT, _LEGACY_HEADER_FILL, BORDER_THIN, ALIGN_CENTER),
+    'legacy-header': StyleBundle(Font(bold=True, size=9, name='Arial'), _LEGACY_HEADER_FILL, BORDER_THIN, ALIGN_CENTER),
+    'legacy-border': StyleBundle(border=BORDER_THIN),
+    'legacy-cell': StyleBundle(FONT_CELL, None, BORDER_THIN, ALIGN_LEFT),
+    'legacy-cell-center': StyleBundle(FONT_CELL, None, BORDER_THIN, ALIGN_CENTER),
+    'legacy-proceso': StyleBundle(FONT_CELL, solid_fill(GREEN_LIGHT), BORDER_THIN, ALIGN_LEFT),
+    # Tipo de riesgo (columna J)
+    'legacy-tipo-critico': StyleBundle(Font(color="721c24", bold=True, size=9, name='Arial'), solid_fill("f8d7da"), BORDER_THIN, ALIGN_CENTER),
+    'legacy-tipo-alto': StyleBundle(Font(color="856404", bold=True, size=9, name='Arial'), solid_fill("fff3cd"), BORDER_THIN, ALIGN_CENTER),
+    'legacy-tipo-medio': StyleBundle(Font(color="0c5460", bold=True, size=9, name='Arial'), solid_fill("d1ecf1"), BORDER_THIN, ALIGN_CENTER),
+    'legacy-tipo-bajo': StyleBundle(Font(color="155724", bold=True, size=9, name='Arial'), solid_fill("d4edda"), BORDER_THIN, ALIGN_CENTER),
+    # RPN (columna K)
+    'legacy-rpn-critico': StyleBundle(Font(bold=True, size=9, name='Arial', color="FFFFFF"), solid_fill("dc3545"), BORDER_THIN, ALIGN_CENTER),
+    'legacy-rpn-alto': StyleBundle(Font(bold=True, size=9, name='Arial', color="FFFFFF"), solid_fill("fd7e14"), BORDER_THIN, ALIGN_CENTER),
+    'legacy-rpn-medio': StyleBundle(Font(bold=True, size=9, name='Arial', color="000000"), solid_fill("ffc107"), BORDER_THIN, ALIGN_CENTER),
+    'legacy-rpn-bajo': StyleBundle(Font(bold=True, size=9, name='Arial', color="FFFFFF"), solid_fill("28a745"), BORDER_THIN, ALIGN_CENTER),
+    # Tipo de riesgo y RPN sin color propio: lo pone el formato condicional
+    'legacy-tipo-plain': StyleBundle(Font(bold=True, size=9, name='Arial'), None, BORDER_THIN, ALIGN_CENTER),
+    'legacy-rpn-plain': StyleBundle(Font(bold=True, size=9, name='Arial'), None, BORDER_THIN, ALIGN_CENTER),
+}
+
+LEGACY_TIPO_ROLES = {
+    'Crítico': 'legacy-tipo-critico',
+    'Alto': 'legacy-tipo-alto',
+    'Medio': 'legacy-tipo-medio',
+}
+
+
+def legacy_rpn_role(rpn_value) -> str:
+    """Rol de la celda RPN en la exportación clásica (umbrales 100/50/20)"""
+    try:
+        rpn_num = int(rpn_value) if rpn_value else 1
+    except (TypeError, ValueError):
+        return 'legacy-rpn-bajo'
+    if rpn_num >= 100:
+        return 'legacy-rpn-critico'
+    if rpn_num >= 50:
+        return 'legacy-rpn-alto'
+    if rpn_num >= 20:
+        return 'legacy-rpn-medio'
+    return 'legacy-rpn-bajo'
+
+
+# ==================== ROLES: EXPORTACIÓN MODULAR (Club Noel) ====================
+_HEADER_FONT = Font(bold=True, size=10, name='Arial', color="000000")
+_RPN_FONT = Font(bold=True, size=9, name='Arial', color="FFFFFF")
+
+MODULAR_STYLES = {
+    'fundacion': StyleBundle(Font(bold=True, size=12, name='Arial'), None, BORDER_THIN_BLACK, ALIGN_CENTER),
+    'subtitulo': StyleBundle(Font(bold=True, size=11, name='Arial'), solid_fill(GREEN_LIGHT), BORDER_THIN_BLACK, ALIGN_CENTER),
+    'label': StyleBundle(_HEADER_FONT, None, BORDER_THIN_BLACK, ALIGN_CENTER),
+    'label-left': StyleBundle(_HEADER_FONT, None, BORDER_THIN_BLACK, ALIGN_LEFT),
+    'label-green': StyleBundle(_HEADER_FONT, solid_fill(GREEN_LIGHT), BORDER_THIN_BLACK, ALIGN_CENTER),
+    'table-header': StyleBundle(_HEADER_FONT, solid_fill("D9D9D9"), BORDER_THIN_BLACK, ALIGN_CENTER),
+    'border': StyleBundle(border=BORDER_THIN_BLACK),
+    'cell': StyleBundle(FONT_CELL, None, BORDER_THIN_BLACK, ALIGN_LEFT),
+    'cell-center': StyleBundle(FONT_CELL, None, BORDER_THIN_BLACK, ALIGN_CENTER),
+    # RPN (columna J)
+    'rpn': StyleBundle(_RPN_FONT, None, BORDER_THIN_BLACK, ALIGN_CENTER),
+    'rpn-alto': StyleBundle(_RPN_FONT, solid_fill("dc3545"), BORDER_THIN_BLACK, ALIGN_CENTER),
+    'rpn-medio': StyleBundle(_RPN_FONT, solid_fill("fd7e14"), BORDER_THIN_BLACK, ALIGN_CENTER),
+    'rpn-bajo': StyleBundle(_RPN_FONT, solid_fill("28a745"), BORDER_THIN_BLACK, ALIGN_CENTER),
+    # Tipo de riesgo (columna K)
+    'tipo-alto': StyleBundle(Font(bold=True, size=9, name='Arial', color="721c24"), solid_fill("f8d7da"), BORDER_THIN_BLACK, ALIGN_CENTER),
+    'tipo-medio': StyleBundle(Font(bold=True, size=9, name='Arial', color="8b4513"), solid_fill("ffe5d0"), BORDER_THIN_BLACK, ALIGN_CENTER),
+    'tipo-bajo': StyleBundle(Font(bold=True, size=9, name='Arial', color="155724"), solid_fill("d4edda"), BORDER_THIN_BLACK, ALIGN_CENTER),
+    # RPN y tipo de riesgo sin color propio: lo pone el formato condicional
+    'rpn-plain': StyleBundle(Font(bold=True, size=9, name='Arial', color="000000"), None, BORDER_THIN_BLACK, ALIGN_CENTER),
+    'tipo-plain': StyleBundle(Font(bold=True, size=9, name='Arial', color="000000"), None, BORDER_THIN_BLACK, ALIGN_CENTER),
+}
+
+_PROCESO_FONT = Font(bold=True, size=10, name='Arial')
+
+
+def modular_risk(rpn):
+    """
+    Tipo de riesgo y roles (RPN, tipo) para una falla modular.
+    3 niveles: Alto (>=33), Medio (>=13), Bajo. Sin RPN no hay clasificación.
+    """
+    if not rpn:
+        return '', 'rpn', 'cell-center'
+    if rpn >= 33:
+        return 'Alto', 'rpn-alto', 'tipo-alto'
+    if rpn >= 13:
+        return 'Medio', 'rpn-medio', 'tipo-medio'
+    return 'Bajo', 'rpn-bajo', 'tipo-bajo'
+
+
+def proceso_roles(color: Optional[str]):
+    """
+    Roles (celda superior, resto de filas) para la columna de un proceso
+    con su color propio. Si el color no es válido se usa el verde claro.
+    """
+    try:
+        color_hex = color.replace('#', '')
+        solid_fill(color_hex)
+    except Exception:
+        color_hex = GREEN_LIGHT
+    return f'proceso-{color_hex}', f'proceso-{color_hex}-span'
+
+
+@lru_cache(maxsize=256)
+def _proceso_bundle(role: str) -> StyleBundle:
+    color_hex = role.split('-')[1]
+    fill = solid_fill(color_hex)
+    if role.endswith('-span'):
+        return StyleBundle(fill=fill, border=BORDER_THIN_BLACK)
+    return StyleBundle(_PROCESO_FONT, fill, BORDER_THIN_BLACK, ALIGN_CENTER)
+
+
+STYLE_BUNDLES = {**LEGACY_STYLES, **MODULAR_STYLES}
+
+
+# ==================== FORMATO CONDICIONAL ====================
+# En las exportaciones con formato condicional las columnas de RPN y tipo de
+# riesgo se escriben con los roles *-plain y el color lo ponen estas reglas,
+# aplicadas a toda la columna de datos. Así quien recibe el archivo puede
+# cambiar un valor o un umbral (Inicio > Formato condicional > Administrar
+# reglas) y Excel recolorea sin volver a exportar. Cada regla usa la fuente y
+# el relleno del rol de color fijo equivalente; la primera que se cumple gana.
+
+def _dxf(role: str) -> dict:
+    # En un formato diferencial Excel solo admite color y estilo de la fuente
+    bundle = STYLE_BUNDLES[role]
+    return {'font': Font(bold=bundle.font.b, color=bundle.font.color), 'fill': bundle.fill}
+
+
+def _cell_is(operator: str, value: str, role: str) -> Rule:
+    return CellIsRule(operator=operator, formula=[value], stopIfTrue=True, **_dxf(role))
+
+
+def _formula(formula: str, role: str) -> Rule:
+    return FormulaRule(formula=[formula], stopIfTrue=True, **_dxf(role))
+
+
+def _legacy_rpn_rules(ref: str) -> List[Rule]:
+    # El RPN clásico puede venir como texto; sin número se trata como 1 (legacy_rpn_role)
+    rpn = f'IFERROR(VALUE({ref}),1)'
+    return [
+        _formula(f'{rpn}>=100', 'legacy-rpn-critico'),
+        _formula(f'{rpn}>=50', 'legacy-rpn-alto'),
+        _formula(f'{rpn}>=20', 'legacy-rpn-medio'),
+        _formula(f'{rpn}<20', 'legacy-rpn-bajo'),
+    ]
+
+
+def _legacy_tipo_rules(ref: str) -> List[Rule]:
+    rules = [_cell_is('equal', f'"{tipo}"', role) for tipo, role in LEGACY_TIPO_ROLES.items()]
+    # Cualquier otro valor se muestra como bajo
+    others = ','.join(f'{ref}<>"{tipo}"' for tipo in LEGACY_TIPO_ROLES)
+    rules.append(_formula(f'AND({others})', 'legacy-tipo-bajo'))
+    return rules
+
+
+def _modular_rpn_rules(ref: str) -> List[Rule]:
+    # Mismos umbrales que modular_risk
+    return [
+        _cell_is('greaterThanOrEqual', '33', 'rpn-alto'),
+        _cell_is('greaterThanOrEqual', '13', 'rpn-medio'),
+        _cell_is('greaterThan', '0', 'rpn-bajo'),
+    ]
+
+
+def _modular_tipo_rules(ref: str) -> List[Rule]:
+    return [
+        _cell_is('equal', '"Alto"', 'tipo-alto'),
+        _cell_is('equal', '"Medio"', 'tipo-medio'),
+        _cell_is('equal', '"Bajo"', 'tipo-bajo'),
+    ]
+
+
+CONDITIONAL_RULES = {
+    'legacy-rpn': _legacy_rpn_rules,
+    'legacy-tipo': _legacy_tipo_rules,
+    'modular-rpn': _modular_rpn_rules,
+    'modular-tipo': _modular_tipo_rules,
+}
+
+
+def conditional_rules(name: str, ref: str) -> List[Rule]:
+    """
+    Reglas nuevas de un conjunto de formato condicional. `ref` es la celda
+    superior izquierda del rango (las fórmulas son relativas a ella). Las
+    reglas se crean en cada llamada porque openpyxl les asigna prioridad
+    por hoja.
+    """
+    return CONDITIONAL_RULES[name](ref)
+
+
+def style_bundle(role: str) -> StyleBundle:
+    """StyleBundle de un rol fijo o de un rol de color de proceso"""
+    bundle = STYLE_BUNDLES.get(role)
+    if bundle is None:
+        if not role.startswith('proceso-'):
+            raise KeyError(f"Rol de estilo desconocido: {role}")
+        bundle = _proceso_bundle(role)
+    return bundle
+
+
+class WorkbookStyles:
+    """
+    Registro de estilos con nombre de un workbook.
+
+    Los StyleBundle son globales e inmutables; cada workbook recibe su propio
+    NamedStyle (se vinculan al workbook) la primera vez que se usa un rol, y a
+    partir de ahí aplicar un rol a una celda es copiar su arreglo de índices,
+    igual que hace openpyxl al asignar `cell.style`, pero sin buscar el nombre
+    en la lista de estilos ni comparar fuentes/rellenos en cada celda.
+    """
+
+    def __init__(self, wb):
+        self.wb = wb
+        self._arrays = {}
+
+    def apply(self, cell, role: str):
+        """Aplicar el estilo de un rol a una celda"""
+        array = self._arrays.get(role)
+        if array is None:
+            array = self._register(role, style_bundle(role))
+        cell._style = copy(array)
+
+    def _register(self, name: str, bundle: StyleBundle):
+        style = NamedStyle(
+            name=name,
+            font=bundle.font or DEFAULT_FONT,
+            fill=bundle.fill,
+            border=bundle.border,
+            alignment=bundle.alignment,
+        )
+        self.wb.add_named_style(style)
+        self._arrays[name] = style.as_tuple()
+        return self._arrays[name]
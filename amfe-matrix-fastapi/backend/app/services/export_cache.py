@@ -0,0 +1,244 @@
+from collections import OrderedDict
+from io import BytesIO
+from typing import IO, Optional, Tuple
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+# Configuración de la caché de exportaciones
+EXPORT_CACHE_MAX_ENTRIES = int(os.getenv("EXPORT_CACHE_MAX_ENTRIES", "64"))
+EXPORT_CACHE_MAX_BYTES = int(os.getenv("EXPORT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+EXPORT_CACHE_DIR = os.getenv("EXPORT_CACHE_DIR")  # Sin definir = sin caché en disco
+EXPORT_CACHE_DISK_MAX_BYTES = int(os.getenv("EXPORT_CACHE_DISK_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# (tipo de exportación, id de matriz, version de la matriz, versión del exportador)
+ExportKey = Tuple[str, int, str, str]
+
+
+class ExportCache:
+    """
+    Caché de archivos Excel exportados.
+
+    - Nivel en memoria: LRU acotado por número de entradas y por bytes.
+    - Nivel en disco (opcional): un archivo por entrada en `disk_dir`, con
+      expulsión de los menos usados recientemente al superar `max_disk_bytes`.
+      Lo comparten todos los workers que apunten al mismo directorio.
+
+    Como la clave incluye la `version` de la matriz, una matriz modificada
+    nunca devuelve un archivo viejo; invalidate() libera además el espacio en
+    cuanto se escribe.
+    """
+
+    def __init__(self, max_entries: int = EXPORT_CACHE_MAX_ENTRIES, max_bytes: int = EXPORT_CACHE_MAX_BYTES,
+                 disk_dir: Optional[str] = EXPORT_CACHE_DIR, max_disk_bytes: int = EXPORT_CACHE_DISK_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    # ==================== LECTURA ====================
+
+    def get(self, key: ExportKey) -> Optional[bytes]:
+        """Bytes del archivo cacheado o None. Un acierto en disco sube a memoria."""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return data
+
+        path = self._disk_path(key)
+        if path is not None:
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                os.utime(path)
+            except OSError:
+                data = None
+            if data is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                self._put_memory(key, data)
+                return data
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def open(self, key: ExportKey) -> Optional[IO[bytes]]:
+        """
+        Archivo cacheado listo para leer, o None. Pensado para el modo
+        streaming: un acierto en disco se sirve desde el archivo, sin cargarlo
+        en memoria.
+        """
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return BytesIO(data)
+
+        path = self._disk_path(key)
+        if path is not None:
+            try:
+                f = open(path, 'rb')
+                os.utime(path)
+            except OSError:
+                f = None
+            if f is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                return f
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    # ==================== ESCRITURA ====================
+
+    def put(self, key: ExportKey, data: bytes):
+        """Guardar un archivo exportado en memoria y, si está habilitado, en disco"""
+        self._put_memory(key, data)
+        if self.disk_dir:
+            self._put_disk(key, lambda f: f.write(data))
+
+    def put_file(self, key: ExportKey, file: IO[bytes]):
+        """
+        Guardar un archivo exportado en streaming. Solo va al nivel en disco
+        (no se carga en memoria); `file` queda posicionado al inicio.
+        """
+        if self.disk_dir:
+            file.seek(0)
+            self._put_disk(key, lambda f: shutil.copyfileobj(file, f))
+        file.seek(0)
+
+    def invalidate(self, matrix_id: int):
+        """Eliminar todas las exportaciones cacheadas de una matriz"""
+        with self._lock:
+            for key in [k for k in self._memory if k[1] == matrix_id]:
+                self._memory_bytes -= len(self._memory.pop(key))
+
+        if self.disk_dir:
+            prefix = f"{matrix_id}."
+            for entry in os.scandir(self.disk_dir):
+                if entry.name.startswith(prefix) and entry.name.endswith('.xlsx'):
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+
+    def clear(self):
+        """Vaciar ambos niveles"""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+        if self.disk_dir:
+            for entry in os.scandir(self.disk_dir):
+                if entry.name.endswith('.xlsx'):
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+
+    def stats(self) -> dict:
+        """Contadores de aciertos/fallos y ocupación, para dimensionar la caché"""
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "disk_enabled": bool(self.disk_dir),
+                "disk_bytes": self._disk_usage()[0] if self.disk_dir else 0,
+                "max_disk_bytes": self.max_disk_bytes if self.disk_dir else 0,
+            }
+
+    # ==================== INTERNOS ====================
+
+    def _put_memory(self, key: ExportKey, data: bytes):
+        size = len(data)
+        if size > self.max_bytes or self.max_entries <= 0:
+            return
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_bytes -= len(old)
+            self._memory[key] = data
+            self._memory_bytes += size
+            while len(self._memory) > self.max_entries or self._memory_bytes > self.max_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+                self.evictions += 1
+
+    def _file_name(self, key: ExportKey) -> str:
+        kind, matrix_id, matrix_version, version = key
+        digest = hashlib.sha256(f"{matrix_version}|{version}".encode('utf-8')).hexdigest()[:16]
+        return f"{matrix_id}.{kind}.{digest}.xlsx"
+
+    def _disk_path(self, key: ExportKey) -> Optional[str]:
+        if not self.disk_dir:
+            return None
+        return os.path.join(self.disk_dir, self._file_name(key))
+
+    def _put_disk(self, key: ExportKey, write):
+        # Escritura atómica: archivo temporal en el mismo directorio + rename
+        fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, self._disk_path(key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self._evict_disk()
+
+    def _disk_usage(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.disk_dir):
+            if entry.name.endswith('.xlsx'):
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+        return total, entries
+
+    def _evict_disk(self):
+        total, entries = self._disk_usage()
+        if total <= self.max_disk_bytes:
+            return
+        # Los archivos se "tocan" en cada acierto: mtime más viejo = menos usado
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            with self._lock:
+                self.evictions += 1
+            if total <= self.max_disk_bytes:
+                break
+
+
+# Instancia compartida por el proceso
+export_cache = ExportCache()
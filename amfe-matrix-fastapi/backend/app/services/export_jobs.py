@@ -0,0 +1,313 @@
+from concurrent.futures import ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Optional
+import multiprocessing
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+import uuid
+
+from app.services.excel_assets import logo_cache
+from app.services.export_cache import export_cache, ExportKey
+from app.services.matrix_service import render_export_file
+
+# Configuración de la cola de exportaciones en segundo plano
+EXPORT_JOBS_MAX_WORKERS = int(os.getenv("EXPORT_JOBS_MAX_WORKERS", "2"))
+EXPORT_JOBS_MAX_PENDING = int(os.getenv("EXPORT_JOBS_MAX_PENDING", "32"))
+EXPORT_JOB_TIMEOUT = float(os.getenv("EXPORT_JOB_TIMEOUT", "300"))  # segundos de render por trabajo
+EXPORT_JOB_RETENTION = float(os.getenv("EXPORT_JOB_RETENTION", "900"))  # segundos que se conserva el resultado
+EXPORT_JOBS_DIR = os.getenv("EXPORT_JOBS_DIR")  # Sin definir = directorio temporal del proceso
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+
+class ExportQueueFullError(Exception):
+    """No se aceptan más trabajos hasta que termine alguno de los pendientes"""
+
+
+class ExportJobTimeout(Exception):
+    """El render superó EXPORT_JOB_TIMEOUT"""
+
+
+@dataclass
+class ExportJob:
+    """Estado de un trabajo de exportación"""
+    id: str
+    kind: str
+    matrix_id: int
+    user_id: Optional[int]
+    filename: str
+    path: str
+    status: str = JOB_PENDING
+    error: Optional[str] = None
+    size: Optional[int] = None
+    created_at: datetime = field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = None
+    cache_key: Optional[ExportKey] = None
+    future: Optional[Future] = field(default=None, repr=False)
+    expires: Optional[float] = None  # time.monotonic() a partir del cual se descarta
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+
+
+def _pool_context():
+    # Sin fork: el pool se crea desde el proceso de uvicorn, que ya tiene hilos
+    # (threadpool, drivers async) y un fork podría heredar un lock tomado
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(method)
+
+
+def _init_worker():
+    """Se ejecuta al arrancar cada proceso del pool: carga los logos una vez por worker"""
+    logo_cache.preload()
+
+
+def _on_timeout(signum, frame):
+    raise ExportJobTimeout()
+
+
+def _call_with_timeout(timeout: float, fn, *args):
+    """
+    Se ejecuta en un proceso del pool. El límite de tiempo se aplica con
+    SIGALRM dentro del worker, así un render colgado no ocupa el proceso.
+    """
+    alarm = timeout > 0 and hasattr(signal, "SIGALRM")
+    if alarm:
+        signal.signal(signal.SIGALRM, _on_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return fn(*args)
+    finally:
+        if alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def render_to_path(kind: str, data: dict, path: str, conditional: bool = False) -> int:
+    """Renderizar `data` directamente a `path` y devolver el tamaño del archivo"""
+    try:
+        with open(path, 'w+b') as f:
+            render_export_file(kind, data, f, conditional)
+        return os.path.getsize(path)
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+
+
+class ExportJobQueue:
+    """
+    Cola de exportaciones a Excel en segundo plano.
+
+    El render corre en un ProcessPoolExecutor acotado (no compite por el GIL
+    con el event loop); al worker solo viaja el dict `data` de la matriz y el
+    resultado queda en un archivo de `jobs_dir`. Los trabajos terminados se
+    conservan `retention` segundos y luego se eliminan junto con su archivo.
+
+    El registro de trabajos vive en memoria: con varios workers de uvicorn
+    cada proceso conoce solo los trabajos que recibió.
+    """
+
+    def __init__(self, max_workers: int = EXPORT_JOBS_MAX_WORKERS, max_pending: int = EXPORT_JOBS_MAX_PENDING,
+                 timeout: float = EXPORT_JOB_TIMEOUT, retention: float = EXPORT_JOB_RETENTION,
+                 jobs_dir: Optional[str] = EXPORT_JOBS_DIR):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.retention = retention
+        self.jobs_dir = jobs_dir
+        self._jobs: Dict[str, ExportJob] = {}
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    # ==================== API ====================
+
+    def submit(self, kind: str, matrix, user_id: Optional[int], filename: str,
+               cache_key: Optional[ExportKey] = None, conditional: bool = False) -> ExportJob:
+        """
+        Encolar la exportación de una matriz. Si ya está en la caché de
+        exportaciones el trabajo nace terminado, sin pasar por el pool.
+        """
+        self.purge()
+        job_id = uuid.uuid4().hex
+        job = ExportJob(
+            id=job_id,
+            kind=kind,
+            matrix_id=matrix.id,
+            user_id=user_id,
+            filename=filename,
+            path=os.path.join(self._dir(), f"{job_id}.xlsx"),
+            cache_key=cache_key,
+        )
+
+        cached = export_cache.open(cache_key) if cache_key else None
+        if cached is not None:
+            with cached, open(job.path, 'wb') as f:
+                shutil.copyfileobj(cached, f)
+            job.size = os.path.getsize(job.path)
+            self._finish(job, JOB_DONE)
+            with self._lock:
+                self._jobs[job_id] = job
+            return job
+
+        with self._lock:
+            pending = sum(1 for j in self._jobs.values() if not j.finished)
+            if pending >= self.max_pending:
+                raise ExportQueueFullError()
+            self._jobs[job_id] = job
+        try:
+            job.future = self.run(render_to_path, kind, matrix.data, job.path, conditional)
+        except Exception:
+            with self._lock:
+                self._jobs.pop(job_id, None)
+            raise
+        job.future.add_done_callback(lambda future: self._on_done(job, future))
+        return job
+
+    def run(self, fn, *args) -> Future:
+        """
+        Ejecutar fn(*args) en el pool con el límite de tiempo de los trabajos.
+        `fn` debe ser una función de módulo (se envía por pickle al worker).
+        """
+        with self._lock:
+            try:
+                return self._get_pool().submit(_call_with_timeout, self.timeout, fn, *args)
+            except BrokenProcessPool:
+                # Un worker murió (p. ej. por memoria): se recrea el pool una vez
+                self._pool = None
+                return self._get_pool().submit(_call_with_timeout, self.timeout, fn, *args)
+
+    def get(self, job_id: str) -> Optional[ExportJob]:
+        """Trabajo por id (None si no existe o ya expiró), con su estado actualizado"""
+        self.purge()
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None and job.status == JOB_PENDING and job.future is not None and job.future.running():
+            job.status = JOB_RUNNING
+        return job
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Cancelar un trabajo pendiente o descartar uno terminado. Un trabajo que
+        ya está en un worker no se puede interrumpir: se descarta al terminar.
+        """
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+        if job is None:
+            return False
+        if job.future is not None and not job.future.done():
+            job.future.cancel()
+        job.status = JOB_CANCELLED
+        self._remove_file(job)
+        return True
+
+    def purge(self):
+        """Eliminar los trabajos terminados cuya retención expiró"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [j for j in self._jobs.values() if j.expires is not None and j.expires <= now]
+            for job in expired:
+                del self._jobs[job.id]
+        for job in expired:
+            self._remove_file(job)
+
+    def stats(self) -> dict:
+        """Ocupación de la cola, para dimensionar workers y límites"""
+        self.purge()
+        with self._lock:
+            jobs = list(self._jobs.values())
+        by_status = {}
+        for job in jobs:
+            if job.status == JOB_PENDING and job.future is not None and job.future.running():
+                job.status = JOB_RUNNING
+            by_status[job.status] = by_status.get(job.status, 0) + 1
+        return {
+            "jobs": by_status,
+            "max_workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "timeout": self.timeout,
+            "retention": self.retention,
+        }
+
+    def shutdown(self):
+        """Detener el pool y borrar los archivos de resultados"""
+        with self._lock:
+            pool, self._pool = self._pool, None
+            jobs = list(self._jobs.values())
+            self._jobs.clear()
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+        for job in jobs:
+            self._remove_file(job)
+
+    # ==================== INTERNOS ====================
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        # Se crea al primer trabajo: importar el módulo no arranca procesos
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=_pool_context(),
+                                             initializer=_init_worker)
+        return self._pool
+
+    def _dir(self) -> str:
+        if self.jobs_dir is None:
+            self.jobs_dir = tempfile.mkdtemp(prefix="amfe-export-jobs-")
+        else:
+            os.makedirs(self.jobs_dir, exist_ok=True)
+        return self.jobs_dir
+
+    def _on_done(self, job: ExportJob, future: Future):
+        if job.status == JOB_CANCELLED:
+            # Descartado mientras corría en un worker
+            self._remove_file(job)
+            return
+        if future.cancelled():
+            self._finish(job, JOB_CANCELLED)
+            return
+        error = future.exception()
+        if error is None:
+            job.size = future.result()
+            self._finish(job, JOB_DONE)
+            if job.cache_key is not None:
+                try:
+                    with open(job.path, 'rb') as f:
+                        export_cache.put_file(job.cache_key, f)
+                except OSError:
+                    pass
+            return
+        if isinstance(error, ExportJobTimeout):
+            job.error = f"Export timed out after {self.timeout:g} seconds"
+        elif isinstance(error, BrokenProcessPool):
+            job.error = "Export worker terminated unexpectedly"
+            with self._lock:
+                self._pool = None
+        else:
+            job.error = f"Export failed: {error}"
+        self._finish(job, JOB_FAILED)
+
+    def _finish(self, job: ExportJob, status: str):
+        job.status = status
+        job.finished_at = datetime.utcnow()
+        job.expires = time.monotonic() + self.retention
+        if status != JOB_DONE:
+            self._remove_file(job)
+
+    def _remove_file(self, job: ExportJob):
+        try:
+            os.remove(job.path)
+        except OSError:
+            pass
+
+
+# Instancia compartida por el proceso
+export_jobs = ExportJobQueue()
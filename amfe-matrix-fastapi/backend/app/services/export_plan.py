@@ -0,0 +1,504 @@
+from array import array
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from app.services.excel_styles import LEGACY_TIPO_ROLES, legacy_rpn_role, modular_risk, proceso_roles
+
+# ========================================
+# PLAN DE LAS EXPORTACIONES
+# ========================================
+#
+# El armado de una exportación tiene dos etapas:
+#   1. Planificación (este módulo): recorre `matrix.data` una sola vez y
+#      produce un ExportPlan con las filas, celdas, rangos combinados,
+#      alturas y roles de estilo ya resueltos. No depende de openpyxl.
+#   2. Render (matrix_service): vuelca un ExportPlan a un .xlsx en memoria o
+#      en streaming. Otros formatos pueden consumir el mismo plan.
+#
+# Los planificadores de filas (_legacy_rows, _modular_rows) generan cada fila
+# como (celdas, merges, altura):
+#   - celdas: lista de (columna, valor, rol de estilo) ordenada por columna;
+#     valor None = solo estilo (p.ej. bordes de celdas combinadas)
+#   - merges: rangos (fila_ini, col_ini, fila_fin, col_fin) que empiezan en la fila
+#   - altura: altura de la fila o None
+# y ExportPlan las guarda en arreglos compactos.
+#
+# Con `conditional=True` las columnas de RPN y tipo de riesgo se planifican
+# con roles sin color y el plan registra los rangos de formato condicional
+# (ver excel_styles.CONDITIONAL_RULES) que el render agrega a la hoja.
+
+
+class ExportPlan:
+    """
+    Plan compacto de una hoja exportada.
+
+    Las celdas se guardan en arreglos paralelos (columna, índice de rol) más
+    una lista de valores; las celdas de la fila r (desde 1) ocupan los índices
+    row_starts[r - 1] a row_starts[r]. Los rangos combinados van en un
+    arreglo plano de 4 enteros por rango, y los rangos de formato condicional
+    como (conjunto de reglas, fila_ini, columna, fila_fin). El plan es
+    inmutable una vez armado, así que se puede cachear y renderizar varias veces.
+    """
+
+    __slots__ = ('kind', 'column_widths', 'logo', 'roles', 'values', 'columns', 'role_ids',
+                 'row_starts', 'merges', 'heights', 'conditional_formats', '_role_index')
+
+    def __init__(self, kind: str, column_widths: Dict[str, float], logo: Optional[str] = None):
+        self.kind = kind
+        self.column_widths = column_widths
+        self.logo = logo  # Fundación cuyo logo va en A1 (None = sin logo)
+        self.roles: List[str] = []
+        self.values: list = []
+        self.columns = array('H')
+        self.role_ids = array('H')
+        self.row_starts = array('I', [0])
+        self.merges = array('I')
+        self.heights: Dict[int, float] = {}
+        self.conditional_formats: List[Tuple[str, int, int, int]] = []
+        self._role_index: Dict[str, int] = {}
+
+    @classmethod
+    def from_rows(cls, kind: str, rows, column_widths: Dict[str, float], logo: Optional[str] = None) -> 'ExportPlan':
+        """Armar el plan a partir de un generador de filas (celdas, merges, altura)"""
+        plan = cls(kind, column_widths, logo)
+        values, columns, role_ids = plan.values, plan.columns, plan.role_ids
+        role_index, roles = plan._role_index, plan.roles
+        for row_idx, (cells, merges, height) in enumerate(rows, start=1):
+            for col, value, role in cells:
+                role_id = role_index.get(role)
+                if role_id is None:
+                    role_id = role_index[role] = len(roles)
+                    roles.append(role)
+                values.append(value)
+                columns.append(col)
+                role_ids.append(role_id)
+            plan.row_starts.append(len(values))
+            for merge in merges:
+                plan.merges.extend(merge)
+            if height:
+                plan.heights[row_idx] = height
+        return plan
+
+    @property
+    def n_rows(self) -> int:
+        return len(self.row_starts) - 1
+
+    @property
+    def n_cells(self) -> int:
+        return len(self.values)
+
+    @property
+    def n_merges(self) -> int:
+        return len(self.merges) // 4
+
+    def merge_ranges(self):
+        """Rangos combinados como (fila_ini, col_ini, fila_fin, col_fin)"""
+        merges = self.merges
+        for i in range(0, len(merges), 4):
+            yield merges[i], merges[i + 1], merges[i + 2], merges[i + 3]
+
+    def rows(self):
+        """Filas como (número de fila, [(columna, valor, rol)], altura); para otros formatos"""
+        values, columns, role_ids, roles = self.values, self.columns, self.role_ids, self.roles
+        starts = self.row_starts
+        for row_idx in range(1, len(starts)):
+            cells = [(columns[i], values[i], roles[role_ids[i]]) for i in range(starts[row_idx - 1], starts[row_idx])]
+            yield row_idx, cells, self.heights.get(row_idx)
+
+    def add_conditional_format(self, rules: str, column: int, first_row: int):
+        """Aplicar un conjunto de reglas a `column` desde `first_row` hasta la última fila"""
+        if self.n_rows >= first_row:
+            self.conditional_formats.append((rules, first_row, column, self.n_rows))
+
+
+MODULAR_DEFAULT_FUNDACION = "Fundación Clínica Infantil Club Noel"
+
+# Primera fila de datos (después de los encabezados) de cada formato
+LEGACY_FIRST_DATA_ROW = 7
+MODULAR_FIRST_DATA_ROW = 6
+
+LEGACY_COLUMN_WIDTHS = {
+    'A': 15,  # Proceso
+    'B': 15,  # Subproceso
+    'C': 25,  # Falla Potencial
+    'D': 25,  # Efecto Potencial
+    'E': 25,  # Causas
+    'F': 25,  # Barreras
+    'G': 10,  # Severidad
+    'H': 12,  # Detectabilidad
+    'I': 10,  # Ocurrencia
+    'J': 15,  # Tipo de Riesgo
+    'K': 8,   # RPN
+    'L': 30,  # Acciones Recomendadas
+    'M': 30,  # Acciones Tomadas
+    'N': 20,  # Responsable
+    'O': 8,   # DIA
+    'P': 8,   # MES
+    'Q': 8,   # AÑO (parte 1)
+    'R': 8    # AÑO (parte 2)
+}
+
+MODULAR_COLUMN_WIDTHS = {
+    'A': 12,  # PROCESO
+    'B': 15,  # SUBPROCESO
+    'C': 25,  # FALLA POTENCIAL
+    'D': 25,  # EFECTO POTENCIAL
+    'E': 20,  # CAUSAS
+    'F': 20,  # BARRERAS
+    'G': 10,  # Severidad
+    'H': 12,  # Detectabilidad
+    'I': 10,  # Ocurrencia
+    'J': 8,   # RPN
+    'K': 12,  # TIPO DE RIESGO
+    'L': 30,  # ACCIONES RECOMENDADAS
+    'M': 30,  # ACCIONES TOMADAS
+    'N': 18,  # RESPONSABLE
+    'O': 6,   # DÍA
+    'P': 6,   # MES
+    'Q': 8    # AÑO
+}
+
+
+def _parse_fecha(header: dict):
+    """Día, mes y año de la fecha de emisión (o mes/año del header si no es válida)"""
+    fecha_emision = header.get('fechaEmision', '')
+    if fecha_emision:
+        try:
+            fecha_obj = datetime.strptime(fecha_emision, '%Y-%m-%d')
+            return fecha_obj.day, fecha_obj.month, fecha_obj.year
+        except:
+            pass
+    return '', header.get('mes', ''), header.get('año', '')
+
+
+def _legacy_rows(data: dict, conditional: bool = False):
+    """Filas de la exportación clásica (tableData)"""
+    header = data.get('header', {})
+    table_data = data.get('tableData', [])
+    
+    # FILA 1: Fundación (A1:R1)
+    yield [
+        (1, header.get('fundacion', 'Fundación Clínica Infantil Club Noel'), 'legacy-fundacion'),
+    ], [(1, 1, 1, 18)], None
+    
+    # FILA 2: Título y código
+    yield [
+        (1, 'Análisis de Modo de Fallos y Efectos (AMFE) de Equipos Biomédicos', 'legacy-titulo'),
+        (11, 'CÓDIGO:', 'legacy-label'),                          # K
+        (13, header.get('codigo', ''), 'legacy-cell-center'),     # M
+        (15, 'PAGINA', 'legacy-label'),                           # O
+        (16, header.get('pagina', '1'), 'legacy-cell-center'),    # P
+        (17, 'DE', 'legacy-label'),                               # Q
+        (18, header.get('año', ''), 'legacy-cell-center'),        # R
+    ], [(2, 1, 2, 10), (2, 11, 2, 12), (2, 13, 2, 14)], None     # A:J, K:L, M:N
+    
+    # FILA 3: Información de servicio
+    yield [
+        (1, 'SERVICIO', 'legacy-header'),                         # A
+        (2, header.get('servicio', ''), 'legacy-cell'),           # B:C
+        (4, 'ÁREA', 'legacy-header'),                             # D
+        (5, header.get('area', ''), 'legacy-cell'),               # E
+        (6, 'UCI', 'legacy-header'),                              # F
+        (7, header.get('uci', ''), 'legacy-cell'),                # G
+        (8, 'ELABORADO POR', 'legacy-header'),                    # H
+        (9, header.get('elaboradoPor', ''), 'legacy-cell'),       # I:J
+        (11, 'VERSIÓN:', 'legacy-label'),                         # K:L
+        (13, header.get('version', '1'), 'legacy-cell-center'),   # M:N
+        (15, 'DIA', 'legacy-label'),                              # O
+        (16, 'MES', 'legacy-label'),                              # P
+        (17, 'AÑO', 'legacy-label'),                              # Q:R
+    ], [(3, 2, 3, 3), (3, 9, 3, 10), (3, 11, 3, 12), (3, 13, 3, 14), (3, 17, 3, 18)], None
+    
+    # FILA 4: Proceso, equipo biomédico y fecha
+    dia, mes, anio = _parse_fecha(header)
+    yield [
+        (1, 'PROCESO', 'legacy-header'),                              # A
+        (2, '', 'legacy-border'),                                     # B:J
+        (11, 'EQUIPO BIOMÉDICO', 'legacy-label-fill'),                # K:L
+        (13, header.get('equipoBiomedico', ''), 'legacy-cell-center'),  # M:N
+        (15, dia, 'legacy-cell-center'),                              # O
+        (16, mes, 'legacy-cell-center'),                              # P
+        (17, anio, 'legacy-cell-center'),                             # Q:R
+    ], [(4, 2, 4, 10), (4, 11, 4, 12), (4, 13, 4, 14), (4, 17, 4, 18)], None
+    
+    # ENCABEZADOS DE LA TABLA (2 filas); todos combinan 2 filas salvo RPN (J:K)
+    table_headers = [
+        (1, 'PROCESO'),
+        (2, 'SUBPROCESO'),
+        (3, 'FALLA POTENCIAL DEL SUBPROCESO'),
+        (4, 'EFECTO POTENCIAL DE LA FALLA'),
+        (5, 'CAUSAS POTENCIALES'),
+        (6, 'BARRERAS EXISTENTES'),
+        (7, 'Severidad'),
+        (8, 'Detectabilidad'),
+        (9, 'Ocurrencia'),
+        (10, 'RPN'),
+        (12, 'ACCIONES RECOMENDADAS'),
+        (13, 'ACCIONES TOMADAS'),
+        (14, 'RESPONSABLE'),
+    ]
+    yield (
+        [(col, text, 'legacy-header') for col, text in table_headers],
+        [(5, 10, 5, 11) if col == 10 else (5, col, 6, col) for col, _ in table_headers],
+        30,
+    )
+    
+    # Segunda fila de headers (subcolumnas de RPN)
+    yield [
+        (10, 'TIPO DE RIESGO', 'legacy-label-fill'),  # J
+        (11, 'RPN', 'legacy-label-fill'),             # K
+    ], [], 20
+    
+    # DATOS DE LA TABLA
+    # Columnas: Proceso(0), Subproceso(1), Falla(2), Efecto(3), Severidad(4), 
+    # Causa(5), Ocurrencia(6), Barrera(7), Detectabilidad(8), RPN(9), TipoRiesgo(10), Acciones(11)
+    
+    for row_data in table_data:
+        # Asegurarse de que la fila tenga suficientes elementos (sin modificar matrix.data)
+        row_data = list(row_data) + [''] * (12 - len(row_data))
+        tipo_riesgo = row_data[10] or 'Bajo'
+        rpn_value = row_data[9] or 1
+        if conditional:
+            tipo_role, rpn_role = 'legacy-tipo-plain', 'legacy-rpn-plain'
+        else:
+            tipo_role = LEGACY_TIPO_ROLES.get(tipo_riesgo, 'legacy-tipo-bajo')
+            rpn_role = legacy_rpn_role(rpn_value)
+        
+        yield [
+            # Proceso (con color de proceso si tiene valor)
+            (1, row_data[0] or '', 'legacy-proceso' if row_data[0] else 'legacy-cell'),
+            # Subproceso, Falla, Efecto, Causas, Barreras
+            (2, row_data[1] or '', 'legacy-cell'),
+            (3, row_data[2] or '', 'legacy-cell'),
+            (4, row_data[3] or '', 'legacy-cell'),
+            (5, row_data[5] or '', 'legacy-cell'),
+            (6, row_data[7] or '', 'legacy-cell'),
+            # Severidad, Detectabilidad, Ocurrencia
+            (7, row_data[4] or '', 'legacy-cell-center'),
+            (8, row_data[8] or '', 'legacy-cell-center'),
+            (9, row_data[6] or '', 'legacy-cell-center'),
+            # Tipo de Riesgo y RPN, coloreados según su valor
+            (10, tipo_riesgo, tipo_role),
+            (11, rpn_value, rpn_role),
+            # Acciones Recomendadas; Acciones Tomadas y Responsable (vacíos por ahora)
+            (12, row_data[11] or '', 'legacy-cell'),
+            (13, '', 'legacy-cell'),
+            (14, '', 'legacy-cell'),
+        ], [], None
+
+
+def _falla_rows(falla: dict) -> int:
+    """Filas que ocupa una falla: la lista de elementos más larga (mínimo 1)"""
+    return max(
+        len(falla.get('efectosPotenciales', [])),
+        len(falla.get('causasPotenciales', [])),
+        len(falla.get('barrerasExistentes', [])),
+        len(falla.get('accionesRecomendadas', [])),
+        len(falla.get('accionesTomadas', [])),
+        1
+    )
+
+
+def _modular_fundacion(data: dict) -> str:
+    """Fundación de una matriz modular: título de la fila 1 y clave de su logo"""
+    return (data.get('header') or {}).get('fundacion') or MODULAR_DEFAULT_FUNDACION
+
+
+def _modular_rows(data: dict, conditional: bool = False):
+    """
+    Filas de la exportación modular con el formato EXACTO de Club Noel.
+    Las filas se generan en orden; las alturas de proceso/subproceso se
+    calculan antes de su primera fila para poder combinar las columnas A/B.
+    """
+    header = data.get('header', {})
+    procesos = data.get('procesos', [])
+    
+    # ==================== FILA 1: Título Principal (B1:K1) + Logo en A1 ====================
+    yield [
+        (1, None, 'border'),                                      # A1 (logo)
+        (2, _modular_fundacion(data), 'fundacion'),               # B1:K1
+        (12, 'CÓDIGO:', 'label-left'),                            # L
+        (13, header.get('codigo', ''), 'cell-center'),            # M
+        (14, 'VERSIÓN:', 'label-left'),                           # N
+        (15, header.get('version', '1'), 'cell-center'),          # O
+        (16, 'PAGINA', 'label'),                                  # P
+        (17, header.get('pagina', '1'), 'cell-center'),           # Q
+    ], [(1, 2, 1, 11)], None
+    
+    # ==================== FILA 2: Subtítulo (A2:K2) + FECHA ====================
+    yield [
+        (1, "Análisis de Modo de Fallos y Efectos (AMFE) de Equipos Biomédicos", 'subtitulo'),
+        (12, 'FECHA DE EMISIÓN:', 'label-left'),  # L
+        (13, '', 'border'),                       # M
+        (14, '', 'border'),                       # N
+        (15, 'DÍA', 'label'),                     # O
+        (16, 'MES', 'label'),                     # P
+        (17, 'AÑO', 'label'),                     # Q
+    ], [(2, 1, 2, 11)], None
+    
+    # ==================== FILA 3: Valores de Fecha (A3:N3 combinadas) ====================
+    dia, mes, año = _parse_fecha(header)
+    if dia:
+        dia, mes, año = str(dia), str(mes), str(año)
+    yield [(col, None, 'border') for col in range(1, 15)] + [
+        (15, dia, 'cell-center'),
+        (16, mes, 'cell-center'),
+        (17, año, 'cell-center'),
+    ], [(3, 1, 3, 14)], None
+    
+    # ==================== FILA 4: Información del Servicio ====================
+    yield [
+        (1, 'SERVICIO', 'label-green'),                                                    # A
+        (2, header.get('servicio', 'UNIDAD DE CUIDADOS INTENSIVOS'), 'label-green'),       # B:C
+        (3, None, 'border'),
+        (4, 'ÁREA', 'label-green'),                                                        # D
+        (5, header.get('area', 'UCI'), 'cell-center'),                                     # E
+        (6, 'ELABORADO POR', 'label-green'),                                               # F:H
+        (7, None, 'border'),
+        (8, None, 'border'),
+        (9, header.get('elaboradoPor', 'Ana María Toro Aguirre'), 'cell-center'),          # I
+        (10, 'EQUIPO BIOMÉDICO', 'label-green'),                                           # J:K
+        (11, None, 'border'),
+        (12, header.get('equipo', 'VENTILADOR DE ALTA FRECUENCIA'), 'cell-center'),       # L:M
+        (13, None, 'border'),
+        (14, 'MODELO/MARCA', 'label-green'),                                               # N
+        (15, header.get('modeloMarca', ''), 'cell-center'),                               # O:Q
+        (16, None, 'border'),
+        (17, None, 'border'),
+    ], [(4, 2, 4, 3), (4, 6, 4, 8), (4, 10, 4, 11), (4, 12, 4, 13), (4, 15, 4, 17)], None
+    
+    # ==================== FILA 5: Headers de la Tabla ====================
+    headers = [
+        'PROCESO',                          # A
+        'SUBPROCESO',                       # B
+        'FALLA POTENCIAL\nDEL SUBPROCESO',  # C
+        'EFECTO POTENCIAL\nDE LA FALLA',    # D
+        'CAUSAS\nPOTENCIALES',              # E
+        'BARRERAS\nEXISTENTES',             # F
+        'Severidad',                        # G
+        'Detectabilidad',                   # H
+        'Ocurrencia',                       # I
+        'RPN',                              # J
+        'TIPO DE\nRIESGO',                  # K
+        'ACCIONES\nRECOMENDATAS',           # L
+        'ACCIONES\nTOMADAS',                # M
+        'RESPONSABLE',                      # N
+        '',                                 # O
+        '',                                 # P
+        '',                                 # Q
+    ]
+    yield [(col, text, 'table-header') for col, text in enumerate(headers, start=1)], [], 40
+    
+    # ==================== DATOS: PROCESOS MODULARES ====================
+    current_row = MODULAR_FIRST_DATA_ROW
+    for proceso in procesos:
+        subprocesos = proceso.get('subprocesos', [])
+        proceso_top_role, proceso_span_role = proceso_roles(proceso.get('color', '#C6E0B4'))
+        proceso_rows = sum(_falla_rows(f) for s in subprocesos for f in s.get('fallasPotenciales', []))
+        proceso_start_row = current_row
+        
+        for subproceso in subprocesos:
+            fallas = subproceso.get('fallasPotenciales', [])
+            subproceso_rows = sum(_falla_rows(f) for f in fallas)
+            subproceso_start_row = current_row
+            
+            for falla in fallas:
+                efectos = falla.get('efectosPotenciales', [])
+                causas = falla.get('causasPotenciales', [])
+                barreras = falla.get('barrerasExistentes', [])
+                acciones_rec = falla.get('accionesRecomendadas', [])
+                acciones_tom = falla.get('accionesTomadas', [])
+                falla_rows = _falla_rows(falla)
+                
+                # Evaluación y tipo de riesgo (3 niveles: Alto/Medio/Bajo)
+                evaluacion = falla.get('evaluacion', {})
+                rpn = evaluacion.get('rpn', '')
+                tipo_riesgo, rpn_role, tipo_role = modular_risk(rpn)
+                if conditional:
+                    rpn_role, tipo_role = 'rpn-plain', 'tipo-plain' if tipo_riesgo else 'cell-center'
+                
+                # Columnas combinadas por falla: C (falla), G-I (evaluación),
+                # J (RPN), K (tipo de riesgo), N (responsable)
+                falla_cells = {
+                    3: (falla.get('descripcion', ''), 'cell'),
+                    7: (evaluacion.get('severidad', ''), 'cell-center'),
+                    8: (evaluacion.get('detectabilidad', ''), 'cell-center'),
+                    9: (evaluacion.get('ocurrencia', ''), 'cell-center'),
+                    10: (rpn, rpn_role),
+                    11: (tipo_riesgo, tipo_role),
+                    14: (falla.get('responsable', ''), 'cell'),
+                }
+                # Elementos fila por fila: D (efectos), E (causas), F (barreras),
+                # L (acciones recomendadas), M (acciones tomadas)
+                item_columns = {4: efectos, 5: causas, 6: barreras, 12: acciones_rec, 13: acciones_tom}
+                
+                for i in range(falla_rows):
+                    merges = []
+                    cells = []
+                    
+                    # A: proceso (combinado, con el color del proceso)
+                    if current_row == proceso_start_row:
+                        if proceso_rows > 1:
+                            merges.append((current_row, 1, current_row + proceso_rows - 1, 1))
+                        cells.append((1, proceso.get('nombre', ''), proceso_top_role))
+                    else:
+                        cells.append((1, None, proceso_span_role))
+                    
+                    # B: subproceso (combinado)
+                    if current_row == subproceso_start_row:
+                        if subproceso_rows > 1:
+                            merges.append((current_row, 2, current_row + subproceso_rows - 1, 2))
+                        cells.append((2, subproceso.get('nombre', ''), 'cell'))
+                    else:
+                        cells.append((2, None, 'border'))
+                    
+                    for col in (3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14):
+                        if col in falla_cells:
+                            if i == 0:
+                                if falla_rows > 1:
+                                    merges.append((current_row, col, current_row + falla_rows - 1, col))
+                                value, role = falla_cells[col]
+                                cells.append((col, value, role))
+                            else:
+                                # Bordes en celdas combinadas
+                                cells.append((col, None, 'border'))
+                        else:
+                            items = item_columns[col]
+                            cells.append((col, items[i]['descripcion'] if i < len(items) else '', 'cell'))
+                    
+                    yield cells, merges, None
+                    current_row += 1
+
+
+def plan_legacy(data: dict, conditional: bool = False) -> ExportPlan:
+    """Plan de la exportación clásica (tableData)"""
+    plan = ExportPlan.from_rows('legacy', _legacy_rows(data, conditional), LEGACY_COLUMN_WIDTHS)
+    if conditional:
+        plan.add_conditional_format('legacy-tipo', 10, LEGACY_FIRST_DATA_ROW)  # J
+        plan.add_conditional_format('legacy-rpn', 11, LEGACY_FIRST_DATA_ROW)   # K
+    return plan
+
+
+def plan_modular(data: dict, conditional: bool = False) -> ExportPlan:
+    """Plan de la exportación modular (formato Club Noel)"""
+    plan = ExportPlan.from_rows('modular', _modular_rows(data, conditional), MODULAR_COLUMN_WIDTHS,
+                                logo=_modular_fundacion(data))
+    if conditional:
+        plan.add_conditional_format('modular-rpn', 10, MODULAR_FIRST_DATA_ROW)   # J
+        plan.add_conditional_format('modular-tipo', 11, MODULAR_FIRST_DATA_ROW)  # K
+    return plan
+
+
+PLANNERS = {
+    'legacy': plan_legacy,
+    'modular': plan_modular,
+}
+
+
+def plan_export(kind: str, data: dict, conditional: bool = False) -> ExportPlan:
+    """
+    Plan de una exportación 'legacy' o 'modular' a partir del dict `data` de
+    la matriz; con `conditional` el color de RPN y tipo de riesgo va como
+    formato condicional.
+    """
+    return PLANNERS[kind](data, conditional)
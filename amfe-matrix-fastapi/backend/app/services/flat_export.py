@@ -0,0 +1,181 @@
+from io import StringIO
+from typing import Iterable, Iterator, List
+import csv
+import json
+
+from app.models import AMFEMatrix
+from app.schemas import FallaRecord
+from app.services.chunk_sink import ChunkSink
+from app.services.excel_styles import modular_risk
+
+# Columnas en el orden de FallaRecord
+FLAT_COLUMNS: List[str] = list(FallaRecord.model_fields)
+
+FLAT_MEDIA_TYPES = {
+    'csv': "text/csv; charset=utf-8",
+    'ndjson': "application/x-ndjson",
+    'parquet': "application/vnd.apache.parquet",
+}
+
+# Registros por bloque enviado (CSV/NDJSON) y por row group (Parquet)
+FLAT_CSV_BATCH = 500
+FLAT_PARQUET_ROW_GROUP = 10000
+
+
+def _descripcion(items: list, i: int):
+    return items[i].get('descripcion') if i < len(items) else None
+
+
+def iter_falla_records(matrix: AMFEMatrix) -> Iterator[dict]:
+    """
+    Registros planos (dicts con los campos de FallaRecord) de una matriz
+    modular: uno por falla e índice de la lista más larga entre efectos,
+    causas, barreras y acciones. Recorre `data` directamente, sin validar
+    con pydantic, para no duplicar la matriz en memoria.
+    """
+    data = matrix.data
+    header = data.get('header', {})
+    matrix_fields = {
+        "matrix_id": matrix.id,
+        "matrix_name": matrix.name,
+        "servicio": header.get('servicio', ''),
+        "area": header.get('area', ''),
+        "equipo": header.get('equipo', ''),
+    }
+
+    for proceso in data.get('procesos', []):
+        for subproceso in proceso.get('subprocesos', []):
+            for falla in subproceso.get('fallasPotenciales', []):
+                efectos = falla.get('efectosPotenciales', [])
+                causas = falla.get('causasPotenciales', [])
+                barreras = falla.get('barrerasExistentes', [])
+                recomendadas = falla.get('accionesRecomendadas', [])
+                tomadas = falla.get('accionesTomadas', [])
+                evaluacion = falla.get('evaluacion', {})
+                rpn = evaluacion.get('rpn')
+
+                falla_fields = {
+                    **matrix_fields,
+                    "proceso_id": proceso.get('id', ''),
+                    "proceso": proceso.get('nombre', ''),
+                    "subproceso_id": subproceso.get('id', ''),
+                    "subproceso": subproceso.get('nombre', ''),
+                    "falla_id": falla.get('id', ''),
+                    "falla": falla.get('descripcion', ''),
+                    "responsable": falla.get('responsable'),
+                    "severidad": evaluacion.get('severidad'),
+                    "detectabilidad": evaluacion.get('detectabilidad'),
+                    "ocurrencia": evaluacion.get('ocurrencia'),
+                    "rpn": rpn,
+                    "tipo_riesgo": modular_risk(rpn)[0] or None,
+                }
+                n = max(len(efectos), len(causas), len(barreras), len(recomendadas), len(tomadas), 1)
+                for i in range(n):
+                    yield {
+                        **falla_fields,
+                        "indice": i,
+                        "efecto": _descripcion(efectos, i),
+                        "causa": _descripcion(causas, i),
+                        "barrera": _descripcion(barreras, i),
+                        "accion_recomendada": _descripcion(recomendadas, i),
+                        "accion_tomada": _descripcion(tomadas, i),
+                    }
+
+
+def _records(matrices: Iterable[AMFEMatrix]) -> Iterator[dict]:
+    for matrix in matrices:
+        yield from iter_falla_records(matrix)
+
+
+def iter_csv(matrices: Iterable[AMFEMatrix]) -> Iterator[bytes]:
+    """CSV con encabezado, enviado en bloques de FLAT_CSV_BATCH registros"""
+    buffer = StringIO()
+    # Columnas por nombre: un campo de más o de menos falla en lugar de correr las columnas
+    writer = csv.DictWriter(buffer, fieldnames=FLAT_COLUMNS)
+    writer.writeheader()
+    pending = 0
+    for record in _records(matrices):
+        writer.writerow(record)
+        pending += 1
+        if pending >= FLAT_CSV_BATCH:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield buffer.getvalue().encode('utf-8')
+
+
+def iter_ndjson(matrices: Iterable[AMFEMatrix]) -> Iterator[bytes]:
+    """Un objeto JSON por línea, enviado en bloques de FLAT_CSV_BATCH registros"""
+    lines = []
+    for record in _records(matrices):
+        lines.append(json.dumps({name: record[name] for name in FLAT_COLUMNS}, ensure_ascii=False))
+        if len(lines) >= FLAT_CSV_BATCH:
+            yield ('\n'.join(lines) + '\n').encode('utf-8')
+            lines = []
+    if lines:
+        yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def _parquet_schema():
+    import pyarrow as pa
+    types = {int: pa.int64(), str: pa.string()}
+    fields = []
+    for name, field in FallaRecord.model_fields.items():
+        # Optional[X] -> X
+        annotation = field.annotation
+        base = next((t for t in getattr(annotation, '__args__', (annotation,)) if t is not type(None)), str)
+        fields.append(pa.field(name, types.get(base, pa.string()), nullable=not field.is_required()))
+    return pa.schema(fields)
+
+
+def parquet_available() -> bool:
+    """Parquet necesita pyarrow, que es opcional"""
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def iter_parquet(matrices: Iterable[AMFEMatrix]) -> Iterator[bytes]:
+    """
+    Parquet escrito por row groups de FLAT_PARQUET_ROW_GROUP registros; cada
+    row group se envía apenas se escribe (el pie del archivo va al final).
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _parquet_schema()
+    sink = ChunkSink()
+    columns = {name: [] for name in FLAT_COLUMNS}
+
+    def flush(writer):
+        writer.write_table(pa.Table.from_arrays([pa.array(columns[f.name], type=f.type) for f in schema],
+                                                schema=schema))
+        for col in columns.values():
+            col.clear()
+
+    rows = 0
+    writer = pq.ParquetWriter(sink, schema, compression='snappy')
+    try:
+        for record in _records(matrices):
+            for name, col in columns.items():
+                col.append(record[name])
+            rows += 1
+            if rows >= FLAT_PARQUET_ROW_GROUP:
+                flush(writer)
+                rows = 0
+                yield sink.drain()
+        if rows:
+            flush(writer)
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+FLAT_WRITERS = {
+    'csv': iter_csv,
+    'ndjson': iter_ndjson,
+    'parquet': iter_parquet,
+}
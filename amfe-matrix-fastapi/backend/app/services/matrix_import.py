@@ -0,0 +1,352 @@
+"""
+Importación masiva de matrices modulares (POST /matrices/modular/import).
+
+El cuerpo es NDJSON (un MatrixModularCreate por línea) o un arreglo JSON de
+MatrixModularCreate, y se lee a medida que llega: cada documento se valida
+apenas se completa y solo se retiene el lote en curso. Cada lote se inserta
+en una transacción con un INSERT masivo (más las tablas normalizadas y el
+resumen de riesgo); si el lote falla en la base, se reintenta matriz por
+matriz para aislar las que fallan. Los errores se informan por documento (posición en el cuerpo)
+sin abortar el resto de la importación.
+"""
+from codecs import getincrementaldecoder
+from typing import AsyncIterator, List, Optional, Tuple
+import json
+import logging
+import os
+import re
+import time
+
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import AMFEMatrix
+from app.schemas import MatrixModularCreate
+from app.services.modular_tables import build_modular_rows
+from app.services.risk_summary import build_risk_summary
+from app.services.revisions import build_revision
+
+logger = logging.getLogger(__name__)
+
+# Matrices por transacción (el parámetro batch_size de la ruta lo puede cambiar hasta IMPORT_MAX_BATCH_SIZE)
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "100"))
+IMPORT_MAX_BATCH_SIZE = int(os.getenv("IMPORT_MAX_BATCH_SIZE", "1000"))
+# Errores detallados en el informe; el resto solo se cuenta
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))
+# Tamaño máximo de un documento sin terminar en el buffer de lectura
+IMPORT_MAX_DOCUMENT_BYTES = int(os.getenv("IMPORT_MAX_DOCUMENT_BYTES", str(50 * 1024 * 1024)))
+
+NDJSON_MEDIA_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+JSON_MEDIA_TYPE = "application/json"
+
+# Errores de validación informados por documento
+MAX_ERRORS_PER_DOCUMENT = 10
+
+_WHITESPACE = ' \t\r\n'
+
+
+class ImportFormatError(Exception):
+    """El cuerpo no se puede seguir leyendo (JSON mal formado, documento demasiado grande)"""
+
+
+class DocumentError(Exception):
+    """Un documento no se pudo leer; se informa con su posición y se sigue con el resto"""
+
+    def __init__(self, name: Optional[str], errors: List[str]):
+        super().__init__("; ".join(errors))
+        self.name = name
+        self.errors = errors
+
+
+# ==================== LECTURA DEL CUERPO ====================
+
+def _decoder():
+    return getincrementaldecoder('utf-8')()
+
+
+def _decode(decoder, chunk: bytes, final: bool = False) -> str:
+    try:
+        return decoder.decode(chunk, final)
+    except UnicodeDecodeError as exc:
+        raise ImportFormatError(f"Body is not valid UTF-8: {exc}")
+
+
+def _check_buffer(size: int):
+    if size > IMPORT_MAX_DOCUMENT_BYTES:
+        raise ImportFormatError(f"A document exceeds {IMPORT_MAX_DOCUMENT_BYTES} bytes")
+
+
+def _parse_line(line: str):
+    try:
+        return json.loads(line)
+    except ValueError as exc:
+        return DocumentError(None, [f"Invalid JSON: {exc}"])
+
+
+def _parse_lines(lines: List[str]) -> list:
+    return [_parse_line(line) for line in lines if line.strip()]
+
+
+async def iter_ndjson_documents(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, object]]:
+    """
+    (posición, documento) de un cuerpo NDJSON. Una línea que no es JSON
+    válido se entrega como DocumentError, para informarla y seguir. Las
+    líneas se parsean en el pool de hilos para no bloquear el event loop.
+    """
+    decoder = _decoder()
+    buffer = ''
+    index = 0
+    async for chunk in chunks:
+        buffer += _decode(decoder, chunk)
+        *lines, buffer = buffer.split('\n')
+        if lines:
+            for document in await run_in_threadpool(_parse_lines, lines):
+                yield index, document
+                index += 1
+        _check_buffer(len(buffer))
+    buffer += _decode(decoder, b'', final=True)
+    if buffer.strip():
+        yield index, await run_in_threadpool(_parse_line, buffer)
+
+
+# Caracteres que cambian el estado del escaneo fuera y dentro de una cadena
+_STRUCTURAL = re.compile(r'[{}\[\]"]')
+_STRING_SPECIAL = re.compile(r'["\\]')
+# Fin de un elemento escalar (número, true, false, null)
+_SCALAR_END = re.compile(r'[\s,\]]')
+
+
+class _JsonArrayReader:
+    """
+    Separa los elementos de un arreglo JSON que llega por partes. Cada parte
+    se recorre una sola vez: del elemento en curso se guardan la profundidad
+    de anidamiento y si se está dentro de una cadena (o tras un escape), y el
+    elemento se parsea con json.loads una única vez cuando se cierra.
+    """
+
+    def __init__(self):
+        self._parts: Optional[List[str]] = None  # Texto del elemento en curso (None entre elementos)
+        self._size = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._scalar = False
+        self._count = 0
+        self._state = 'start'  # start -> first -> (item <-> separator) -> end
+
+    def _start_item(self, char: str):
+        self._parts, self._size = [], 0
+        self._depth = 1 if char in '{[' else 0
+        self._in_string = char == '"'
+        self._escape = False
+        self._scalar = char not in '{["'
+
+    def _scan_item(self, text: str, pos: int) -> Optional[int]:
+        """Fin (exclusivo) del elemento en curso dentro de `text`, o None si sigue en la próxima parte"""
+        if self._scalar:
+            match = _SCALAR_END.search(text, pos)
+            return match.start() if match else None
+        while True:
+            if self._escape:
+                if pos >= len(text):
+                    return None
+                self._escape, pos = False, pos + 1
+            if self._in_string:
+                match = _STRING_SPECIAL.search(text, pos)
+                if not match:
+                    return None
+                pos = match.end()
+                if match.group() == '\\':
+                    self._escape = True
+                    continue
+                self._in_string = False
+                if self._depth == 0:
+                    return pos
+            else:
+                match = _STRUCTURAL.search(text, pos)
+                if not match:
+                    return None
+                pos = match.end()
+                char = match.group()
+                if char == '"':
+                    self._in_string = True
+                elif char in '{[':
+                    self._depth += 1
+                else:
+                    self._depth -= 1
+                    if self._depth == 0:
+                        return pos
+
+    def _end_item(self, text: str) -> object:
+        text = ''.join(self._parts) + text
+        self._parts = None
+        try:
+            item = json.loads(text)
+        except ValueError as exc:
+            raise ImportFormatError(f"Invalid JSON in item {self._count}: {exc}")
+        self._count += 1
+        self._state = 'separator'
+        return item
+
+    def feed(self, text: str, final: bool = False) -> List[object]:
+        items = []
+        pos = 0
+        item_start = 0  # Un elemento que viene de la parte anterior sigue desde el principio de `text`
+        while True:
+            if self._parts is not None:
+                end = self._scan_item(text, pos)
+                if end is None and final and self._scalar:
+                    end = len(text)
+                if end is None:
+                    self._parts.append(text[item_start:])
+                    self._size += len(text) - item_start
+                    _check_buffer(self._size)
+                    break
+                items.append(self._end_item(text[item_start:end]))
+                pos = end
+                continue
+            while pos < len(text) and text[pos] in _WHITESPACE:
+                pos += 1
+            if pos >= len(text):
+                break
+            char = text[pos]
+            if self._state == 'start':
+                if char != '[':
+                    raise ImportFormatError("Body must be a JSON array (or NDJSON with an NDJSON content type)")
+                self._state, pos = 'first', pos + 1
+            elif self._state == 'separator':
+                if char not in ',]':
+                    raise ImportFormatError(f"Expected ',' or ']' after item {self._count - 1}")
+                self._state, pos = ('item' if char == ',' else 'end'), pos + 1
+            elif self._state == 'end':
+                raise ImportFormatError("Unexpected data after the JSON array")
+            elif self._state == 'first' and char == ']':
+                self._state, pos = 'end', pos + 1
+            else:
+                self._start_item(char)
+                item_start = pos
+                pos += 0 if self._scalar else 1
+        if final and self._state != 'end':
+            raise ImportFormatError("Unexpected end of the JSON array")
+        return items
+
+
+async def iter_json_array_documents(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, object]]:
+    """
+    (posición, documento) de un cuerpo que es un arreglo JSON. Cada parte se
+    separa y parsea en el pool de hilos para no bloquear el event loop.
+    """
+    decoder = _decoder()
+    reader = _JsonArrayReader()
+    index = 0
+    async for chunk in chunks:
+        for item in await run_in_threadpool(reader.feed, _decode(decoder, chunk)):
+            yield index, item
+            index += 1
+    for item in await run_in_threadpool(reader.feed, _decode(decoder, b'', final=True), True):
+        yield index, item
+        index += 1
+
+
+# ==================== IMPORTACIÓN ====================
+
+def _add_error(report: dict, index: int, name, errors: List[str]):
+    report["failed"] += 1
+    if len(report["errors"]) < IMPORT_MAX_ERRORS:
+        report["errors"].append({"index": index, "name": name if isinstance(name, str) else None, "errors": errors})
+    else:
+        report["errors_truncated"] = True
+
+
+def _validation_errors(exc: ValidationError) -> List[str]:
+    return [
+        f"{'/'.join(str(part) for part in error['loc'])}: {error['msg']}"
+        for error in exc.errors()[:MAX_ERRORS_PER_DOCUMENT]
+    ]
+
+
+def _matrix_row(matrix: MatrixModularCreate, user_id: int) -> dict:
+    # Mismo documento que guarda create_modular_matrix
+    return {
+        "name": matrix.name,
+        "description": matrix.description,
+        "data": {"type": "modular", **matrix.data.dict()},
+        "created_by": user_id,
+    }
+
+
+async def _insert_rows(db: AsyncSession, rows: List[dict]) -> List[int]:
+    # INSERT masivo (insertmanyvalues) con los ids en el orden de las filas
+    result = await db.execute(insert(AMFEMatrix).returning(AMFEMatrix.id, sort_by_parameter_order=True), rows)
+    ids = result.scalars().all()
+    for matrix_id, row in zip(ids, rows):
+        db.add_all(build_modular_rows(matrix_id, row["data"]))
+        db.add(build_risk_summary(matrix_id, row["data"]))
+        document = {key: row[key] for key in ("name", "description", "data")}
+        db.add(build_revision(matrix_id, document, user_id=row["created_by"]))
+    await db.flush()
+    return ids
+
+
+async def _insert_batch(db: AsyncSession, batch: List[Tuple[int, dict]], report: dict):
+    try:
+        ids = await _insert_rows(db, [row for _, row in batch])
+        await db.commit()
+    except SQLAlchemyError:
+        await db.rollback()
+        # Aislar las matrices que fallan: una transacción por matriz
+        ids = []
+        for index, row in batch:
+            try:
+                ids.extend(await _insert_rows(db, [row]))
+                await db.commit()
+            except SQLAlchemyError as exc:
+                await db.rollback()
+                _add_error(report, index, row["name"], [f"Database error: {getattr(exc, 'orig', None) or exc}"])
+    report["imported"] += len(ids)
+    report["ids"].extend(ids)
+
+
+async def import_modular_matrices(db: AsyncSession, documents: AsyncIterator[Tuple[int, object]], user_id: int,
+                                  batch_size: int = IMPORT_BATCH_SIZE) -> dict:
+    """
+    Validar e insertar los documentos (de iter_ndjson_documents,
+    iter_json_array_documents o excel_import.iter_workbook_documents) en lotes de `batch_size`. Devuelve el informe
+    (ver BulkImportResult) con los ids creados, los errores por documento y
+    el rendimiento en matrices por segundo. Si el cuerpo deja de poder
+    leerse, se guarda lo ya validado y el motivo queda en `aborted`.
+    """
+    start = time.perf_counter()
+    report = {"received": 0, "imported": 0, "failed": 0, "ids": [], "errors": [],
+              "errors_truncated": False, "aborted": None}
+    batch: List[Tuple[int, dict]] = []
+    try:
+        async for index, document in documents:
+            report["received"] += 1
+            if isinstance(document, DocumentError):
+                _add_error(report, index, document.name, document.errors)
+                continue
+            try:
+                matrix = MatrixModularCreate.model_validate(document)
+            except ValidationError as exc:
+                name = document.get("name") if isinstance(document, dict) else None
+                _add_error(report, index, name, _validation_errors(exc))
+                continue
+            batch.append((index, _matrix_row(matrix, user_id)))
+            if len(batch) >= batch_size:
+                await _insert_batch(db, batch, report)
+                batch = []
+    except ImportFormatError as exc:
+        report["aborted"] = str(exc)
+    if batch:
+        await _insert_batch(db, batch, report)
+
+    elapsed = time.perf_counter() - start
+    report["elapsed_s"] = round(elapsed, 3)
+    report["matrices_per_second"] = round(report["imported"] / elapsed, 1) if elapsed > 0 else None
+    logger.info("Importación: %d recibidas, %d importadas, %d con error en %.2f s (%s matrices/s)",
+                report["received"], report["imported"], report["failed"], elapsed, report["matrices_per_second"])
+    return report
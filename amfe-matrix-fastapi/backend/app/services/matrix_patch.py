@@ -0,0 +1,382 @@
+"""
+Actualización parcial (PATCH) de matrices modulares.
+
+El documento que se parchea tiene la forma de MatrixModularCreate:
+{"name", "description", "data": {"header", "procesos"}}. Se aceptan:
+
+- JSON Patch (RFC 6902, application/json-patch+json). En las listas de
+  procesos, subprocesos, fallas e items, los segmentos de la ruta son el
+  `id` estable del elemento y no su posición, p. ej.
+  /data/procesos/p1/subprocesos/s1/fallasPotenciales/f1/causasPotenciales/c2/descripcion.
+  `-` agrega al final y `add` sobre un id inserta antes de ese elemento.
+- JSON Merge Patch (RFC 7396, application/merge-patch+json). Además de lo
+  estándar (un arreglo reemplaza la lista completa), una lista de elementos
+  con id puede recibir un objeto indexado por id: {"p1": {...}} combina el
+  elemento, {"p9": {...}} lo agrega y {"p1": null} lo quita.
+
+Solo se copian los contenedores de las rutas tocadas y solo se validan, con
+los modelos de app.schemas, los campos y elementos que cambiaron (más la
+cantidad mínima de elementos de las listas modificadas). El RPN se
+recalcula solo en las evaluaciones de las fallas afectadas.
+"""
+from copy import copy, deepcopy
+from functools import lru_cache
+from typing import Annotated, Any, List, Optional, Set, Tuple, Union
+import typing
+
+from annotated_types import MinLen
+from pydantic import BaseModel, TypeAdapter, ValidationError
+
+from app.models import AMFEMatrix
+from app.schemas import Evaluacion, MatrixModularCreate
+
+JSON_PATCH_MEDIA_TYPE = "application/json-patch+json"
+MERGE_PATCH_MEDIA_TYPE = "application/merge-patch+json"
+PATCH_MEDIA_TYPES = (JSON_PATCH_MEDIA_TYPE, MERGE_PATCH_MEDIA_TYPE)
+
+JSON_PATCH_OPS = ('add', 'remove', 'replace', 'move', 'copy', 'test')
+
+# Modelos con campos calculados a partir de otros (rpn = S × D × O): si se
+# toca cualquiera de sus campos se revalidan completos
+DERIVED_FIELD_MODELS = (Evaluacion,)
+
+# Ubicación tocada por el parche: (ruta del contenedor padre, clave o id)
+Location = Tuple[Tuple[str, ...], str]
+
+
+class PatchError(Exception):
+    """Parche mal formado, ruta inexistente o resultado que no valida"""
+
+
+class PatchTestFailed(PatchError):
+    """Falló una operación `test` del JSON Patch"""
+
+
+def matrix_document(matrix: AMFEMatrix) -> dict:
+    """Documento a parchear: nombre, descripción y `data` sin la marca type=modular"""
+    data = {key: value for key, value in matrix.data.items() if key != 'type'}
+    return {"name": matrix.name, "description": matrix.description, "data": data}
+
+
+def apply_patch(document: dict, patch: Any, media_type: str) -> dict:
+    """
+    Aplicar un JSON Patch o un merge patch a `document` (de matrix_document).
+    No modifica `document`: devuelve uno nuevo que comparte los subárboles no
+    tocados. PatchError si el parche no se puede aplicar o no valida.
+    """
+    doc = _Document(document)
+    touched: Set[Location] = set()
+    if media_type == JSON_PATCH_MEDIA_TYPE:
+        if not isinstance(patch, list):
+            raise PatchError("A JSON Patch must be an array of operations")
+        for operation in patch:
+            _apply_operation(doc, operation, touched)
+    elif media_type == MERGE_PATCH_MEDIA_TYPE:
+        if not isinstance(patch, dict):
+            raise PatchError("A merge patch must be an object")
+        _merge(doc, (), doc.root, MatrixModularCreate, patch, touched)
+    else:
+        raise PatchError(f"Unsupported patch media type '{media_type}'")
+    _validate(doc, touched)
+    return doc.root
+
+
+# ==================== ESQUEMA ====================
+
+def _is_model(annotation) -> bool:
+    return isinstance(annotation, type) and issubclass(annotation, BaseModel)
+
+
+def _unwrap_optional(annotation):
+    if typing.get_origin(annotation) is Union:
+        args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+        if len(args) == 1:
+            return args[0]
+    return annotation
+
+
+def _field(model, key: str):
+    field = model.model_fields.get(key)
+    if field is None:
+        raise PatchError(f"Unknown field '{key}'")
+    return field
+
+
+def _child_schema(model, key: str):
+    """(modelo del objeto, modelo de los elementos) del campo `key`; None si no aplica"""
+    annotation = _unwrap_optional(_field(model, key).annotation)
+    if typing.get_origin(annotation) in (list, List):
+        (item,) = typing.get_args(annotation)
+        return None, item if _is_model(item) else None
+    return (annotation if _is_model(annotation) else None), None
+
+
+@lru_cache(maxsize=None)
+def _field_adapter(model, key: str) -> TypeAdapter:
+    field = model.model_fields[key]
+    if field.metadata:
+        return TypeAdapter(Annotated[(field.annotation, *field.metadata)])
+    return TypeAdapter(field.annotation)
+
+
+@lru_cache(maxsize=None)
+def _model_adapter(model) -> TypeAdapter:
+    return TypeAdapter(model)
+
+
+def _min_length(model, key: str) -> int:
+    return max((m.min_length for m in model.model_fields[key].metadata if isinstance(m, MinLen)), default=0)
+
+
+# ==================== DOCUMENTO ====================
+
+def _pointer(tokens) -> str:
+    return ''.join('/' + str(token).replace('~', '~0').replace('/', '~1') for token in tokens)
+
+
+def _find(items: list, item_id: str) -> Optional[int]:
+    for i, item in enumerate(items):
+        if isinstance(item, dict) and item.get('id') == item_id:
+            return i
+    return None
+
+
+def _index(items: list, item_id: str, tokens) -> int:
+    i = _find(items, item_id)
+    if i is None:
+        raise PatchError(f"No item with id '{item_id}' at '{_pointer(tokens)}'")
+    return i
+
+
+def _item_id(value) -> str:
+    if not isinstance(value, dict) or not isinstance(value.get('id'), str):
+        raise PatchError("List items must be objects with a string 'id'")
+    return value['id']
+
+
+class _Document:
+    """
+    Documento con copia en escritura: antes de modificar un contenedor se
+    copia (superficialmente) toda la ruta hasta él, así el documento original
+    (y el `data` de la matriz cargada) no se modifican.
+    """
+
+    def __init__(self, root: dict):
+        self.root = copy(root)
+        self._owned = [self.root]
+        self._owned_ids = {id(self.root)}
+
+    def own(self, container, key):
+        """El hijo `key` de `container`, copiado si todavía no es propio"""
+        child = container[key]
+        if isinstance(child, (dict, list)) and id(child) not in self._owned_ids:
+            child = copy(child)
+            container[key] = child
+            self._owned.append(child)
+            self._owned_ids.add(id(child))
+        return child
+
+    def walk(self, tokens, write: bool = False):
+        """
+        Contenedor en la ruta `tokens` y su esquema: ('object', modelo) para
+        objetos o ('list', (modelo dueño, campo, modelo de los elementos))
+        """
+        node, kind, schema = self.root, 'object', MatrixModularCreate
+        for depth, token in enumerate(tokens):
+            where = tokens[:depth + 1]
+            if kind == 'object':
+                if not isinstance(node, dict) or token not in node:
+                    raise PatchError(f"Path not found: '{_pointer(where)}'")
+                child_model, item_model = _child_schema(schema, token)
+                key = token
+                if item_model is not None:
+                    next_kind, next_schema = 'list', (schema, token, item_model)
+                elif child_model is not None:
+                    next_kind, next_schema = 'object', child_model
+                else:
+                    raise PatchError(f"Path not found: '{_pointer(where)}'")
+            else:
+                key = _index(node, token, where)
+                next_kind, next_schema = 'object', schema[2]
+            node = self.own(node, key) if write else node[key]
+            kind, schema = next_kind, next_schema
+            if not isinstance(node, dict if kind == 'object' else list):
+                raise PatchError(f"Path not found: '{_pointer(where)}'")
+        return node, kind, schema
+
+
+# ==================== JSON PATCH ====================
+
+def _parse_pointer(pointer) -> Tuple[str, ...]:
+    if not isinstance(pointer, str) or not pointer.startswith('/'):
+        raise PatchError(f"Invalid path '{pointer}'; the whole document can only be replaced with PUT")
+    return tuple(token.replace('~1', '/').replace('~0', '~') for token in pointer[1:].split('/'))
+
+
+def _get(doc: _Document, tokens):
+    parent, kind, _ = doc.walk(tokens[:-1])
+    key = tokens[-1]
+    if kind == 'object':
+        if key not in parent:
+            raise PatchError(f"Path not found: '{_pointer(tokens)}'")
+        return parent[key]
+    return parent[_index(parent, key, tokens)]
+
+
+def _add(doc: _Document, tokens, value, touched: Set[Location]):
+    parent, kind, schema = doc.walk(tokens[:-1], write=True)
+    key = tokens[-1]
+    if kind == 'object':
+        _field(schema, key)
+        parent[key] = value
+    else:
+        new_id = _item_id(value)
+        if _find(parent, new_id) is not None:
+            raise PatchError(f"Duplicate id '{new_id}' at '{_pointer(tokens[:-1])}'")
+        if key == '-':
+            parent.append(value)
+        else:
+            parent.insert(_index(parent, key, tokens), value)
+        key = new_id
+    touched.add((tokens[:-1], key))
+
+
+def _remove(doc: _Document, tokens, touched: Set[Location]):
+    parent, kind, schema = doc.walk(tokens[:-1], write=True)
+    key = tokens[-1]
+    if kind == 'object':
+        _field(schema, key)
+        if key not in parent:
+            raise PatchError(f"Path not found: '{_pointer(tokens)}'")
+        del parent[key]
+    else:
+        parent.pop(_index(parent, key, tokens))
+    touched.add((tokens[:-1], key))
+
+
+def _replace(doc: _Document, tokens, value, touched: Set[Location]):
+    parent, kind, schema = doc.walk(tokens[:-1], write=True)
+    key = tokens[-1]
+    if kind == 'object':
+        _field(schema, key)
+        if key not in parent:
+            raise PatchError(f"Path not found: '{_pointer(tokens)}'")
+        parent[key] = value
+    else:
+        i = _index(parent, key, tokens)
+        new_id = _item_id(value)
+        if new_id != key and _find(parent, new_id) is not None:
+            raise PatchError(f"Duplicate id '{new_id}' at '{_pointer(tokens[:-1])}'")
+        parent[i] = value
+        key = new_id
+    touched.add((tokens[:-1], key))
+
+
+def _apply_operation(doc: _Document, operation, touched: Set[Location]):
+    if not isinstance(operation, dict) or operation.get('op') not in JSON_PATCH_OPS:
+        raise PatchError(f"Invalid patch operation {operation!r}; op must be one of {', '.join(JSON_PATCH_OPS)}")
+    op = operation['op']
+    tokens = _parse_pointer(operation.get('path'))
+    if op in ('add', 'replace', 'test') and 'value' not in operation:
+        raise PatchError(f"Operation '{op}' requires a value")
+
+    if op == 'add':
+        _add(doc, tokens, operation['value'], touched)
+    elif op == 'remove':
+        _remove(doc, tokens, touched)
+    elif op == 'replace':
+        _replace(doc, tokens, operation['value'], touched)
+    elif op == 'test':
+        if _get(doc, tokens) != operation['value']:
+            raise PatchTestFailed(f"Test failed at '{_pointer(tokens)}'")
+    else:
+        source = _parse_pointer(operation.get('from'))
+        if op == 'move':
+            if tokens[:len(source)] == source and len(tokens) > len(source):
+                raise PatchError("Cannot move a value into one of its children")
+            value = _get(doc, source)
+            _remove(doc, source, touched)
+        else:
+            value = deepcopy(_get(doc, source))
+        _add(doc, tokens, value, touched)
+
+
+# ==================== MERGE PATCH ====================
+
+def _strip_nulls(value):
+    # Un objeto nuevo se combina contra {}: sus claves null no se guardan
+    if isinstance(value, dict):
+        return {k: _strip_nulls(v) for k, v in value.items() if v is not None}
+    return value
+
+
+def _merge(doc: _Document, tokens, node: dict, model, patch: dict, touched: Set[Location]):
+    for key, value in patch.items():
+        child_model, item_model = _child_schema(model, key)
+        current = node.get(key)
+        if value is None:
+            if key in node:
+                del node[key]
+            touched.add((tokens, key))
+        elif child_model is not None and isinstance(value, dict) and isinstance(current, dict):
+            _merge(doc, tokens + (key,), doc.own(node, key), child_model, value, touched)
+        elif item_model is not None and isinstance(value, dict) and isinstance(current, list):
+            _merge_items(doc, tokens + (key,), doc.own(node, key), item_model, value, touched)
+        else:
+            node[key] = _strip_nulls(value)
+            touched.add((tokens, key))
+
+
+def _merge_items(doc: _Document, tokens, items: list, item_model, patch: dict, touched: Set[Location]):
+    """Lista de elementos con id combinada con un objeto {id: parche del elemento}"""
+    for item_id, item_patch in patch.items():
+        i = _find(items, item_id)
+        if item_patch is None:
+            if i is not None:
+                items.pop(i)
+            touched.add((tokens, item_id))
+        elif not isinstance(item_patch, dict):
+            raise PatchError(f"Item '{item_id}' at '{_pointer(tokens)}' must be an object or null")
+        elif item_patch.get('id', item_id) != item_id:
+            raise PatchError(f"Item '{item_id}' at '{_pointer(tokens)}' cannot change its id")
+        elif i is not None:
+            _merge(doc, tokens + (item_id,), doc.own(items, i), item_model, item_patch, touched)
+        else:
+            items.append({'id': item_id, **_strip_nulls(item_patch)})
+            touched.add((tokens, item_id))
+
+
+# ==================== VALIDACIÓN ====================
+
+def _validated(adapter: TypeAdapter, value, tokens):
+    try:
+        return adapter.dump_python(adapter.validate_python(value))
+    except ValidationError as exc:
+        errors = '; '.join(
+            f"{_pointer(tuple(tokens) + tuple(error['loc']))}: {error['msg']}" for error in exc.errors()[:5]
+        )
+        raise PatchError(f"Invalid value: {errors}")
+
+
+def _validate(doc: _Document, touched: Set[Location]):
+    # Los más profundos primero: si también se tocó un ancestro, su validación ve los valores ya normalizados
+    for tokens, key in sorted(touched, key=lambda location: -len(location[0])):
+        try:
+            parent, kind, schema = doc.walk(tokens, write=True)
+        except PatchError:
+            continue  # Otra operación quitó el contenedor
+        if kind == 'object':
+            if key in parent:
+                parent[key] = _validated(_field_adapter(schema, key), parent[key], tokens + (key,))
+            elif schema.model_fields[key].is_required():
+                raise PatchError(f"'{_pointer(tokens + (key,))}' is required")
+            if issubclass(schema, DERIVED_FIELD_MODELS):
+                parent.update(_validated(_model_adapter(schema), parent, tokens))
+        else:
+            owner, field, item_model = schema
+            minimum = _min_length(owner, field)
+            if len(parent) < minimum:
+                raise PatchError(f"'{_pointer(tokens)}' must have at least {minimum} item(s)")
+            i = _find(parent, key)
+            if i is not None:
+                parent[i] = _validated(_model_adapter(item_model), parent[i], tokens + (key,))
@@ -1,24 +1,79 @@
-from sqlalchemy.orm import Session
-from app.models import AMFEMatrix, User
-from app.schemas import MatrixCreate
-from typing import List
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models import AMFEMatrix, MatrixRiskSummary, User, matrix_type, matrix_servicio, matrix_area, matrix_equipo
+from app.database import SessionLocal
+from app.schemas import MatrixCreate, MatrixModularCreate
+from app.services.export_cache import export_cache
+from app.services.modular_tables import sync_modular_tables, delete_modular_tables
+from app.services.risk_summary import sync_risk_summary, delete_risk_summary
+from app.services.revisions import record_revision, delete_revisions, revision_document
+from app.services.pagination import paginate, split_page
+from app.services.excel_assets import logo_cache
+from app.services.excel_styles import WorkbookStyles, conditional_rules
+from app.services.export_plan import ExportPlan, plan_export, plan_legacy, plan_modular
+from typing import List, IO, Iterator, Optional, Tuple
 from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.utils import get_column_letter
-from openpyxl.drawing.image import Image
+from openpyxl.worksheet.merge import MergedCellRange, MergedCell
+from openpyxl.worksheet._writer import WorksheetWriter
+from openpyxl.xml.functions import Element
+import openpyxl
 from io import BytesIO
 from datetime import datetime
-import os
+import tempfile
 
-def get_matrices(db: Session, skip: int = 0, limit: int = 100) -> List[AMFEMatrix]:
-    """Obtener todas las matrices AMFE"""
-    return db.query(AMFEMatrix).offset(skip).limit(limit).all()
+# Las rutas usan AsyncSession (app.database.get_async_db); iter_matrices y
+# los scripts siguen con la sesión sync.
 
-def get_matrix(db: Session, matrix_id: int) -> AMFEMatrix:
+async def get_matrices(db: AsyncSession, skip: int = 0, limit: int = 100, cursor: Optional[str] = None,
+                       **filters) -> Tuple[List[AMFEMatrix], Optional[str]]:
+    """
+    Obtener una página de matrices AMFE, opcionalmente filtradas en SQL (ver
+    filter_matrices), y el cursor de la página siguiente (ver pagination)
+    """
+    query = paginate(filter_matrices(select(AMFEMatrix), **filters), AMFEMatrix.id, skip, limit, cursor)
+    return split_page((await db.scalars(query)).all(), limit, lambda matrix: matrix.id)
+
+async def get_matrix_summaries(db: AsyncSession, skip: int = 0, limit: int = 100, cursor: Optional[str] = None,
+                               **filters) -> Tuple[List[dict], Optional[str]]:
+    """
+    Listado liviano de matrices (ver MatrixSummary): la consulta proyecta solo
+    columnas escalares y campos del encabezado extraídos en SQL, sin
+    transferir `data`. Los totales de riesgo salen de amfe_matrix_risk
+    (vacíos para las matrices clásicas).
+    """
+    risk = MatrixRiskSummary
+    query = select(
+        AMFEMatrix.id, AMFEMatrix.name, AMFEMatrix.description,
+        matrix_type.label('type'), matrix_servicio.label('servicio'),
+        matrix_area.label('area'), matrix_equipo.label('equipo'),
+        risk.max_rpn, risk.mean_rpn, risk.procesos, risk.subprocesos, risk.fallas,
+        risk.riesgo_alto, risk.riesgo_medio, risk.riesgo_bajo, risk.sin_evaluar,
+        risk.acciones_recomendadas, risk.acciones_abiertas,
+        AMFEMatrix.created_by, AMFEMatrix.created_at, AMFEMatrix.updated_at,
+    ).outerjoin(risk, risk.matrix_id == AMFEMatrix.id)
+    rows = await db.execute(paginate(filter_matrices(query, **filters), AMFEMatrix.id, skip, limit, cursor))
+    return split_page([row._asdict() for row in rows], limit, lambda row: row['id'])
+
+async def get_matrix_version(db: AsyncSession, matrix_id: int):
+    """id, version, updated_at y type de una matriz, sin cargar `data` (para ETags); None si no existe"""
+    query = select(
+        AMFEMatrix.id, AMFEMatrix.version, AMFEMatrix.updated_at, matrix_type.label('type')
+    ).where(AMFEMatrix.id == matrix_id)
+    return (await db.execute(query)).first()
+
+async def get_matrices_version(db: AsyncSession, **filters):
+    """Cantidad, suma de `version` y mayor id de las matrices que cumplen los filtros (ETag del listado)"""
+    query = select(func.count(AMFEMatrix.id), func.sum(AMFEMatrix.version), func.max(AMFEMatrix.id))
+    return (await db.execute(filter_matrices(query, **filters).order_by(None))).one()
+
+async def get_matrix(db: AsyncSession, matrix_id: int) -> Optional[AMFEMatrix]:
     """Obtener una matriz específica por ID"""
-    return db.query(AMFEMatrix).filter(AMFEMatrix.id == matrix_id).first()
+    return await db.get(AMFEMatrix, matrix_id)
 
-def create_matrix(db: Session, matrix: MatrixCreate, user_id: int) -> AMFEMatrix:
+async def create_matrix(db: AsyncSession, matrix: MatrixCreate, user_id: int) -> AMFEMatrix:
     """Crear una nueva matriz AMFE"""
     db_matrix = AMFEMatrix(
         name=matrix.name,
@@ -26,473 +81,257 @@ def create_matrix(db: Session, matrix: MatrixCreate, user_id: int) -> AMFEMatrix
         data=matrix.data,
         created_by=user_id
     )
+    return await _save_new_matrix(db, db_matrix)
+
+async def _save_new_matrix(db: AsyncSession, db_matrix: AMFEMatrix) -> AMFEMatrix:
+    # flush para tener el id antes de escribir las tablas normalizadas, todo en una transacción
     db.add(db_matrix)
-    db.commit()
-    db.refresh(db_matrix)
+    await db.flush()
+    await sync_modular_tables(db, db_matrix)
+    await sync_risk_summary(db, db_matrix)
+    await record_revision(db, db_matrix, user_id=db_matrix.created_by)
+    await db.commit()
+    await db.refresh(db_matrix)
+    return db_matrix
+
+async def _save_matrix(db: AsyncSession, db_matrix: AMFEMatrix, name: str, description: Optional[str],
+                       data: dict, user_id: Optional[int] = None) -> AMFEMatrix:
+    previous = revision_document(db_matrix)
+    db_matrix.name = name
+    db_matrix.description = description
+    db_matrix.data = data
+    db_matrix.version = AMFEMatrix.version + 1
+    await sync_modular_tables(db, db_matrix)
+    await sync_risk_summary(db, db_matrix)
+    await record_revision(db, db_matrix, previous, user_id)
+    await _commit_revision(db)
+    await db.refresh(db_matrix)
+    export_cache.invalidate(db_matrix.id)
     return db_matrix
 
-def update_matrix(db: Session, matrix_id: int, matrix: MatrixCreate) -> AMFEMatrix:
-    """Actualizar una matriz existente"""
-    db_matrix = db.query(AMFEMatrix).filter(AMFEMatrix.id == matrix_id).first()
+async def update_matrix(db: AsyncSession, matrix_id: int, matrix: MatrixCreate,
+                        user_id: Optional[int] = None) -> Optional[AMFEMatrix]:
+    """Actualizar una matriz existente (`user_id`: autor de la revisión)"""
+    db_matrix = await db.get(AMFEMatrix, matrix_id)
     if db_matrix:
-        db_matrix.name = matrix.name
-        db_matrix.description = matrix.description
-        db_matrix.data = matrix.data
-        db.commit()
-        db.refresh(db_matrix)
+        await _save_matrix(db, db_matrix, matrix.name, matrix.description, matrix.data, user_id)
     return db_matrix
 
-def delete_matrix(db: Session, matrix_id: int) -> bool:
+async def create_modular_matrix(db: AsyncSession, matrix: MatrixModularCreate, user_id: int) -> AMFEMatrix:
+    """Crear una matriz modular (el documento se guarda marcado con type=modular)"""
+    db_matrix = AMFEMatrix(
+        name=matrix.name,
+        description=matrix.description,
+        data={"type": "modular", **matrix.data.dict()},
+        created_by=user_id
+    )
+    return await _save_new_matrix(db, db_matrix)
+
+async def update_modular_matrix(db: AsyncSession, db_matrix: AMFEMatrix, matrix: MatrixModularCreate,
+                                user_id: Optional[int] = None) -> AMFEMatrix:
+    """Reemplazar nombre, descripción y documento de una matriz modular ya cargada"""
+    data = {"type": "modular", **matrix.data.dict()}
+    return await _save_matrix(db, db_matrix, matrix.name, matrix.description, data, user_id)
+
+class MatrixVersionConflict(Exception):
+    """La matriz cambió desde que se leyó (otra escritura ganó)"""
+
+async def save_modular_matrix_patch(db: AsyncSession, db_matrix: AMFEMatrix, document: dict,
+                                    user_id: Optional[int] = None) -> AMFEMatrix:
+    """
+    Guardar el resultado de un PATCH (ver matrix_patch) solo si la matriz no
+    cambió desde que se leyó: el UPDATE va condicionado a `version`, así dos
+    PATCH concurrentes con el mismo If-Match no se pisan.
+    """
+    previous = revision_document(db_matrix)
+    result = await db.execute(
+        update(AMFEMatrix)
+        .where(AMFEMatrix.id == db_matrix.id, AMFEMatrix.version == db_matrix.version)
+        .values(name=document['name'], description=document.get('description'),
+                data={"type": "modular", **document['data']}, version=AMFEMatrix.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        await db.rollback()
+        raise MatrixVersionConflict()
+    await db.refresh(db_matrix)
+    await sync_modular_tables(db, db_matrix)
+    await sync_risk_summary(db, db_matrix)
+    await record_revision(db, db_matrix, previous, user_id)
+    await _commit_revision(db)
+    export_cache.invalidate(db_matrix.id)
+    return db_matrix
+
+async def _commit_revision(db: AsyncSession):
+    """
+    Commit de una escritura con su revisión. Si otra escritura de la misma
+    matriz guardó el mismo número de revisión (índice único), MatrixVersionConflict
+    """
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise MatrixVersionConflict()
+
+async def delete_matrix(db: AsyncSession, matrix_id: int) -> bool:
     """Eliminar una matriz"""
-    db_matrix = db.query(AMFEMatrix).filter(AMFEMatrix.id == matrix_id).first()
+    db_matrix = await db.get(AMFEMatrix, matrix_id)
     if db_matrix:
-        db.delete(db_matrix)
-        db.commit()
+        await delete_modular_tables(db, matrix_id)
+        await delete_risk_summary(db, matrix_id)
+        await delete_revisions(db, matrix_id)
+        await db.delete(db_matrix)
+        await db.commit()
+        export_cache.invalidate(matrix_id)
         return True
     return False
 
-def export_matrix_to_excel(matrix: AMFEMatrix) -> BytesIO:
-    """Exportar una matriz AMFE a formato Excel con estructura profesional"""
+def filter_matrices(query, ids: Optional[List[int]] = None, servicio: Optional[str] = None,
+                    area: Optional[str] = None, created_by: Optional[int] = None,
+                    created_from: Optional[datetime] = None, created_to: Optional[datetime] = None,
+                    type: Optional[str] = None):
+    """
+    Agregar a un select() criterios sobre las matrices; los de `data` usan
+    las expresiones indexadas de app.models. type: 'modular' o 'legacy'
+    (sin type en el documento).
+    """
+    if ids:
+        query = query.where(AMFEMatrix.id.in_(ids))
+    if servicio:
+        query = query.where(matrix_servicio == servicio)
+    if area:
+        query = query.where(matrix_area == area)
+    if created_by is not None:
+        query = query.where(AMFEMatrix.created_by == created_by)
+    if created_from:
+        query = query.where(AMFEMatrix.created_at >= created_from)
+    if created_to:
+        query = query.where(AMFEMatrix.created_at <= created_to)
+    if type == 'modular':
+        query = query.where(matrix_type == 'modular')
+    elif type == 'legacy':
+        query = query.where(or_(matrix_type.is_(None), matrix_type != 'modular'))
+    return query.order_by(AMFEMatrix.id)
+
+async def get_matrices_for_export(db: AsyncSession, **filters) -> List[AMFEMatrix]:
+    """Matrices que cumplen todos los criterios dados (ver filter_matrices), en una sola consulta"""
+    return (await db.scalars(filter_matrices(select(AMFEMatrix), **filters))).all()
+
+async def get_matrix_ids_for_export(db: AsyncSession, **filters) -> List[int]:
+    """Solo los ids de las matrices que cumplen los criterios, sin cargar `data`"""
+    return (await db.scalars(filter_matrices(select(AMFEMatrix.id), **filters))).all()
+
+def iter_matrices(ids: List[int], batch_size: int = 50) -> Iterator[AMFEMatrix]:
+    """
+    Recorrer matrices por lotes de ids, cada lote con su propia sesión. Pensado
+    para generadores de StreamingResponse, que siguen corriendo cuando la
+    sesión de la petición ya se cerró; solo hay un lote en memoria a la vez.
+    """
+    for i in range(0, len(ids), batch_size):
+        db = SessionLocal()
+        try:
+            batch = db.query(AMFEMatrix).filter(AMFEMatrix.id.in_(ids[i:i + batch_size])).order_by(AMFEMatrix.id).all()
+        finally:
+            db.close()
+        yield from batch
+
+# ========================================
+# EXPORTACIÓN A EXCEL
+# ========================================
+#
+# Las exportaciones se planifican en export_plan (filas, celdas, merges y
+# estilos ya resueltos a partir de `matrix.data`) y aquí solo se renderiza
+# el ExportPlan: a un Workbook normal (_render_workbook) o a uno write-only
+# que escribe fila por fila a disco (_render_streaming).
+
+EXCEL_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+# Incrementar cuando cambie el formato de los archivos generados (invalida la caché)
+EXPORTER_VERSION = "3"
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+
+def _add_logo(ws, fundacion: Optional[str] = None) -> bool:
+    """Insertar el logo de la fundación en A1; devuelve si se pudo agregar"""
+    # Imagen ya redimensionada y codificada en memoria (se carga una vez por proceso)
+    img = logo_cache.image(fundacion)
+    if img is None:
+        return False
+    ws.add_image(img, 'A1')
+    return True
+
+
+class UnsupportedOpenpyxlError(Exception):
+    """La versión de openpyxl instalada no tiene los atributos internos que usan las exportaciones"""
+
+
+def _check_openpyxl():
+    """
+    _merge y _stream_sheet usan internos de openpyxl (Worksheet._cells,
+    merged_cells.ranges, WorksheetWriter.write_merged_cells y .xf), probados
+    con 3.1.x (fijado en requirements.txt). Si faltan, se falla al importar
+    en lugar de generar archivos incompletos.
+    """
+    ws = Workbook().active
+    if not (isinstance(getattr(ws, '_cells', None), dict)
+            and isinstance(getattr(ws.merged_cells, 'ranges', None), set)
+            and callable(getattr(WorksheetWriter, 'write_merged_cells', None))):
+        raise UnsupportedOpenpyxlError(f"openpyxl {openpyxl.__version__} is not supported, install openpyxl 3.1.x")
+
+
+_check_openpyxl()
+
+
+def _merge(ws, start_row: int, start_column: int, end_row: int, end_column: int):
+    """
+    Combinar un rango de celdas. Los rangos que generan las exportaciones nunca
+    se solapan y sus bordes se escriben celda a celda, así que se omiten el
+    chequeo de ws.merge_cells, que recorre todos los rangos ya combinados
+    (costo cuadrático en matrices grandes), y el formateo de bordes del rango.
+    """
+    coord = f"{get_column_letter(start_column)}{start_row}:{get_column_letter(end_column)}{end_row}"
+    ws.merged_cells.ranges.add(MergedCellRange(ws, coord))
+    for row in range(start_row, end_row + 1):
+        for col in range(start_column, end_column + 1):
+            if row != start_row or col != start_column:
+                ws._cells[row, col] = MergedCell(ws, row, col)
+
+
+def _add_conditional_formats(ws, plan: ExportPlan):
+    """Agregar a la hoja las reglas de formato condicional del plan (también en modo write-only)"""
+    for rules, first_row, column, last_row in plan.conditional_formats:
+        letter = get_column_letter(column)
+        cell_range = f"{letter}{first_row}:{letter}{last_row}"
+        for rule in conditional_rules(rules, f"{letter}{first_row}"):
+            ws.conditional_formatting.add(cell_range, rule)
+
+
+def _render_workbook(plan: ExportPlan) -> BytesIO:
+    """Volcar un plan a un Workbook en memoria y guardarlo en un BytesIO"""
     wb = Workbook()
     ws = wb.active
     ws.title = "AMFE"
-    
-    # Estilos
-    title_font = Font(bold=True, size=11, name='Arial')
-    title_alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-    
-    header_fill = PatternFill(start_color="CCCCCC", end_color="CCCCCC", fill_type="solid")
-    header_font = Font(bold=True, size=9, name='Arial')
-    header_alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-    
-    proceso_fill = PatternFill(start_color="C6E0B4", end_color="C6E0B4", fill_type="solid")
-    
-    cell_font = Font(size=9, name='Arial')
-    cell_alignment = Alignment(horizontal="left", vertical="center", wrap_text=True)
-    center_alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-    
-    border_thin = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
-    )
-    
-    # Obtener datos
-    data = matrix.data
-    header = data.get('header', {})
-    table_data = data.get('tableData', [])
-    
-    current_row = 1
-    
-    # FILA 1: Fundación (A1:R1)
-    ws.merge_cells(f'A{current_row}:R{current_row}')
-    cell = ws[f'A{current_row}']
-    cell.value = header.get('fundacion', 'Fundación Clínica Infantil Club Noel')
-    cell.font = title_font
-    cell.alignment = title_alignment
-    cell.border = border_thin
-    current_row += 1
-    
-    # FILA 2: Título y código
-    ws.merge_cells(f'A{current_row}:J{current_row}')
-    ws[f'A{current_row}'] = 'Análisis de Modo de Fallos y Efectos (AMFE) de Equipos Biomédicos'
-    ws[f'A{current_row}'].font = Font(bold=True, size=10, name='Arial')
-    ws[f'A{current_row}'].alignment = center_alignment
-    ws[f'A{current_row}'].border = border_thin
-    
-    ws.merge_cells(f'K{current_row}:L{current_row}')
-    ws[f'K{current_row}'] = 'CÓDIGO:'
-    ws[f'K{current_row}'].font = Font(bold=True, size=8, name='Arial')
-    ws[f'K{current_row}'].alignment = center_alignment
-    ws[f'K{current_row}'].border = border_thin
-    
-    ws.merge_cells(f'M{current_row}:N{current_row}')
-    ws[f'M{current_row}'] = header.get('codigo', '')
-    ws[f'M{current_row}'].font = cell_font
-    ws[f'M{current_row}'].alignment = center_alignment
-    ws[f'M{current_row}'].border = border_thin
-    
-    ws[f'O{current_row}'] = 'PAGINA'
-    ws[f'O{current_row}'].font = Font(bold=True, size=8, name='Arial')
-    ws[f'O{current_row}'].alignment = center_alignment
-    ws[f'O{current_row}'].border = border_thin
-    
-    ws[f'P{current_row}'] = header.get('pagina', '1')
-    ws[f'P{current_row}'].font = cell_font
-    ws[f'P{current_row}'].alignment = center_alignment
-    ws[f'P{current_row}'].border = border_thin
-    
-    ws[f'Q{current_row}'] = 'DE'
-    ws[f'Q{current_row}'].font = Font(bold=True, size=8, name='Arial')
-    ws[f'Q{current_row}'].alignment = center_alignment
-    ws[f'Q{current_row}'].border = border_thin
-    
-    ws[f'R{current_row}'] = header.get('año', '')
-    ws[f'R{current_row}'].font = cell_font
-    ws[f'R{current_row}'].alignment = center_alignment
-    ws[f'R{current_row}'].border = border_thin
-    current_row += 1
-    
-    # FILA 3: Información de servicio
-    ws[f'A{current_row}'] = 'SERVICIO'
-    ws[f'A{current_row}'].font = header_font
-    ws[f'A{current_row}'].fill = header_fill
-    ws[f'A{current_row}'].alignment = center_alignment
-    ws[f'A{current_row}'].border = border_thin
-    
-    ws.merge_cells(f'B{current_row}:C{current_row}')
-    ws[f'B{current_row}'] = header.get('servicio', '')
-    ws[f'B{current_row}'].font = cell_font
-    ws[f'B{current_row}'].alignment = cell_alignment
-    ws[f'B{current_row}'].border = border_thin
-    
-    ws[f'D{current_row}'] = 'ÁREA'
-    ws[f'D{current_row}'].font = header_font
-    ws[f'D{current_row}'].fill = header_fill
-    ws[f'D{current_row}'].alignment = center_alignment
-    ws[f'D{current_row}'].border = border_thin
-    
-    ws[f'E{current_row}'] = header.get('area', '')
-    ws[f'E{current_row}'].font = cell_font
-    ws[f'E{current_row}'].alignment = cell_alignment
-    ws[f'E{current_row}'].border = border_thin
-    
-    ws[f'F{current_row}'] = 'UCI'
-    ws[f'F{current_row}'].font = header_font
-    ws[f'F{current_row}'].fill = header_fill
-    ws[f'F{current_row}'].alignment = center_alignment
-    ws[f'F{current_row}'].border = border_thin
-    
-    ws[f'G{current_row}'] = header.get('uci', '')
-    ws[f'G{current_row}'].font = cell_font
-    ws[f'G{current_row}'].alignment = cell_alignment
-    ws[f'G{current_row}'].border = border_thin
-    
-    ws[f'H{current_row}'] = 'ELABORADO POR'
-    ws[f'H{current_row}'].font = header_font
-    ws[f'H{current_row}'].fill = header_fill
-    ws[f'H{current_row}'].alignment = center_alignment
-    ws[f'H{current_row}'].border = border_thin
-    
-    ws.merge_cells(f'I{current_row}:J{current_row}')
-    ws[f'I{current_row}'] = header.get('elaboradoPor', '')
-    ws[f'I{current_row}'].font = cell_font
-    ws[f'I{current_row}'].alignment = cell_alignment
-    ws[f'I{current_row}'].border = border_thin
-    
-    ws.merge_cells(f'K{current_row}:L{current_row}')
-    ws[f'K{current_row}'] = 'VERSIÓN:'
-    ws[f'K{current_row}'].font = Font(bold=True, size=8, name='Arial')
-    ws[f'K{current_row}'].alignment = center_alignment
-    ws[f'K{current_row}'].border = border_thin
-    
-    ws.merge_cells(f'M{current_row}:N{current_row}')
-    ws[f'M{current_row}'] = header.get('version', '1')
-    ws[f'M{current_row}'].font = cell_font
-    ws[f'M{current_row}'].alignment = center_alignment
-    ws[f'M{current_row}'].border = border_thin
-    
-    ws[f'O{current_row}'] = 'DIA'
-    ws[f'O{current_row}'].font = Font(bold=True, size=8, name='Arial')
-    ws[f'O{current_row}'].alignment = center_alignment
-    ws[f'O{current_row}'].border = border_thin
-    
-    ws[f'P{current_row}'] = 'MES'
-    ws[f'P{current_row}'].font = Font(bold=True, size=8, name='Arial')
-    ws[f'P{current_row}'].alignment = center_alignment
-    ws[f'P{current_row}'].border = border_thin
-    
-    ws.merge_cells(f'Q{current_row}:R{current_row}')
-    ws[f'Q{current_row}'] = 'AÑO'
-    ws[f'Q{current_row}'].font = Font(bold=True, size=8, name='Arial')
-    ws[f'Q{current_row}'].alignment = center_alignment
-    ws[f'Q{current_row}'].border = border_thin
-    current_row += 1
-    
-    # FILA 4: Proceso y equipo biomédico
-    ws[f'A{current_row}'] = 'PROCESO'
-    ws[f'A{current_row}'].font = header_font
-    ws[f'A{current_row}'].fill = header_fill
-    ws[f'A{current_row}'].alignment = center_alignment
-    ws[f'A{current_row}'].border = border_thin
-    
-    ws.merge_cells(f'B{current_row}:J{current_row}')
-    ws[f'B{current_row}'] = ''
-    ws[f'B{current_row}'].border = border_thin
-    
-    ws.merge_cells(f'K{current_row}:L{current_row}')
-    ws[f'K{current_row}'] = 'EQUIPO BIOMÉDICO'
-    ws[f'K{current_row}'].font = Font(bold=True, size=8, name='Arial')
-    ws[f'K{current_row}'].fill = header_fill
-    ws[f'K{current_row}'].alignment = center_alignment
-    ws[f'K{current_row}'].border = border_thin
-    
-    ws.merge_cells(f'M{current_row}:N{current_row}')
-    ws[f'M{current_row}'] = header.get('equipoBiomedico', '')
-    ws[f'M{current_row}'].font = cell_font
-    ws[f'M{current_row}'].alignment = center_alignment
-    ws[f'M{current_row}'].border = border_thin
-    
-    # Fecha
-    fecha_emision = header.get('fechaEmision', '')
-    if fecha_emision:
-        try:
-            fecha_obj = datetime.strptime(fecha_emision, '%Y-%m-%d')
-            dia = fecha_obj.day
-            mes = fecha_obj.month
-            anio = fecha_obj.year
-        except:
-            dia = ''
-            mes = header.get('mes', '')
-            anio = header.get('año', '')
-    else:
-        dia = ''
-        mes = header.get('mes', '')
-        anio = header.get('año', '')
-    
-    ws[f'O{current_row}'] = dia
-    ws[f'O{current_row}'].font = cell_font
-    ws[f'O{current_row}'].alignment = center_alignment
-    ws[f'O{current_row}'].border = border_thin
-    
-    ws[f'P{current_row}'] = mes
-    ws[f'P{current_row}'].font = cell_font
-    ws[f'P{current_row}'].alignment = center_alignment
-    ws[f'P{current_row}'].border = border_thin
-    
-    ws.merge_cells(f'Q{current_row}:R{current_row}')
-    ws[f'Q{current_row}'] = anio
-    ws[f'Q{current_row}'].font = cell_font
-    ws[f'Q{current_row}'].alignment = center_alignment
-    ws[f'Q{current_row}'].border = border_thin
-    current_row += 1
-    
-    # ENCABEZADOS DE LA TABLA (2 filas)
-    header_row1 = current_row
-    
-    # Primera fila de headers
-    ws.merge_cells(f'A{current_row}:A{current_row+1}')
-    ws[f'A{current_row}'] = 'PROCESO'
-    
-    ws.merge_cells(f'B{current_row}:B{current_row+1}')
-    ws[f'B{current_row}'] = 'SUBPROCESO'
-    
-    ws.merge_cells(f'C{current_row}:C{current_row+1}')
-    ws[f'C{current_row}'] = 'FALLA POTENCIAL DEL SUBPROCESO'
-    
-    ws.merge_cells(f'D{current_row}:D{current_row+1}')
-    ws[f'D{current_row}'] = 'EFECTO POTENCIAL DE LA FALLA'
-    
-    ws.merge_cells(f'E{current_row}:E{current_row+1}')
-    ws[f'E{current_row}'] = 'CAUSAS POTENCIALES'
-    
-    ws.merge_cells(f'F{current_row}:F{current_row+1}')
-    ws[f'F{current_row}'] = 'BARRERAS EXISTENTES'
-    
-    ws.merge_cells(f'G{current_row}:G{current_row+1}')
-    ws[f'G{current_row}'] = 'Severidad'
-    
-    ws.merge_cells(f'H{current_row}:H{current_row+1}')
-    ws[f'H{current_row}'] = 'Detectabilidad'
-    
-    ws.merge_cells(f'I{current_row}:I{current_row+1}')
-    ws[f'I{current_row}'] = 'Ocurrencia'
-    
-    ws.merge_cells(f'J{current_row}:K{current_row}')
-    ws[f'J{current_row}'] = 'RPN'
-    
-    ws.merge_cells(f'L{current_row}:L{current_row+1}')
-    ws[f'L{current_row}'] = 'ACCIONES RECOMENDADAS'
-    
-    ws.merge_cells(f'M{current_row}:M{current_row+1}')
-    ws[f'M{current_row}'] = 'ACCIONES TOMADAS'
-    
-    ws.merge_cells(f'N{current_row}:N{current_row+1}')
-    ws[f'N{current_row}'] = 'RESPONSABLE'
-    
-    # Aplicar estilos a la primera fila de headers
-    for col in ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J', 'L', 'M', 'N']:
-        cell = ws[f'{col}{current_row}']
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = header_alignment
-        cell.border = border_thin
-    
-    current_row += 1
-    
-    # Segunda fila de headers (subcolumnas de RPN)
-    ws[f'J{current_row}'] = 'TIPO DE RIESGO'
-    ws[f'J{current_row}'].font = Font(bold=True, size=8, name='Arial')
-    ws[f'J{current_row}'].fill = header_fill
-    ws[f'J{current_row}'].alignment = header_alignment
-    ws[f'J{current_row}'].border = border_thin
-    
-    ws[f'K{current_row}'] = 'RPN'
-    ws[f'K{current_row}'].font = Font(bold=True, size=8, name='Arial')
-    ws[f'K{current_row}'].fill = header_fill
-    ws[f'K{current_row}'].alignment = header_alignment
-    ws[f'K{current_row}'].border = border_thin
-    current_row += 1
-    
-    # DATOS DE LA TABLA
-    # Columnas: Proceso(0), Subproceso(1), Falla(2), Efecto(3), Severidad(4), 
-    # Causa(5), Ocurrencia(6), Barrera(7), Detectabilidad(8), RPN(9), TipoRiesgo(10), Acciones(11)
-    
-    for row_data in table_data:
-        # Asegurarse de que la fila tenga suficientes elementos
-        while len(row_data) < 12:
-            row_data.append('')
-        
-        # Proceso
-        ws[f'A{current_row}'] = row_data[0] if row_data[0] else ''
-        ws[f'A{current_row}'].font = cell_font
-        ws[f'A{current_row}'].alignment = cell_alignment
-        ws[f'A{current_row}'].border = border_thin
-        if row_data[0]:  # Si tiene valor, aplicar color de proceso
-            ws[f'A{current_row}'].fill = proceso_fill
-        
-        # Subproceso
-        ws[f'B{current_row}'] = row_data[1] if row_data[1] else ''
-        ws[f'B{current_row}'].font = cell_font
-        ws[f'B{current_row}'].alignment = cell_alignment
-        ws[f'B{current_row}'].border = border_thin
-        
-        # Falla Potencial
-        ws[f'C{current_row}'] = row_data[2] if row_data[2] else ''
-        ws[f'C{current_row}'].font = cell_font
-        ws[f'C{current_row}'].alignment = cell_alignment
-        ws[f'C{current_row}'].border = border_thin
-        
-        # Efecto Potencial
-        ws[f'D{current_row}'] = row_data[3] if row_data[3] else ''
-        ws[f'D{current_row}'].font = cell_font
-        ws[f'D{current_row}'].alignment = cell_alignment
-        ws[f'D{current_row}'].border = border_thin
-        
-        # Causas Potenciales
-        ws[f'E{current_row}'] = row_data[5] if len(row_data) > 5 and row_data[5] else ''
-        ws[f'E{current_row}'].font = cell_font
-        ws[f'E{current_row}'].alignment = cell_alignment
-        ws[f'E{current_row}'].border = border_thin
-        
-        # Barreras Existentes
-        ws[f'F{current_row}'] = row_data[7] if len(row_data) > 7 and row_data[7] else ''
-        ws[f'F{current_row}'].font = cell_font
-        ws[f'F{current_row}'].alignment = cell_alignment
-        ws[f'F{current_row}'].border = border_thin
-        
-        # Severidad
-        ws[f'G{current_row}'] = row_data[4] if len(row_data) > 4 and row_data[4] else ''
-        ws[f'G{current_row}'].font = cell_font
-        ws[f'G{current_row}'].alignment = center_alignment
-        ws[f'G{current_row}'].border = border_thin
-        
-        # Detectabilidad
-        ws[f'H{current_row}'] = row_data[8] if len(row_data) > 8 and row_data[8] else ''
-        ws[f'H{current_row}'].font = cell_font
-        ws[f'H{current_row}'].alignment = center_alignment
-        ws[f'H{current_row}'].border = border_thin
-        
-        # Ocurrencia
-        ws[f'I{current_row}'] = row_data[6] if len(row_data) > 6 and row_data[6] else ''
-        ws[f'I{current_row}'].font = cell_font
-        ws[f'I{current_row}'].alignment = center_alignment
-        ws[f'I{current_row}'].border = border_thin
-        
-        # Tipo de Riesgo
-        tipo_riesgo = row_data[10] if len(row_data) > 10 and row_data[10] else 'Bajo'
-        ws[f'J{current_row}'] = tipo_riesgo
-        ws[f'J{current_row}'].font = cell_font
-        ws[f'J{current_row}'].alignment = center_alignment
-        ws[f'J{current_row}'].border = border_thin
-        
-        # Color según tipo de riesgo
-        if tipo_riesgo == 'Crítico':
-            ws[f'J{current_row}'].fill = PatternFill(start_color="f8d7da", end_color="f8d7da", fill_type="solid")
-            ws[f'J{current_row}'].font = Font(color="721c24", bold=True, size=9, name='Arial')
-        elif tipo_riesgo == 'Alto':
-            ws[f'J{current_row}'].fill = PatternFill(start_color="fff3cd", end_color="fff3cd", fill_type="solid")
-            ws[f'J{current_row}'].font = Font(color="856404", bold=True, size=9, name='Arial')
-        elif tipo_riesgo == 'Medio':
-            ws[f'J{current_row}'].fill = PatternFill(start_color="d1ecf1", end_color="d1ecf1", fill_type="solid")
-            ws[f'J{current_row}'].font = Font(color="0c5460", bold=True, size=9, name='Arial')
-        else:  # Bajo
-            ws[f'J{current_row}'].fill = PatternFill(start_color="d4edda", end_color="d4edda", fill_type="solid")
-            ws[f'J{current_row}'].font = Font(color="155724", bold=True, size=9, name='Arial')
-        
-        # RPN
-        rpn_value = row_data[9] if len(row_data) > 9 and row_data[9] else 1
-        ws[f'K{current_row}'] = rpn_value
-        ws[f'K{current_row}'].font = Font(bold=True, size=9, name='Arial', color="FFFFFF")
-        ws[f'K{current_row}'].alignment = center_alignment
-        ws[f'K{current_row}'].border = border_thin
-        
-        # Color según RPN
-        try:
-            rpn_num = int(rpn_value) if rpn_value else 1
-            if rpn_num >= 100:
-                ws[f'K{current_row}'].fill = PatternFill(start_color="dc3545", end_color="dc3545", fill_type="solid")
-            elif rpn_num >= 50:
-                ws[f'K{current_row}'].fill = PatternFill(start_color="fd7e14", end_color="fd7e14", fill_type="solid")
-            elif rpn_num >= 20:
-                ws[f'K{current_row}'].fill = PatternFill(start_color="ffc107", end_color="ffc107", fill_type="solid")
-                ws[f'K{current_row}'].font = Font(bold=True, size=9, name='Arial', color="000000")
-            else:
-                ws[f'K{current_row}'].fill = PatternFill(start_color="28a745", end_color="28a745", fill_type="solid")
-        except:
-            ws[f'K{current_row}'].fill = PatternFill(start_color="28a745", end_color="28a745", fill_type="solid")
-        
-        # Acciones Recomendadas
-        ws[f'L{current_row}'] = row_data[11] if len(row_data) > 11 and row_data[11] else ''
-        ws[f'L{current_row}'].font = cell_font
-        ws[f'L{current_row}'].alignment = cell_alignment
-        ws[f'L{current_row}'].border = border_thin
-        
-        # Acciones Tomadas (vacío por ahora)
-        ws[f'M{current_row}'] = ''
-        ws[f'M{current_row}'].font = cell_font
-        ws[f'M{current_row}'].alignment = cell_alignment
-        ws[f'M{current_row}'].border = border_thin
-        
-        # Responsable (vacío por ahora)
-        ws[f'N{current_row}'] = ''
-        ws[f'N{current_row}'].font = cell_font
-        ws[f'N{current_row}'].alignment = cell_alignment
-        ws[f'N{current_row}'].border = border_thin
-        
-        current_row += 1
-    
-    # Ajustar anchos de columnas
-    column_widths = {
-        'A': 15,  # Proceso
-        'B': 15,  # Subproceso
-        'C': 25,  # Falla Potencial
-        'D': 25,  # Efecto Potencial
-        'E': 25,  # Causas
-        'F': 25,  # Barreras
-        'G': 10,  # Severidad
-        'H': 12,  # Detectabilidad
-        'I': 10,  # Ocurrencia
-        'J': 15,  # Tipo de Riesgo
-        'K': 8,   # RPN
-        'L': 30,  # Acciones Recomendadas
-        'M': 30,  # Acciones Tomadas
-        'N': 20,  # Responsable
-        'O': 8,   # DIA
-        'P': 8,   # MES
-        'Q': 8,   # AÑO (parte 1)
-        'R': 8    # AÑO (parte 2)
-    }
-    
-    for col, width in column_widths.items():
+    styles = WorkbookStyles(wb)
+    
+    # Primero los rangos combinados: sus celdas internas solo reciben estilo (bordes)
+    for merge in plan.merge_ranges():
+        _merge(ws, *merge)
+    
+    values, columns, role_ids, roles = plan.values, plan.columns, plan.role_ids, plan.roles
+    starts = plan.row_starts
+    for row_idx in range(1, len(starts)):
+        for i in range(starts[row_idx - 1], starts[row_idx]):
+            styles.apply(ws.cell(row=row_idx, column=columns[i], value=values[i]), roles[role_ids[i]])
+    for row_idx, height in plan.heights.items():
+        ws.row_dimensions[row_idx].height = height
+    _add_conditional_formats(ws, plan)
+    
+    # Logo en A1 con la altura de la fila ajustada
+    if plan.logo and _add_logo(ws, plan.logo):
+        ws.row_dimensions[1].height = 45
+    
+    for col, width in plan.column_widths.items():
         ws.column_dimensions[col].width = width
     
-    # Ajustar altura de filas de header
-    ws.row_dimensions[header_row1].height = 30
-    ws.row_dimensions[header_row1 + 1].height = 20
-    
-    # Guardar en BytesIO
     excel_file = BytesIO()
     wb.save(excel_file)
     excel_file.seek(0)
@@ -500,486 +339,204 @@ def export_matrix_to_excel(matrix: AMFEMatrix) -> BytesIO:
     return excel_file
 
 
-def export_modular_matrix_to_excel(matrix: AMFEMatrix) -> BytesIO:
+def _write_merge_cells(stream, plan: ExportPlan):
     """
-    Exportar una matriz AMFE modular a formato Excel con el formato EXACTO de Club Noel.
-    Respeta la estructura, celdas combinadas, colores y títulos específicos.
+    Escribir <mergeCells> en el stream XML de una hoja write-only, rango por
+    rango. openpyxl arma todos los <mergeCell> en memoria al cerrar la hoja
+    (un objeto por rango); el plan ya los tiene como enteros.
     """
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "AMFE"
-    
-    # ==================== ESTILOS ====================
-    title_font = Font(bold=True, size=12, name='Arial')
-    subtitle_font = Font(bold=True, size=11, name='Arial')
-    header_font = Font(bold=True, size=10, name='Arial', color="000000")
-    cell_font = Font(size=9, name='Arial')
-    
-    title_alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-    center_alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-    left_alignment = Alignment(horizontal="left", vertical="center", wrap_text=True)
-    
-    # Colores según imagen
-    green_light_fill = PatternFill(start_color="C6E0B4", end_color="C6E0B4", fill_type="solid")  # Verde claro
-    gray_light_fill = PatternFill(start_color="D9D9D9", end_color="D9D9D9", fill_type="solid")   # Gris claro
-    
-    border_thin = Border(
-        left=Side(style='thin', color="000000"),
-        right=Side(style='thin', color="000000"),
-        top=Side(style='thin', color="000000"),
-        bottom=Side(style='thin', color="000000")
-    )
-    
-    # ==================== OBTENER DATOS ====================
-    data = matrix.data
-    header = data.get('header', {})
-    procesos = data.get('procesos', [])
-    
-    current_row = 1
-    
-    # ==================== FILA 1: Título Principal (B1:K1) + Logo en A1 ====================
-    # Logo Club Noel en A1
-    try:
-        # Obtener la ruta del logo
-        logo_path = os.path.join(os.path.dirname(__file__), '..', '..', 'assets', 'club.jpg')
-        if os.path.exists(logo_path):
-            # Crear objeto de imagen
-            img = Image(logo_path)
-            
-            # Ajustar tamaño de la imagen para que quepa en A1
-            img.width = 80
-            img.height = 60
-            
-            # Insertar imagen en A1
-            ws.add_image(img, 'A1')
-            
-            # Ajustar altura de la fila 1
-            ws.row_dimensions[1].height = 45
-    except Exception as e:
-        # Si hay error con la imagen, continuar sin ella
-        print(f"No se pudo agregar el logo: {e}")
-    
-    # Título en B1:K1 (dejando A1 para el logo)
-    ws.merge_cells(f'B{current_row}:K{current_row}')
-    cell = ws[f'B{current_row}']
-    cell.value = "Fundación Clínica Infantil Club Noel"
-    cell.font = title_font
-    cell.alignment = title_alignment
-    cell.border = border_thin
-    
-    # Borde para A1 (celda del logo)
-    ws[f'A{current_row}'].border = border_thin
-    
-    # Columnas L-Q: CÓDIGO, VERSIÓN
-    ws[f'L{current_row}'] = 'CÓDIGO:'
-    ws[f'L{current_row}'].font = header_font
-    ws[f'L{current_row}'].alignment = left_alignment
-    ws[f'L{current_row}'].border = border_thin
-    
-    ws[f'M{current_row}'] = header.get('codigo', '')
-    ws[f'M{current_row}'].font = cell_font
-    ws[f'M{current_row}'].alignment = center_alignment
-    ws[f'M{current_row}'].border = border_thin
-    
-    ws[f'N{current_row}'] = 'VERSIÓN:'
-    ws[f'N{current_row}'].font = header_font
-    ws[f'N{current_row}'].alignment = left_alignment
-    ws[f'N{current_row}'].border = border_thin
-    
-    ws[f'O{current_row}'] = header.get('version', '1')
-    ws[f'O{current_row}'].font = cell_font
-    ws[f'O{current_row}'].alignment = center_alignment
-    ws[f'O{current_row}'].border = border_thin
-    
-    ws[f'P{current_row}'] = 'PAGINA'
-    ws[f'P{current_row}'].font = header_font
-    ws[f'P{current_row}'].alignment = center_alignment
-    ws[f'P{current_row}'].border = border_thin
-    
-    ws[f'Q{current_row}'] = header.get('pagina', '1')
-    ws[f'Q{current_row}'].font = cell_font
-    ws[f'Q{current_row}'].alignment = center_alignment
-    ws[f'Q{current_row}'].border = border_thin
-    current_row += 1
-    
-    # ==================== FILA 2: Subtítulo (A2:K2) + FECHA ====================
-    ws.merge_cells(f'A{current_row}:K{current_row}')
-    cell = ws[f'A{current_row}']
-    cell.value = "Análisis de Modo de Fallos y Efectos (AMFE) de Equipos Biomédicos"
-    cell.font = subtitle_font
-    cell.alignment = title_alignment
-    cell.fill = green_light_fill
-    cell.border = border_thin
-    
-    ws[f'L{current_row}'] = 'FECHA DE EMISIÓN:'
-    ws[f'L{current_row}'].font = header_font
-    ws[f'L{current_row}'].alignment = left_alignment
-    ws[f'L{current_row}'].border = border_thin
-    
-    # Parsear fecha
-    fecha_emision = header.get('fechaEmision', '')
-    if fecha_emision:
+    if not plan.n_merges:
+        return
+    xf = stream.send(True)
+    with xf.element("mergeCells", count=str(plan.n_merges)):
+        for start_row, start_column, end_row, end_column in plan.merge_ranges():
+            ref = f"{get_column_letter(start_column)}{start_row}:{get_column_letter(end_column)}{end_row}"
+            xf.write(Element("mergeCell", ref=ref))
+    stream.send(None)
+
+
+def _stream_sheet(ws, styles: WorkbookStyles, plan: ExportPlan):
+    """Volcar un plan a una hoja write-only (cada fila va a disco apenas se escribe)"""
+    # En modo write-only anchos, alturas e imágenes deben definirse antes de escribir filas
+    for col, width in plan.column_widths.items():
+        ws.column_dimensions[col].width = width
+    for row_idx, height in plan.heights.items():
+        ws.row_dimensions[row_idx].height = height
+    if plan.logo and _add_logo(ws, plan.logo):
+        ws.row_dimensions[1].height = 45
+    
+    values, columns, role_ids, roles = plan.values, plan.columns, plan.role_ids, plan.roles
+    starts = plan.row_starts
+    for row_idx in range(1, len(starts)):
+        start, end = starts[row_idx - 1], starts[row_idx]
+        row = [None] * (columns[end - 1] if end > start else 0)
+        for i in range(start, end):
+            cell = WriteOnlyCell(ws, value=values[i])
+            styles.apply(cell, roles[role_ids[i]])
+            row[columns[i] - 1] = cell
+        ws.append(row)
+    
+    _add_conditional_formats(ws, plan)
+    # Los rangos combinados van después de las filas; se escriben en streaming
+    if not plan.n_merges:
+        return
+    writer = getattr(ws, '_writer', None)
+    if writer is None or not hasattr(writer, 'xf'):
+        raise UnsupportedOpenpyxlError(f"openpyxl {openpyxl.__version__} is not supported, install openpyxl 3.1.x")
+    writer.write_merged_cells = lambda: _write_merge_cells(writer.xf, plan)
+
+
+def _save_streaming(wb: Workbook, excel_file: Optional[IO[bytes]] = None) -> IO[bytes]:
+    if excel_file is None:
+        excel_file = tempfile.TemporaryFile()
         try:
-            fecha_obj = datetime.strptime(fecha_emision, '%Y-%m-%d')
-            dia = str(fecha_obj.day)
-            mes = str(fecha_obj.month)
-            año = str(fecha_obj.year)
-        except:
-            dia = ''
-            mes = header.get('mes', '')
-            año = header.get('año', '')
+            wb.save(excel_file)
+        except Exception:
+            excel_file.close()
+            raise
     else:
-        dia = ''
-        mes = header.get('mes', '')
-        año = header.get('año', '')
-    
-    ws[f'M{current_row}'] = ''
-    ws[f'M{current_row}'].border = border_thin
-    
-    ws[f'N{current_row}'] = ''
-    ws[f'N{current_row}'].border = border_thin
-    
-    ws[f'O{current_row}'] = 'DÍA'
-    ws[f'O{current_row}'].font = header_font
-    ws[f'O{current_row}'].alignment = center_alignment
-    ws[f'O{current_row}'].border = border_thin
-    
-    ws[f'P{current_row}'] = 'MES'
-    ws[f'P{current_row}'].font = header_font
-    ws[f'P{current_row}'].alignment = center_alignment
-    ws[f'P{current_row}'].border = border_thin
-    
-    ws[f'Q{current_row}'] = 'AÑO'
-    ws[f'Q{current_row}'].font = header_font
-    ws[f'Q{current_row}'].alignment = center_alignment
-    ws[f'Q{current_row}'].border = border_thin
-    current_row += 1
-    
-    # ==================== FILA 3: Valores de Fecha (A3:N3 combinadas) ====================
-    # Combinar celdas A3:N3 (vacías con bordes)
-    ws.merge_cells(f'A{current_row}:N{current_row}')
-    ws[f'A{current_row}'].border = border_thin
-    for col in ['B', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J', 'K', 'L', 'M', 'N']:
-        ws[f'{col}{current_row}'].border = border_thin
-    
-    # Valores de fecha en O3, P3, Q3
-    ws[f'O{current_row}'] = dia
-    ws[f'O{current_row}'].font = cell_font
-    ws[f'O{current_row}'].alignment = center_alignment
-    ws[f'O{current_row}'].border = border_thin
-    
-    ws[f'P{current_row}'] = mes
-    ws[f'P{current_row}'].font = cell_font
-    ws[f'P{current_row}'].alignment = center_alignment
-    ws[f'P{current_row}'].border = border_thin
-    
-    ws[f'Q{current_row}'] = año
-    ws[f'Q{current_row}'].font = cell_font
-    ws[f'Q{current_row}'].alignment = center_alignment
-    ws[f'Q{current_row}'].border = border_thin
-    current_row += 1
-    
-    # ==================== FILA 5: Información del Servicio ====================
-    ws[f'A{current_row}'] = 'SERVICIO'
-    ws[f'A{current_row}'].font = header_font
-    ws[f'A{current_row}'].alignment = center_alignment
-    ws[f'A{current_row}'].fill = green_light_fill
-    ws[f'A{current_row}'].border = border_thin
-    
-    ws.merge_cells(f'B{current_row}:C{current_row}')
-    ws[f'B{current_row}'] = header.get('servicio', 'UNIDAD DE CUIDADOS INTENSIVOS')
-    ws[f'B{current_row}'].font = header_font
-    ws[f'B{current_row}'].alignment = center_alignment
-    ws[f'B{current_row}'].fill = green_light_fill
-    ws[f'B{current_row}'].border = border_thin
-    ws[f'C{current_row}'].border = border_thin
-    
-    ws[f'D{current_row}'] = 'ÁREA'
-    ws[f'D{current_row}'].font = header_font
-    ws[f'D{current_row}'].alignment = center_alignment
-    ws[f'D{current_row}'].fill = green_light_fill
-    ws[f'D{current_row}'].border = border_thin
-    
-    ws[f'E{current_row}'] = header.get('area', 'UCI')
-    ws[f'E{current_row}'].font = cell_font
-    ws[f'E{current_row}'].alignment = center_alignment
-    ws[f'E{current_row}'].border = border_thin
-    
-    ws.merge_cells(f'F{current_row}:H{current_row}')
-    ws[f'F{current_row}'] = 'ELABORADO POR'
-    ws[f'F{current_row}'].font = header_font
-    ws[f'F{current_row}'].alignment = center_alignment
-    ws[f'F{current_row}'].fill = green_light_fill
-    ws[f'F{current_row}'].border = border_thin
-    for col in ['G', 'H']:
-        ws[f'{col}{current_row}'].border = border_thin
-    
-    ws[f'I{current_row}'] = header.get('elaboradoPor', 'Ana María Toro Aguirre')
-    ws[f'I{current_row}'].font = cell_font
-    ws[f'I{current_row}'].alignment = center_alignment
-    ws[f'I{current_row}'].border = border_thin
-    
-    ws.merge_cells(f'J{current_row}:K{current_row}')
-    ws[f'J{current_row}'] = 'EQUIPO BIOMÉDICO'
-    ws[f'J{current_row}'].font = header_font
-    ws[f'J{current_row}'].alignment = center_alignment
-    ws[f'J{current_row}'].fill = green_light_fill
-    ws[f'J{current_row}'].border = border_thin
-    ws[f'K{current_row}'].border = border_thin
-    
-    ws.merge_cells(f'L{current_row}:M{current_row}')
-    ws[f'L{current_row}'] = header.get('equipo', 'VENTILADOR DE ALTA FRECUENCIA')
-    ws[f'L{current_row}'].font = cell_font
-    ws[f'L{current_row}'].alignment = center_alignment
-    ws[f'L{current_row}'].border = border_thin
-    ws[f'M{current_row}'].border = border_thin
-    
-    ws[f'N{current_row}'] = 'MODELO/MARCA'
-    ws[f'N{current_row}'].font = header_font
-    ws[f'N{current_row}'].alignment = center_alignment
-    ws[f'N{current_row}'].fill = green_light_fill
-    ws[f'N{current_row}'].border = border_thin
-    
-    ws.merge_cells(f'O{current_row}:Q{current_row}')
-    ws[f'O{current_row}'] = header.get('modeloMarca', '')
-    ws[f'O{current_row}'].font = cell_font
-    ws[f'O{current_row}'].alignment = center_alignment
-    ws[f'O{current_row}'].border = border_thin
-    ws[f'P{current_row}'].border = border_thin
-    ws[f'Q{current_row}'].border = border_thin
-    current_row += 1
-    
-    # ==================== FILA 6: Headers de la Tabla ====================
-    headers = [
-        ('A', 'PROCESO'),
-        ('B', 'SUBPROCESO'),
-        ('C', 'FALLA POTENCIAL\nDEL SUBPROCESO'),
-        ('D', 'EFECTO POTENCIAL\nDE LA FALLA'),
-        ('E', 'CAUSAS\nPOTENCIALES'),
-        ('F', 'BARRERAS\nEXISTENTES'),
-        ('G', 'Severidad'),
-        ('H', 'Detectabilidad'),
-        ('I', 'Ocurrencia'),
-        ('J', 'RPN'),
-        ('K', 'TIPO DE\nRIESGO'),
-        ('L', 'ACCIONES\nRECOMENDATAS'),
-        ('M', 'ACCIONES\nTOMADAS'),
-        ('N', 'RESPONSABLE'),
-        ('O', ''),
-        ('P', ''),
-        ('Q', '')
-    ]
-    
-    for col, text in headers:
-        ws[f'{col}{current_row}'] = text
-        ws[f'{col}{current_row}'].font = header_font
-        ws[f'{col}{current_row}'].alignment = center_alignment
-        ws[f'{col}{current_row}'].fill = gray_light_fill
-        ws[f'{col}{current_row}'].border = border_thin
-    
-    ws.row_dimensions[current_row].height = 40
-    current_row += 1
-    
-    # ==================== DATOS: PROCESOS MODULARES ====================
-    for proceso in procesos:
-        proceso_nombre = proceso.get('nombre', '')
-        proceso_color = proceso.get('color', '#C6E0B4')
-        subprocesos = proceso.get('subprocesos', [])
-        
-        proceso_start_row = current_row
-        proceso_rows = 0
-        
-        for subproceso in subprocesos:
-            subproceso_nombre = subproceso.get('nombre', '')
-            fallas = subproceso.get('fallasPotenciales', [])
-            
-            subproceso_start_row = current_row
-            subproceso_rows = 0
-            
-            for falla in fallas:
-                # Calcular filas necesarias
-                num_efectos = len(falla.get('efectosPotenciales', []))
-                num_causas = len(falla.get('causasPotenciales', []))
-                num_barreras = len(falla.get('barrerasExistentes', []))
-                num_acciones_rec = len(falla.get('accionesRecomendadas', []))
-                num_acciones_tom = len(falla.get('accionesTomadas', []))
-                
-                falla_rows = max(num_efectos, num_causas, num_barreras, num_acciones_rec, num_acciones_tom, 1)
-                falla_start_row = current_row
-                
-                # Merge falla
-                if falla_rows > 1:
-                    ws.merge_cells(f'C{falla_start_row}:C{falla_start_row + falla_rows - 1}')
-                ws[f'C{falla_start_row}'] = falla.get('descripcion', '')
-                ws[f'C{falla_start_row}'].font = cell_font
-                ws[f'C{falla_start_row}'].alignment = left_alignment
-                
-                # Evaluación
-                evaluacion = falla.get('evaluacion', {})
-                severidad = evaluacion.get('severidad', '')
-                detectabilidad = evaluacion.get('detectabilidad', '')
-                ocurrencia = evaluacion.get('ocurrencia', '')
-                rpn = evaluacion.get('rpn', '')
-                
-                # Tipo de riesgo y colores (3 niveles: Alto/Medio/Bajo)
-                if rpn:
-                    if rpn >= 33:
-                        tipo_riesgo = 'Alto'
-                        rpn_fill = PatternFill(start_color="dc3545", end_color="dc3545", fill_type="solid")  # Rojo
-                        tipo_fill = PatternFill(start_color="f8d7da", end_color="f8d7da", fill_type="solid")
-                        tipo_font = Font(bold=True, size=9, name='Arial', color="721c24")
-                    elif rpn >= 13:
-                        tipo_riesgo = 'Medio'
-                        rpn_fill = PatternFill(start_color="fd7e14", end_color="fd7e14", fill_type="solid")  # Naranja
-                        tipo_fill = PatternFill(start_color="ffe5d0", end_color="ffe5d0", fill_type="solid")
-                        tipo_font = Font(bold=True, size=9, name='Arial', color="8b4513")
-                    else:
-                        tipo_riesgo = 'Bajo'
-                        rpn_fill = PatternFill(start_color="28a745", end_color="28a745", fill_type="solid")  # Verde
-                        tipo_fill = PatternFill(start_color="d4edda", end_color="d4edda", fill_type="solid")
-                        tipo_font = Font(bold=True, size=9, name='Arial', color="155724")
-                else:
-                    tipo_riesgo = ''
-                    rpn_fill = None
-                    tipo_fill = None
-                    tipo_font = cell_font
-                
-                # Merge evaluación y RPN con colores
-                for col, value in [('G', severidad), ('H', detectabilidad), ('I', ocurrencia)]:
-                    if falla_rows > 1:
-                        ws.merge_cells(f'{col}{falla_start_row}:{col}{falla_start_row + falla_rows - 1}')
-                    ws[f'{col}{falla_start_row}'] = value
-                    ws[f'{col}{falla_start_row}'].font = cell_font
-                    ws[f'{col}{falla_start_row}'].alignment = center_alignment
-                
-                # Columna J (RPN) - con color de fondo
-                if falla_rows > 1:
-                    ws.merge_cells(f'J{falla_start_row}:J{falla_start_row + falla_rows - 1}')
-                ws[f'J{falla_start_row}'] = rpn
-                ws[f'J{falla_start_row}'].font = Font(bold=True, size=9, name='Arial', color="FFFFFF")
-                ws[f'J{falla_start_row}'].alignment = center_alignment
-                if rpn_fill:
-                    ws[f'J{falla_start_row}'].fill = rpn_fill
-                
-                # Columna K (Tipo de Riesgo) - con color de fondo
-                if falla_rows > 1:
-                    ws.merge_cells(f'K{falla_start_row}:K{falla_start_row + falla_rows - 1}')
-                ws[f'K{falla_start_row}'] = tipo_riesgo
-                if tipo_font:
-                    ws[f'K{falla_start_row}'].font = tipo_font
-                ws[f'K{falla_start_row}'].alignment = center_alignment
-                if tipo_fill:
-                    ws[f'K{falla_start_row}'].fill = tipo_fill
-                
-                # Responsable
-                if falla_rows > 1:
-                    ws.merge_cells(f'N{falla_start_row}:N{falla_start_row + falla_rows - 1}')
-                ws[f'N{falla_start_row}'] = falla.get('responsable', '')
-                ws[f'N{falla_start_row}'].font = cell_font
-                ws[f'N{falla_start_row}'].alignment = left_alignment
-                
-                # Escribir elementos fila por fila
-                for i in range(falla_rows):
-                    row = falla_start_row + i
-                    
-                    # Efectos
-                    efectos = falla.get('efectosPotenciales', [])
-                    ws[f'D{row}'] = efectos[i]['descripcion'] if i < len(efectos) else ''
-                    ws[f'D{row}'].font = cell_font
-                    ws[f'D{row}'].alignment = left_alignment
-                    ws[f'D{row}'].border = border_thin
-                    
-                    # Causas
-                    causas = falla.get('causasPotenciales', [])
-                    ws[f'E{row}'] = causas[i]['descripcion'] if i < len(causas) else ''
-                    ws[f'E{row}'].font = cell_font
-                    ws[f'E{row}'].alignment = left_alignment
-                    ws[f'E{row}'].border = border_thin
-                    
-                    # Barreras
-                    barreras = falla.get('barrerasExistentes', [])
-                    ws[f'F{row}'] = barreras[i]['descripcion'] if i < len(barreras) else ''
-                    ws[f'F{row}'].font = cell_font
-                    ws[f'F{row}'].alignment = left_alignment
-                    ws[f'F{row}'].border = border_thin
-                    
-                    # Acciones Recomendadas
-                    acciones_rec = falla.get('accionesRecomendadas', [])
-                    ws[f'L{row}'] = acciones_rec[i]['descripcion'] if i < len(acciones_rec) else ''
-                    ws[f'L{row}'].font = cell_font
-                    ws[f'L{row}'].alignment = left_alignment
-                    ws[f'L{row}'].border = border_thin
-                    
-                    # Acciones Tomadas
-                    acciones_tom = falla.get('accionesTomadas', [])
-                    ws[f'M{row}'] = acciones_tom[i]['descripcion'] if i < len(acciones_tom) else ''
-                    ws[f'M{row}'].font = cell_font
-                    ws[f'M{row}'].alignment = left_alignment
-                    ws[f'M{row}'].border = border_thin
-                    
-                    # Borders en merged cells
-                    for col in ['C', 'G', 'H', 'I', 'J', 'K', 'N']:
-                        ws[f'{col}{row}'].border = border_thin
-                
-                current_row += falla_rows
-                subproceso_rows += falla_rows
-            
-            # Merge subproceso
-            if subproceso_rows > 1:
-                ws.merge_cells(f'B{subproceso_start_row}:B{subproceso_start_row + subproceso_rows - 1}')
-            ws[f'B{subproceso_start_row}'] = subproceso_nombre
-            ws[f'B{subproceso_start_row}'].font = cell_font
-            ws[f'B{subproceso_start_row}'].alignment = left_alignment
-            for i in range(subproceso_rows):
-                ws[f'B{subproceso_start_row + i}'].border = border_thin
-            
-            proceso_rows += subproceso_rows
-        
-        # Merge proceso
-        if proceso_rows > 1:
-            ws.merge_cells(f'A{proceso_start_row}:A{proceso_start_row + proceso_rows - 1}')
-        ws[f'A{proceso_start_row}'] = proceso_nombre
-        ws[f'A{proceso_start_row}'].font = Font(bold=True, size=10, name='Arial')
-        ws[f'A{proceso_start_row}'].alignment = center_alignment
-        
-        # Color del proceso
-        try:
-            color_hex = proceso_color.replace('#', '')
-            fill = PatternFill(start_color=color_hex, end_color=color_hex, fill_type="solid")
-        except:
-            fill = green_light_fill
-        
-        for i in range(proceso_rows):
-            ws[f'A{proceso_start_row + i}'].fill = fill
-            ws[f'A{proceso_start_row + i}'].border = border_thin
-    
-    # ==================== AJUSTAR ANCHOS ====================
-    column_widths = {
-        'A': 12,  # PROCESO
-        'B': 15,  # SUBPROCESO
-        'C': 25,  # FALLA POTENCIAL
-        'D': 25,  # EFECTO POTENCIAL
-        'E': 20,  # CAUSAS
-        'F': 20,  # BARRERAS
-        'G': 10,  # Severidad
-        'H': 12,  # Detectabilidad
-        'I': 10,  # Ocurrencia
-        'J': 8,   # RPN
-        'K': 12,  # TIPO DE RIESGO
-        'L': 30,  # ACCIONES RECOMENDADAS
-        'M': 30,  # ACCIONES TOMADAS
-        'N': 18,  # RESPONSABLE
-        'O': 6,   # DÍA
-        'P': 6,   # MES
-        'Q': 8    # AÑO
-    }
-    
-    for col, width in column_widths.items():
-        ws.column_dimensions[col].width = width
-    
-    # Guardar
-    excel_file = BytesIO()
-    wb.save(excel_file)
+        wb.save(excel_file)
     excel_file.seek(0)
-    
     return excel_file
+
+
+def _render_streaming(plan: ExportPlan, excel_file: Optional[IO[bytes]] = None) -> IO[bytes]:
+    """
+    Volcar un plan a un Workbook write-only. Cada fila se serializa a disco
+    apenas se escribe, así que no se crean objetos de celda por toda la
+    matriz; el .xlsx resultante queda en `excel_file` (por defecto un
+    archivo temporal) posicionado al inicio.
+    """
+    wb = Workbook(write_only=True)
+    _stream_sheet(wb.create_sheet("AMFE"), WorkbookStyles(wb), plan)
+    return _save_streaming(wb, excel_file)
+
+
+def iter_file_chunks(file: IO[bytes], chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[bytes]:
+    """Leer un archivo por bloques para StreamingResponse y cerrarlo al terminar"""
+    try:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        file.close()
+
+
+def export_matrix_to_excel(matrix: AMFEMatrix, conditional: bool = False) -> BytesIO:
+    """
+    Exportar una matriz AMFE a formato Excel con estructura profesional.
+    Con conditional=True el color de RPN y tipo de riesgo es formato condicional.
+    """
+    return _render_workbook(plan_legacy(matrix.data, conditional))
+
+
+def export_matrix_to_excel_streaming(matrix: AMFEMatrix, conditional: bool = False) -> IO[bytes]:
+    """Exportar una matriz AMFE a Excel en modo streaming (sin celdas en memoria)"""
+    return _render_streaming(plan_legacy(matrix.data, conditional))
+
+
+def export_modular_matrix_to_excel(matrix: AMFEMatrix, conditional: bool = False) -> BytesIO:
+    """
+    Exportar una matriz AMFE modular a formato Excel con el formato EXACTO de Club Noel.
+    Respeta la estructura, celdas combinadas, colores y títulos específicos.
+    Con conditional=True el color de RPN y tipo de riesgo es formato condicional.
+    """
+    return _render_workbook(plan_modular(matrix.data, conditional))
+
+
+def export_modular_matrix_to_excel_streaming(matrix: AMFEMatrix, conditional: bool = False) -> IO[bytes]:
+    """
+    Exportar una matriz AMFE modular a Excel en modo streaming (sin celdas en memoria).
+    Mismo formato que export_modular_matrix_to_excel.
+    """
+    return _render_streaming(plan_modular(matrix.data, conditional))
+
+
+EXPORTERS = {
+    'legacy': (export_matrix_to_excel, export_matrix_to_excel_streaming),
+    'modular': (export_modular_matrix_to_excel, export_modular_matrix_to_excel_streaming),
+}
+
+
+def render_export_file(kind: str, data: dict, excel_file: IO[bytes], conditional: bool = False) -> IO[bytes]:
+    """
+    Renderizar una exportación ('legacy' o 'modular') en streaming a partir
+    del dict `data` de la matriz, sin objetos de la base de datos. Es lo que
+    ejecutan los workers de export_jobs en otro proceso.
+    """
+    return _render_streaming(plan_export(kind, data, conditional), excel_file=excel_file)
+
+
+def _sheet_title(title: str, used: set) -> str:
+    # Excel: máximo 31 caracteres, sin []:*?/\ y sin repetir (sin distinguir mayúsculas)
+    clean = ''.join('_' if ch in '[]:*?/\\' else ch for ch in title).strip("' ") or "AMFE"
+    candidate = clean[:31]
+    n = 2
+    while candidate.lower() in used:
+        suffix = f" ({n})"
+        candidate = clean[:31 - len(suffix)] + suffix
+        n += 1
+    used.add(candidate.lower())
+    return candidate
+
+
+def render_multi_sheet_file(items, excel_file: IO[bytes], conditional: bool = False) -> IO[bytes]:
+    """
+    Renderizar varias matrices en un solo workbook, una hoja por matriz.
+    `items` es una lista de (tipo, título de hoja, data).
+    """
+    wb = Workbook(write_only=True)
+    styles = WorkbookStyles(wb)
+    used = set()
+    for kind, title, data in items:
+        _stream_sheet(wb.create_sheet(_sheet_title(title, used)), styles, plan_export(kind, data, conditional))
+    return _save_streaming(wb, excel_file)
+
+
+def export_kind(matrix: AMFEMatrix) -> str:
+    """Tipo de exportación que corresponde a una matriz"""
+    return 'modular' if matrix.data.get('type') == 'modular' else 'legacy'
+
+
+def export_filename(matrix: AMFEMatrix, kind: str) -> str:
+    """Nombre del .xlsx descargado para una matriz"""
+    prefix = "AMFE_Modular" if kind == 'modular' else "AMFE"
+    return f"{prefix}_{matrix.name.replace(' ', '_')}_{matrix.id}.xlsx"
+
+
+def export_cache_key(matrix: AMFEMatrix, kind: str, conditional: bool = False):
+    """
+    Clave de caché: (tipo, id, `version` de la matriz, versión del exportador
+    y de los logos). La variante con formato condicional es otro archivo:
+    lleva el sufijo "cf" en la versión.
+    """
+    version = f"{EXPORTER_VERSION}.{logo_cache.version}"
+    if conditional:
+        version += ".cf"
+    return (kind, matrix.id, str(matrix.version), version)
+
+
+def export_matrix_cached(matrix: AMFEMatrix, kind: str, stream: bool = False,
+                         conditional: bool = False) -> IO[bytes]:
+    """
+    Exportar una matriz ('legacy' o 'modular') pasando por la caché de
+    exportaciones. Un acierto devuelve el archivo guardado sin usar openpyxl.
+    En modo streaming el resultado se guarda solo en el nivel en disco.
+    """
+    export, export_streaming = EXPORTERS[kind]
+    key = export_cache_key(matrix, kind, conditional)
+    
+    if stream:
+        excel_file = export_cache.open(key)
+        if excel_file is None:
+            excel_file = export_streaming(matrix, conditional)
+            export_cache.put_file(key, excel_file)
+        return excel_file
+    
+    data = export_cache.get(key)
+    if data is None:
+        data = export(matrix, conditional).getvalue()
+        export_cache.put(key, data)
+    return BytesIO(data)
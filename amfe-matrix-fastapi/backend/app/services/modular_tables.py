@@ -0,0 +1,136 @@
+from typing import List
+import logging
+
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.models import AMFEMatrix, matrix_type, MatrixProceso, MatrixSubproceso, MatrixFalla, MatrixFallaItem
+from app.services.excel_styles import modular_risk
+
+logger = logging.getLogger(__name__)
+
+# Listas de una falla que van a amfe_falla_items: (clave en el documento, tipo)
+FALLA_ITEM_LISTS = (
+    ('efectosPotenciales', 'efecto'),
+    ('causasPotenciales', 'causa'),
+    ('barrerasExistentes', 'barrera'),
+    ('accionesRecomendadas', 'accion_recomendada'),
+    ('accionesTomadas', 'accion_tomada'),
+)
+
+# Orden de borrado: de las hojas a la raíz (SQLite no aplica ON DELETE CASCADE por defecto)
+NORMALIZED_MODELS = (MatrixFallaItem, MatrixFalla, MatrixSubproceso, MatrixProceso)
+
+
+def is_modular(data: dict) -> bool:
+    return isinstance(data, dict) and data.get('type') == 'modular'
+
+
+def _int_or_none(value):
+    try:
+        return int(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+
+def falla_search_text(proceso: dict, subproceso: dict, falla: dict) -> str:
+    """Textos de una falla para la búsqueda (MatrixFalla.search_text), uno por línea"""
+    texts = [proceso.get('nombre'), subproceso.get('nombre'), falla.get('descripcion')]
+    for key, _ in FALLA_ITEM_LISTS:
+        texts.extend(item.get('descripcion') for item in falla.get(key) or [])
+    texts.append(falla.get('responsable'))
+    return '\n'.join(text for text in texts if isinstance(text, str) and text.strip())
+
+
+def build_modular_rows(matrix_id: int, data: dict) -> List[MatrixProceso]:
+    """
+    Filas normalizadas de un documento modular: los procesos, con sus
+    subprocesos, fallas e items ya enlazados (basta con agregar los procesos
+    a la sesión). Recorre `data` sin validar, como las exportaciones.
+    """
+    procesos = []
+    for p_pos, proceso in enumerate(data.get('procesos', [])):
+        db_proceso = MatrixProceso(
+            matrix_id=matrix_id, position=p_pos, ref=proceso.get('id'),
+            nombre=proceso.get('nombre'), color=proceso.get('color'),
+        )
+        for s_pos, subproceso in enumerate(proceso.get('subprocesos', [])):
+            db_subproceso = MatrixSubproceso(
+                matrix_id=matrix_id, position=s_pos, ref=subproceso.get('id'), nombre=subproceso.get('nombre'),
+            )
+            for f_pos, falla in enumerate(subproceso.get('fallasPotenciales', [])):
+                evaluacion = falla.get('evaluacion') or {}
+                rpn = _int_or_none(evaluacion.get('rpn'))
+                db_falla = MatrixFalla(
+                    matrix_id=matrix_id, position=f_pos, ref=falla.get('id'),
+                    descripcion=falla.get('descripcion'), responsable=falla.get('responsable'),
+                    severidad=_int_or_none(evaluacion.get('severidad')),
+                    detectabilidad=_int_or_none(evaluacion.get('detectabilidad')),
+                    ocurrencia=_int_or_none(evaluacion.get('ocurrencia')),
+                    rpn=rpn, tipo_riesgo=modular_risk(rpn)[0] or None,
+                    search_text=falla_search_text(proceso, subproceso, falla),
+                )
+                for key, tipo in FALLA_ITEM_LISTS:
+                    for i_pos, item in enumerate(falla.get(key) or []):
+                        db_falla.items.append(MatrixFallaItem(
+                            matrix_id=matrix_id, tipo=tipo, position=i_pos,
+                            ref=item.get('id'), descripcion=item.get('descripcion'),
+                        ))
+                db_subproceso.fallas.append(db_falla)
+            db_proceso.subprocesos.append(db_subproceso)
+        procesos.append(db_proceso)
+    return procesos
+
+
+def _delete_statements(matrix_id: int):
+    return [delete(model).where(model.matrix_id == matrix_id) for model in NORMALIZED_MODELS]
+
+
+async def delete_modular_tables(db: AsyncSession, matrix_id: int):
+    """Borrar las filas normalizadas de una matriz (sin commit)"""
+    for statement in _delete_statements(matrix_id):
+        await db.execute(statement)
+
+
+async def sync_modular_tables(db: AsyncSession, matrix: AMFEMatrix):
+    """
+    Reescribir las filas normalizadas de una matriz a partir de su `data`, en
+    la misma transacción que la escritura de la matriz (sin commit). Una
+    matriz que no es modular queda sin filas.
+    """
+    await delete_modular_tables(db, matrix.id)
+    if is_modular(matrix.data):
+        db.add_all(build_modular_rows(matrix.id, matrix.data))
+
+
+# ==================== BACKFILL (sync) ====================
+
+def sync_modular_tables_sync(db: Session, matrix_id: int, data: dict):
+    """Versión sync de sync_modular_tables, para scripts y migraciones"""
+    for statement in _delete_statements(matrix_id):
+        db.execute(statement)
+    if is_modular(data):
+        db.add_all(build_modular_rows(matrix_id, data))
+
+
+def backfill_modular_tables(db: Session, batch_size: int = 50) -> int:
+    """
+    Poblar las tablas normalizadas con todas las matrices modulares
+    existentes, con un commit por lote. Se puede repetir: cada matriz se
+    reescribe completa. Devuelve cuántas matrices se procesaron.
+    """
+    count = 0
+    ids = db.scalars(
+        select(AMFEMatrix.id).where(matrix_type == 'modular').order_by(AMFEMatrix.id)
+    ).all()
+    for i in range(0, len(ids), batch_size):
+        # Solo las columnas necesarias: las migraciones corren con el modelo actual, que puede tener columnas nuevas
+        batch = db.execute(select(AMFEMatrix.id, AMFEMatrix.data).where(AMFEMatrix.id.in_(ids[i:i + batch_size]))).all()
+        for matrix_id, data in batch:
+            sync_modular_tables_sync(db, matrix_id, data)
+            count += 1
+        db.commit()
+        db.expunge_all()
+        logger.info("Backfill de tablas modulares: %d/%d matrices", count, len(ids))
+    return count
@@ -0,0 +1,51 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from typing import List, Optional, Sequence, Tuple
+import json
+
+# Header con el cursor de la página siguiente (ausente en la última página).
+# El cuerpo de las respuestas sigue siendo una lista, como con skip/limit.
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(last_id: int) -> str:
+    """Cursor opaco que apunta a la fila siguiente a `last_id`"""
+    raw = json.dumps({"id": last_id}, separators=(',', ':')).encode()
+    return urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+def decode_cursor(cursor: str) -> int:
+    """Último id de la página anterior; ValueError si el cursor no es válido"""
+    try:
+        raw = urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        last_id = json.loads(raw)["id"]
+    except (ValueError, TypeError, KeyError) as exc:
+        raise ValueError("invalid cursor") from exc
+    if not isinstance(last_id, int):
+        raise ValueError("invalid cursor")
+    return last_id
+
+
+def paginate(query, id_column, skip: int, limit: int, cursor: Optional[str] = None):
+    """
+    Agregar la paginación a un select() ordenado por `id_column`. Con cursor
+    es por keyset (WHERE id > último id, sobre el índice de la clave
+    primaria) y no depende de cuántas filas haya antes; sin cursor se usa
+    el offset de siempre. Se pide una fila de más para saber si hay otra
+    página (ver split_page).
+    """
+    if cursor is not None:
+        query = query.where(id_column > decode_cursor(cursor))
+    elif skip:
+        query = query.offset(skip)
+    return query.limit(limit + 1)
+
+
+def split_page(rows: Sequence, limit: int, get_id) -> Tuple[List, Optional[str]]:
+    """Las filas de la página y el cursor de la siguiente (None si no hay más)"""
+    rows = list(rows)
+    if limit <= 0:
+        return [], None
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(get_id(rows[-1]))
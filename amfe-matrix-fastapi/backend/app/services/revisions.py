@@ -0,0 +1,334 @@
+"""
+Historial de revisiones de las matrices (amfe_matrix_revisions).
+
+La matriz guarda siempre el documento actual; cada escritura agrega una
+revisión con las diferencias estructurales respecto de la anterior (delta)
+o, cada REVISION_SNAPSHOT_INTERVAL revisiones, con el documento completo
+(snapshot). Ambos se guardan como JSON comprimido con zlib. Reconstruir una
+revisión parte del snapshot más cercano hacia atrás y aplica a lo sumo
+REVISION_SNAPSHOT_INTERVAL - 1 deltas.
+
+El documento de una revisión es {"name", "description", "data"}. Un delta es
+una lista de operaciones {"op", "path", "value"} con `path` como lista de
+segmentos. En las listas cuyos elementos tienen un `id` de texto único
+(procesos, subprocesos, fallas e items de las matrices modulares) el segmento
+es ese id, como en matrix_patch; en las demás, la posición (int):
+  - add: agregar una clave, o un elemento (al final si el segmento es un id)
+  - remove: quitar una clave o un elemento
+  - replace: reemplazar un valor (path vacío: el documento completo)
+  - order: nuevo orden de una lista con ids (`value`: los ids)
+"""
+from typing import List, Optional
+import json
+import logging
+import os
+import zlib
+
+from sqlalchemy import case, delete, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.models import AMFEMatrix, MatrixRevision
+
+logger = logging.getLogger(__name__)
+
+REVISION_SNAPSHOT_INTERVAL = max(int(os.getenv("REVISION_SNAPSHOT_INTERVAL", "20")), 1)
+REVISION_COMPRESS_LEVEL = 6
+
+SNAPSHOT, DELTA = 'snapshot', 'delta'
+
+# Un delta de al menos esta fracción del documento (en JSON) se guarda como snapshot
+SNAPSHOT_DELTA_RATIO = 0.5
+
+
+class RevisionNotFound(Exception):
+    """La matriz no tiene la revisión pedida"""
+
+
+def revision_document(matrix: AMFEMatrix) -> dict:
+    """Documento versionado de una matriz: nombre, descripción y `data`"""
+    return {"name": matrix.name, "description": matrix.description, "data": matrix.data}
+
+
+def _dumps(value) -> bytes:
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def _pack(raw: bytes) -> bytes:
+    return zlib.compress(raw, REVISION_COMPRESS_LEVEL)
+
+
+def _unpack(payload: bytes):
+    return json.loads(zlib.decompress(payload))
+
+
+# ==================== DIFERENCIAS ====================
+
+def _id_list(items: list) -> bool:
+    """Lista cuyos elementos son objetos con un `id` de texto único"""
+    ids = set()
+    for item in items:
+        if not isinstance(item, dict) or not isinstance(item.get('id'), str) or item['id'] in ids:
+            return False
+        ids.add(item['id'])
+    return True
+
+
+def _diff(old, new, path: list, ops: list):
+    if isinstance(old, dict) and isinstance(new, dict):
+        if old == new:
+            return
+        for key in old:
+            if key not in new:
+                ops.append({"op": "remove", "path": path + [key]})
+        for key, value in new.items():
+            if key in old:
+                _diff(old[key], value, path + [key], ops)
+            else:
+                ops.append({"op": "add", "path": path + [key], "value": value})
+    elif isinstance(old, list) and isinstance(new, list):
+        if old == new:
+            return
+        if _id_list(old) and _id_list(new):
+            old_by_id = {item['id']: item for item in old}
+            new_ids = [item['id'] for item in new]
+            kept = set(new_ids)
+            for item_id in old_by_id:
+                if item_id not in kept:
+                    ops.append({"op": "remove", "path": path + [item_id]})
+            for item in new:
+                if item['id'] in old_by_id:
+                    _diff(old_by_id[item['id']], item, path + [item['id']], ops)
+                else:
+                    ops.append({"op": "add", "path": path + [item['id']], "value": item})
+            # Los agregados quedan al final: solo hace falta `order` si el orden final es otro
+            expected = [item_id for item_id in old_by_id if item_id in kept]
+            expected += [item_id for item_id in new_ids if item_id not in old_by_id]
+            if expected != new_ids:
+                ops.append({"op": "order", "path": path, "value": new_ids})
+        else:
+            common = min(len(old), len(new))
+            for index in range(common):
+                _diff(old[index], new[index], path + [index], ops)
+            for index in range(len(old) - 1, common - 1, -1):
+                ops.append({"op": "remove", "path": path + [index]})
+            for index in range(common, len(new)):
+                ops.append({"op": "add", "path": path + [index], "value": new[index]})
+    elif type(old) is not type(new) or old != new:
+        ops.append({"op": "replace", "path": path, "value": new})
+
+
+def diff_documents(old, new) -> List[dict]:
+    """Operaciones que transforman `old` en `new` (vacía si son iguales)"""
+    ops: List[dict] = []
+    _diff(old, new, [], ops)
+    return ops
+
+
+def _index(items: list, segment) -> int:
+    if isinstance(segment, int):
+        return segment
+    for index, item in enumerate(items):
+        if isinstance(item, dict) and item.get('id') == segment:
+            return index
+    raise KeyError(segment)
+
+
+def _resolve(document, path: list):
+    for segment in path:
+        document = document[_index(document, segment)] if isinstance(document, list) else document[segment]
+    return document
+
+
+def apply_delta(document, ops: List[dict]):
+    """
+    Aplicar un delta de diff_documents. Modifica `document` (salvo si se
+    reemplaza entero) y devuelve el resultado.
+    """
+    for op in ops:
+        path, kind = op['path'], op['op']
+        if kind == 'order':
+            items = _resolve(document, path)
+            by_id = {item['id']: item for item in items}
+            items[:] = [by_id[item_id] for item_id in op['value']]
+            continue
+        if not path:
+            document = op['value']
+            continue
+        parent, key = _resolve(document, path[:-1]), path[-1]
+        if isinstance(parent, list):
+            if kind == 'add':
+                parent.insert(key if isinstance(key, int) else len(parent), op['value'])
+            elif kind == 'remove':
+                del parent[_index(parent, key)]
+            else:
+                parent[_index(parent, key)] = op['value']
+        elif kind == 'remove':
+            del parent[key]
+        else:
+            parent[key] = op['value']
+    return document
+
+
+def _pointer(path: list) -> str:
+    """Ruta como JSON Pointer (RFC 6901)"""
+    return ''.join('/' + str(segment).replace('~', '~0').replace('/', '~1') for segment in path)
+
+
+def describe_changes(old: dict, new: dict) -> List[dict]:
+    """
+    Cambios entre dos documentos para mostrar: las operaciones de
+    diff_documents con la ruta como JSON Pointer y, en remove y replace, el
+    valor anterior (`old`).
+    """
+    changes = []
+    for op in diff_documents(old, new):
+        change = {"op": op['op'], "path": _pointer(op['path']), "value": op.get('value')}
+        if op['op'] in ('remove', 'replace'):
+            change['old'] = _resolve(old, op['path'])
+        changes.append(change)
+    return changes
+
+
+# ==================== ESCRITURA ====================
+
+def build_revision(matrix_id: int, document: dict, revision: int = 1, user_id: Optional[int] = None,
+                   raw: Optional[bytes] = None) -> MatrixRevision:
+    """Revisión snapshot con el documento completo (p. ej. la 1 de una matriz nueva)"""
+    return MatrixRevision(matrix_id=matrix_id, revision=revision, kind=SNAPSHOT,
+                          payload=_pack(raw if raw is not None else _dumps(document)), created_by=user_id)
+
+
+async def record_revision(db: AsyncSession, matrix: AMFEMatrix, previous: Optional[dict] = None,
+                          user_id: Optional[int] = None):
+    """
+    Agregar la revisión del estado actual de `matrix`, en la misma transacción
+    que su escritura (sin commit). El delta se calcula siempre contra la
+    última revisión guardada (reconstruida), no contra lo que leyó quien
+    escribe. `previous` (revision_document antes de la escritura) solo se usa
+    si la matriz no tenía historial (creada antes que el historial): se guarda
+    primero como revisión 1. Si no cambió nada no se agrega revisión.
+    """
+    # Primero el UPDATE (o INSERT) de la matriz: toma el lock de su fila hasta
+    # el commit, así dos escrituras de la misma matriz leen la última revisión
+    # y agregan la siguiente de a una
+    await db.flush()
+    current = revision_document(matrix)
+    last, last_snapshot = (await db.execute(
+        select(func.max(MatrixRevision.revision),
+               func.max(case((MatrixRevision.kind == SNAPSHOT, MatrixRevision.revision))))
+        .where(MatrixRevision.matrix_id == matrix.id)
+    )).one()
+    if last is None:
+        if previous is None or previous == current:
+            db.add(build_revision(matrix.id, current, user_id=user_id))
+            return
+        db.add(build_revision(matrix.id, previous))
+        last = last_snapshot = 1
+    else:
+        previous = await get_revision_document(db, matrix.id, last)
+
+    ops = diff_documents(previous, current)
+    if not ops:
+        return
+    revision = last + 1
+    delta = _dumps(ops)
+    raw = _dumps(current)
+    if revision - last_snapshot >= REVISION_SNAPSHOT_INTERVAL or len(delta) >= len(raw) * SNAPSHOT_DELTA_RATIO:
+        db.add(build_revision(matrix.id, current, revision, user_id, raw=raw))
+    else:
+        db.add(MatrixRevision(matrix_id=matrix.id, revision=revision, kind=DELTA,
+                              payload=_pack(delta), created_by=user_id))
+
+
+async def delete_revisions(db: AsyncSession, matrix_id: int):
+    """Borrar el historial de una matriz (sin commit)"""
+    await db.execute(delete(MatrixRevision).where(MatrixRevision.matrix_id == matrix_id))
+
+
+# ==================== LECTURA ====================
+
+async def list_revisions(db: AsyncSession, matrix_id: int) -> List[dict]:
+    """Revisiones de una matriz, de la más reciente a la más antigua, sin descomprimir"""
+    query = (
+        select(MatrixRevision.revision, MatrixRevision.kind, func.length(MatrixRevision.payload).label('size'),
+               MatrixRevision.created_at, MatrixRevision.created_by)
+        .where(MatrixRevision.matrix_id == matrix_id)
+        .order_by(MatrixRevision.revision.desc())
+    )
+    return [row._asdict() for row in await db.execute(query)]
+
+
+async def _revision_chain(db: AsyncSession, matrix_id: int, revision: int) -> List[MatrixRevision]:
+    """Snapshot más cercano hasta `revision` y los deltas que siguen, en orden"""
+    base = (
+        select(func.max(MatrixRevision.revision))
+        .where(MatrixRevision.matrix_id == matrix_id, MatrixRevision.kind == SNAPSHOT,
+               MatrixRevision.revision <= revision)
+        .scalar_subquery()
+    )
+    rows = (await db.scalars(
+        select(MatrixRevision)
+        .where(MatrixRevision.matrix_id == matrix_id, MatrixRevision.revision.between(base, revision))
+        .order_by(MatrixRevision.revision)
+    )).all()
+    if not rows or rows[-1].revision != revision:
+        raise RevisionNotFound()
+    return rows
+
+
+async def get_revision(db: AsyncSession, matrix_id: int, revision: int) -> dict:
+    """
+    Reconstruir una revisión: su documento (name, description, data) con
+    número, tipo y autor. RevisionNotFound si no existe.
+    """
+    rows = await _revision_chain(db, matrix_id, revision)
+    document = _unpack(rows[0].payload)
+    for row in rows[1:]:
+        document = apply_delta(document, _unpack(row.payload))
+    target = rows[-1]
+    return {
+        "revision": target.revision, "kind": target.kind, "size": len(target.payload),
+        "created_at": target.created_at, "created_by": target.created_by, **document,
+    }
+
+
+async def get_revision_document(db: AsyncSession, matrix_id: int, revision: int) -> dict:
+    """Solo el documento (name, description, data) de una revisión"""
+    result = await get_revision(db, matrix_id, revision)
+    return {key: result[key] for key in ("name", "description", "data")}
+
+
+async def diff_revisions(db: AsyncSession, matrix_id: int, from_revision: int, to_revision: int) -> List[dict]:
+    """Cambios (describe_changes) de la revisión `from_revision` a `to_revision`"""
+    old = await get_revision_document(db, matrix_id, from_revision)
+    new = await get_revision_document(db, matrix_id, to_revision)
+    return describe_changes(old, new)
+
+
+# ==================== BACKFILL (sync) ====================
+
+def backfill_revisions(db: Session, batch_size: int = 200) -> int:
+    """
+    Guardar como revisión 1 el documento actual de las matrices sin historial,
+    con un commit por lote. Devuelve cuántas matrices se procesaron.
+    """
+    count = 0
+    has_history = select(MatrixRevision.matrix_id).where(MatrixRevision.matrix_id == AMFEMatrix.id).exists()
+    ids = db.scalars(select(AMFEMatrix.id).where(~has_history).order_by(AMFEMatrix.id)).all()
+    for i in range(0, len(ids), batch_size):
+        # Solo las columnas necesarias: las migraciones corren con el modelo actual, que puede tener columnas nuevas
+        matrices = db.execute(
+            select(AMFEMatrix.id, AMFEMatrix.name, AMFEMatrix.description, AMFEMatrix.data,
+                   AMFEMatrix.created_by, AMFEMatrix.updated_at)
+            .where(AMFEMatrix.id.in_(ids[i:i + batch_size]))
+        ).all()
+        for matrix in matrices:
+            revision = build_revision(matrix.id, revision_document(matrix), user_id=matrix.created_by)
+            revision.created_at = matrix.updated_at
+            db.add(revision)
+        db.commit()
+        db.expunge_all()
+        count += len(matrices)
+        logger.info("Backfill del historial de revisiones: %d/%d matrices", count, len(ids))
+    return count
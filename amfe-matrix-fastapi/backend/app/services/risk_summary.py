@@ -0,0 +1,97 @@
+from typing import Optional
+import logging
+
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.models import AMFEMatrix, MatrixRiskSummary, matrix_type
+from app.services.excel_styles import modular_risk
+from app.services.modular_tables import is_modular, _int_or_none
+
+logger = logging.getLogger(__name__)
+
+# Tipo de riesgo (modular_risk) -> columna de MatrixRiskSummary
+RISK_COLUMNS = {'Alto': 'riesgo_alto', 'Medio': 'riesgo_medio', 'Bajo': 'riesgo_bajo'}
+
+
+def compute_risk_summary(data: dict) -> dict:
+    """
+    Totales de riesgo de un documento modular (columnas de MatrixRiskSummary
+    sin matrix_id). Recorre `data` sin validar, como build_modular_rows.
+    """
+    summary = {
+        'procesos': 0, 'subprocesos': 0, 'fallas': 0,
+        'riesgo_alto': 0, 'riesgo_medio': 0, 'riesgo_bajo': 0, 'sin_evaluar': 0,
+        'max_rpn': None, 'mean_rpn': None,
+        'acciones_recomendadas': 0, 'acciones_abiertas': 0,
+    }
+    rpns = []
+    for proceso in data.get('procesos', []):
+        summary['procesos'] += 1
+        for subproceso in proceso.get('subprocesos', []):
+            summary['subprocesos'] += 1
+            for falla in subproceso.get('fallasPotenciales', []):
+                summary['fallas'] += 1
+                rpn = _int_or_none((falla.get('evaluacion') or {}).get('rpn'))
+                tipo = modular_risk(rpn)[0]
+                if tipo:
+                    summary[RISK_COLUMNS[tipo]] += 1
+                    rpns.append(rpn)
+                else:
+                    summary['sin_evaluar'] += 1
+                recomendadas = len(falla.get('accionesRecomendadas') or [])
+                tomadas = len(falla.get('accionesTomadas') or [])
+                summary['acciones_recomendadas'] += recomendadas
+                summary['acciones_abiertas'] += max(recomendadas - tomadas, 0)
+    if rpns:
+        summary['max_rpn'] = max(rpns)
+        summary['mean_rpn'] = round(sum(rpns) / len(rpns), 2)
+    return summary
+
+
+def build_risk_summary(matrix_id: int, data: dict) -> Optional[MatrixRiskSummary]:
+    """Fila de resumen de una matriz (None si no es modular)"""
+    if not is_modular(data):
+        return None
+    return MatrixRiskSummary(matrix_id=matrix_id, **compute_risk_summary(data))
+
+
+async def sync_risk_summary(db: AsyncSession, matrix: AMFEMatrix):
+    """
+    Recalcular el resumen de riesgo de una matriz a partir de su `data`, en
+    la misma transacción que la escritura de la matriz (sin commit)
+    """
+    await db.execute(delete(MatrixRiskSummary).where(MatrixRiskSummary.matrix_id == matrix.id))
+    summary = build_risk_summary(matrix.id, matrix.data)
+    if summary is not None:
+        db.add(summary)
+
+
+async def delete_risk_summary(db: AsyncSession, matrix_id: int):
+    """Borrar el resumen de una matriz (sin commit)"""
+    await db.execute(delete(MatrixRiskSummary).where(MatrixRiskSummary.matrix_id == matrix_id))
+
+
+# ==================== BACKFILL (sync) ====================
+
+def backfill_risk_summaries(db: Session, batch_size: int = 200) -> int:
+    """
+    Calcular el resumen de todas las matrices modulares existentes, con un
+    commit por lote. Se puede repetir: cada resumen se reescribe. Devuelve
+    cuántas matrices se procesaron.
+    """
+    count = 0
+    ids = db.scalars(
+        select(AMFEMatrix.id).where(matrix_type == 'modular').order_by(AMFEMatrix.id)
+    ).all()
+    for i in range(0, len(ids), batch_size):
+        batch_ids = ids[i:i + batch_size]
+        rows = db.execute(select(AMFEMatrix.id, AMFEMatrix.data).where(AMFEMatrix.id.in_(batch_ids))).all()
+        db.execute(delete(MatrixRiskSummary).where(MatrixRiskSummary.matrix_id.in_(batch_ids)))
+        db.add_all(summary for summary in (build_risk_summary(matrix_id, data) for matrix_id, data in rows)
+                   if summary is not None)
+        db.commit()
+        count += len(rows)
+        logger.info("Backfill de resúmenes de riesgo: %d/%d matrices", count, len(ids))
+    return count
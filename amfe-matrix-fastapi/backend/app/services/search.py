@@ -0,0 +1,121 @@
+"""
+Búsqueda de texto en las fallas de las matrices modulares (GET /search).
+
+Se busca en MatrixFalla.search_text (proceso, subproceso, descripción,
+efectos, causas, barreras, acciones y responsable de cada falla), que se
+reescribe con las tablas normalizadas en cada escritura de la matriz:
+  - Postgres: websearch_to_tsquery / ts_rank_cd con la configuración
+    amfe_es (español, sin tildes) sobre el índice GIN de
+    fallas_search_vector; el fragmento (ts_headline) se calcula solo para
+    las filas de la página.
+  - SQLite: FTS5 (amfe_fallas_fts) con bm25 y snippet; cada palabra de la
+    consulta se busca como prefijo, ya que FTS5 no tiene stemming en español.
+"""
+from typing import List, Optional
+import re
+
+from sqlalchemy import column, func, literal_column, select, table
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import (
+    AMFEMatrix, MatrixFalla, MatrixSubproceso, MatrixProceso,
+    SEARCH_CONFIG, SEARCH_FTS_TABLE, fallas_search_vector, matrix_servicio, matrix_area,
+)
+from app.services.matrix_service import filter_matrices
+
+SEARCH_MAX_LIMIT = 100
+
+# Marcas del término encontrado en el fragmento
+HIGHLIGHT_START, HIGHLIGHT_STOP = '<b>', '</b>'
+SNIPPET_WORDS = 16
+
+_config = literal_column(f"'{SEARCH_CONFIG}'::regconfig")
+_fts = table(SEARCH_FTS_TABLE, column('rowid'))
+_WORD = re.compile(r'\w+')
+
+
+def _fts5_query(q: str) -> Optional[str]:
+    """Consulta FTS5: todas las palabras (AND), cada una como prefijo y entre comillas"""
+    words = _WORD.findall(q)
+    return ' '.join(f'"{word}"*' for word in words) if words else None
+
+
+def _hit_columns():
+    return (
+        MatrixFalla.matrix_id, AMFEMatrix.name.label('matrix_name'),
+        matrix_servicio.label('servicio'), matrix_area.label('area'),
+        MatrixProceso.nombre.label('proceso'), MatrixSubproceso.nombre.label('subproceso'),
+        MatrixFalla.ref.label('falla_ref'), MatrixFalla.descripcion.label('falla'),
+        MatrixFalla.rpn, MatrixFalla.tipo_riesgo,
+    )
+
+
+def _with_path(query):
+    """Unir proceso, subproceso y matriz de cada falla"""
+    return (
+        query
+        .join(MatrixSubproceso, MatrixSubproceso.id == MatrixFalla.subproceso_id)
+        .join(MatrixProceso, MatrixProceso.id == MatrixSubproceso.proceso_id)
+        .join(AMFEMatrix, AMFEMatrix.id == MatrixFalla.matrix_id)
+    )
+
+
+def _postgresql_query(q: str, limit: int, **filters):
+    tsquery = func.websearch_to_tsquery(_config, q)
+    rank = func.ts_rank_cd(fallas_search_vector, tsquery)
+    page = (
+        filter_matrices(
+            select(MatrixFalla.id, rank.label('rank'))
+            .join(AMFEMatrix, AMFEMatrix.id == MatrixFalla.matrix_id)
+            .where(fallas_search_vector.op('@@')(tsquery)),
+            **filters
+        )
+        .order_by(None).order_by(rank.desc(), MatrixFalla.id)
+        .limit(limit)
+        .subquery()
+    )
+    options = f"StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, MaxWords={SNIPPET_WORDS}, MinWords=5"
+    snippet = func.ts_headline(_config, MatrixFalla.search_text, tsquery, options)
+    return _with_path(
+        select(*_hit_columns(), page.c.rank, snippet.label('snippet'))
+        .select_from(page)
+        .join(MatrixFalla, MatrixFalla.id == page.c.id)
+    ).order_by(page.c.rank.desc(), MatrixFalla.id)
+
+
+def _sqlite_query(q: str, limit: int, **filters):
+    match = _fts5_query(q)
+    fts = literal_column(SEARCH_FTS_TABLE)
+    # bm25 es menor cuanto más relevante: se invierte para que rank sea "mayor es mejor"
+    rank = (-func.bm25(fts)).label('rank')
+    snippet = func.snippet(fts, 0, HIGHLIGHT_START, HIGHLIGHT_STOP, '…', SNIPPET_WORDS).label('snippet')
+    query = _with_path(
+        select(*_hit_columns(), rank, snippet)
+        .select_from(_fts)
+        .join(MatrixFalla, MatrixFalla.id == _fts.c.rowid)
+    ).where(fts.op('MATCH')(match))
+    return filter_matrices(query, **filters).order_by(None).order_by(func.bm25(fts), MatrixFalla.id).limit(limit)
+
+
+async def search_fallas(db: AsyncSession, q: str, limit: int = 20, **filters) -> List[dict]:
+    """
+    Fallas cuyo texto coincide con `q`, de la más relevante a la menos, con
+    su ruta (proceso → subproceso → falla), un fragmento con los términos
+    marcados y el id de la matriz. `filters` son los de filter_matrices.
+    """
+    if not _WORD.search(q):
+        return []
+    if db.bind.dialect.name == 'postgresql':
+        query = _postgresql_query(q, limit, **filters)
+    else:
+        query = _sqlite_query(q, limit, **filters)
+    hits = []
+    for row in await db.execute(query):
+        hit = row._asdict()
+        hit['rank'] = round(float(hit['rank']), 6)
+        if hit['snippet']:
+            hit['snippet'] = hit['snippet'].replace('\n', ' · ')  # Un texto por línea en search_text
+        hit['path'] = ' → '.join(part or '' for part in (hit['proceso'], hit['subproceso'], hit['falla']))
+        hit['matrix_url'] = f"/matrices/modular/{hit['matrix_id']}"
+        hits.append(hit)
+    return hits
@@ -0,0 +1,53 @@
+"""
+Benchmark del costo por fila de las exportaciones a Excel.
+
+Genera matrices sintéticas (modular y clásica), las exporta varias veces y
+reporta el tiempo por fila de datos escrita, separando la planificación
+(export_plan) del render a Excel. No necesita base de datos.
+
+Uso (desde backend/):
+    python -m benchmarks.bench_export_rows
+    python -m benchmarks.bench_export_rows --procesos 20 --repeat 5
+"""
+import os
+import argparse
+import time
+
+# Las exportaciones no tocan la base de datos; evitar conectar a Postgres al importar app
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from app.services.export_plan import plan_legacy, plan_modular
+from app.services.matrix_service import export_matrix_to_excel, export_modular_matrix_to_excel
+from benchmarks.synthetic import build_modular_matrix, build_legacy_matrix
+
+
+def _time(func, arg, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(arg)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--procesos", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    modular, modular_rows = build_modular_matrix(args.procesos)
+    legacy, legacy_rows = build_legacy_matrix(modular_rows)
+
+    for label, export, plan, matrix, rows in [
+        ("modular", export_modular_matrix_to_excel, plan_modular, modular, modular_rows),
+        ("clasica", export_matrix_to_excel, plan_legacy, legacy, legacy_rows),
+    ]:
+        seconds = _time(export, matrix, args.repeat)
+        plan_seconds = _time(plan, matrix.data, args.repeat)
+        print(f"{label:8s} filas={rows:6d} total={seconds * 1000:9.1f} ms  por_fila={seconds / rows * 1e6:7.1f} µs"
+              f"  plan={plan_seconds * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Suite de benchmarks de las exportaciones a Excel.
+
+Genera matrices sintéticas (benchmarks/synthetic.py) a varias escalas
+(1/10/100 procesos y distintas formas de subprocesos/fallas/efectos),
+las exporta con los exportadores de matrix_service y registra por caso:
+tiempo (mínimo/mediana de `--repeat` corridas), pico de tracemalloc, pico
+de RSS del proceso y tamaño del archivo generado. Cada caso corre en un
+proceso nuevo para que el RSS de uno no contamine al siguiente.
+
+El resultado es JSON, para comparar entre commits. No necesita Postgres.
+
+Uso (desde backend/):
+    python -m benchmarks.bench_export_suite --output resultados.json
+    python -m benchmarks.bench_export_suite --procesos 1 10 --exporters modular
+    python -m benchmarks.bench_export_suite --output nuevo.json --compare resultados.json
+"""
+import os
+import argparse
+import json
+import multiprocessing
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+# Las exportaciones no tocan la base de datos; evitar conectar a Postgres al importar app
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+# Formas de matriz: (subprocesos por proceso, fallas por subproceso, efectos por falla)
+SHAPES = {
+    "compacta": (2, 3, 1),
+    "tipica": (4, 5, 3),
+    "extensa": (3, 4, 8),
+}
+PROCESOS = [1, 10, 100]
+
+# nombre -> (función en matrix_service, tipo de matriz)
+EXPORTERS = {
+    "modular": ("export_modular_matrix_to_excel", "modular"),
+    "modular_streaming": ("export_modular_matrix_to_excel_streaming", "modular"),
+    "clasica": ("export_matrix_to_excel", "legacy"),
+    "clasica_streaming": ("export_matrix_to_excel_streaming", "legacy"),
+}
+DEFAULT_EXPORTERS = ["modular", "clasica"]
+
+
+def _peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa KiB; macOS, bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _output_size(excel_file) -> int:
+    excel_file.seek(0, os.SEEK_END)
+    size = excel_file.tell()
+    excel_file.close()
+    return size
+
+
+def run_case(exporter: str, shape: str, procesos: int, repeat: int) -> dict:
+    """Un caso del benchmark; se ejecuta en un proceso propio"""
+    # Cualquier salida al importar app (p. ej. el log de SQLAlchemy con DB_ECHO=true) no debe mezclarse con el JSON
+    sys.stdout = sys.stderr
+    from app.services import matrix_service
+    from benchmarks.synthetic import build_modular_matrix, build_legacy_matrix
+
+    func_name, kind = EXPORTERS[exporter]
+    export = getattr(matrix_service, func_name)
+    subprocesos, fallas, efectos = SHAPES[shape]
+    matrix, rows = build_modular_matrix(procesos, subprocesos, fallas, efectos)
+    if kind == "legacy":
+        matrix, rows = build_legacy_matrix(rows)
+
+    # Calentamiento (imports perezosos, logo) y tamaño del archivo
+    output_bytes = _output_size(export(matrix))
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        excel_file = export(matrix)
+        times.append(time.perf_counter() - start)
+        excel_file.close()
+
+    # tracemalloc en una corrida aparte: enlentece mucho la ejecución
+    tracemalloc.start()
+    export(matrix).close()
+    peak_tracemalloc = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "exporter": exporter,
+        "shape": shape,
+        "procesos": procesos,
+        "subprocesos": subprocesos,
+        "fallas": fallas,
+        "efectos": efectos,
+        "rows": rows,
+        "repeat": repeat,
+        "wall_min_s": min(times),
+        "wall_median_s": statistics.median(times),
+        "us_per_row": min(times) / rows * 1e6,
+        "peak_tracemalloc_bytes": peak_tracemalloc,
+        "peak_rss_bytes": _peak_rss_bytes(),
+        "output_bytes": output_bytes,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(__file__)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _metadata(repeat: int) -> dict:
+    import openpyxl
+    return {
+        "commit": _git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "openpyxl": openpyxl.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "repeat": repeat,
+    }
+
+
+def _case_key(result: dict):
+    return result["exporter"], result["shape"], result["procesos"]
+
+
+def compare(results: list, baseline: dict):
+    """Imprimir la variación de tiempo y memoria contra otro archivo de resultados"""
+    previous = {_case_key(r): r for r in baseline.get("results", [])}
+    print(f"\nComparación contra {baseline.get('meta', {}).get('commit') or 'línea base'}:", file=sys.stderr)
+    for result in results:
+        old = previous.get(_case_key(result))
+        if old is None:
+            continue
+        wall = (result["wall_min_s"] / old["wall_min_s"] - 1) * 100
+        mem = (result["peak_tracemalloc_bytes"] / max(old["peak_tracemalloc_bytes"], 1) - 1) * 100
+        print(f"  {result['exporter']:18s} {result['shape']:9s} procesos={result['procesos']:4d}"
+              f"  tiempo {wall:+6.1f}%  tracemalloc {mem:+6.1f}%", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--procesos", type=int, nargs="+", default=PROCESOS)
+    parser.add_argument("--shapes", nargs="+", choices=sorted(SHAPES), default=list(SHAPES))
+    parser.add_argument("--exporters", nargs="+", choices=sorted(EXPORTERS), default=DEFAULT_EXPORTERS)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="archivo JSON de resultados (por defecto, salida estándar)")
+    parser.add_argument("--compare", help="archivo JSON de una corrida anterior para comparar")
+    args = parser.parse_args()
+
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for exporter in args.exporters:
+        for shape in args.shapes:
+            for procesos in args.procesos:
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                    result = pool.submit(run_case, exporter, shape, procesos, args.repeat).result()
+                results.append(result)
+                print(f"{exporter:18s} {shape:9s} procesos={procesos:4d} filas={result['rows']:6d}"
+                      f"  {result['wall_min_s'] * 1000:9.1f} ms  {result['us_per_row']:7.1f} µs/fila"
+                      f"  tracemalloc={result['peak_tracemalloc_bytes'] / 1e6:7.1f} MB"
+                      f"  rss={result['peak_rss_bytes'] / 1e6:7.1f} MB"
+                      f"  xlsx={result['output_bytes'] / 1e3:8.1f} kB", file=sys.stderr)
+
+    report = {"meta": _metadata(args.repeat), "results": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    else:
+        json.dump(report, sys.stdout, indent=2, ensure_ascii=False)
+        print()
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Benchmark de la importación masiva de matrices modulares.
+
+Genera documentos MatrixModularCreate sintéticos (benchmarks/synthetic.py),
+los serializa como NDJSON y mide matrices por segundo de
+import_modular_matrices con varios tamaños de lote, contra la línea base
+de crear una matriz por vez (create_modular_matrix: un commit por matriz,
+como N llamadas a POST /matrices/modular).
+
+Por defecto usa una base SQLite temporal; con DATABASE_URL se mide contra
+esa base (p. ej. Postgres), que debe estar vacía o ser descartable.
+
+Uso (desde backend/):
+    python -m benchmarks.bench_import
+    python -m benchmarks.bench_import --matrices 2000 --procesos 3 --batch-sizes 50 200 500
+"""
+import os
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench_import.db"
+
+# El log de SQLAlchemy (echo) no debe mezclarse con los resultados
+os.environ.setdefault("DB_ECHO", "false")
+
+from app.database import AsyncSessionLocal
+from app.schemas import MatrixModularCreate
+from app.services.matrix_import import import_modular_matrices, iter_ndjson_documents
+from app.services.matrix_service import create_modular_matrix
+from benchmarks.synthetic import build_modular_data
+
+CHUNK_BYTES = 64 * 1024
+
+
+def build_documents(count: int, procesos: int) -> list:
+    data = build_modular_data(procesos, subprocesos=2, fallas=3, efectos=2)
+    data.pop("type")
+    return [{"name": f"Importada {i}", "description": "benchmark", "data": data} for i in range(count)]
+
+
+async def _chunks(body: bytes):
+    for i in range(0, len(body), CHUNK_BYTES):
+        yield body[i:i + CHUNK_BYTES]
+
+
+async def run_bulk(body: bytes, batch_size: int) -> dict:
+    async with AsyncSessionLocal() as db:
+        return await import_modular_matrices(db, iter_ndjson_documents(_chunks(body)), user_id=1,
+                                             batch_size=batch_size)
+
+
+async def run_one_by_one(documents: list) -> float:
+    start = time.perf_counter()
+    async with AsyncSessionLocal() as db:
+        for document in documents:
+            await create_modular_matrix(db, MatrixModularCreate.model_validate(document), user_id=1)
+    return time.perf_counter() - start
+
+
+async def main_async(args):
+    documents = build_documents(args.matrices, args.procesos)
+    body = "".join(json.dumps(document, ensure_ascii=False) + "\n" for document in documents).encode()
+    print(f"{args.matrices} matrices, {len(body) / 1e6:.1f} MB de NDJSON, base: {os.environ['DATABASE_URL']}")
+
+    if not args.skip_baseline:
+        baseline = await run_one_by_one(documents[:args.baseline_matrices])
+        rate = args.baseline_matrices / baseline
+        print(f"  una por vez     {args.baseline_matrices:6d} matrices  {baseline:7.2f} s  {rate:8.1f} matrices/s")
+
+    for batch_size in args.batch_sizes:
+        report = await run_bulk(body, batch_size)
+        print(f"  lote={batch_size:<5d}      {report['imported']:6d} matrices  {report['elapsed_s']:7.2f} s"
+              f"  {report['matrices_per_second']:8.1f} matrices/s  errores={report['failed']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--matrices", type=int, default=500)
+    parser.add_argument("--procesos", type=int, default=2)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--baseline-matrices", type=int, default=100,
+                        help="matrices de la línea base una por vez (es lenta)")
+    parser.add_argument("--skip-baseline", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
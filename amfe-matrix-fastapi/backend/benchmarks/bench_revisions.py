@@ -0,0 +1,111 @@
+"""
+Benchmark del historial de revisiones (app/services/revisions.py).
+
+Crea una matriz modular sintética (benchmarks/synthetic.py) y le aplica
+--edits ediciones pequeñas con update_modular_matrix (una evaluación o una
+descripción de falla por vez, como en el editor). Para varios intervalos de
+snapshot informa los bytes guardados frente a guardar el documento completo
+en cada revisión (sin comprimir y comprimido) y la latencia de reconstruir
+revisiones (get_revision).
+
+Por defecto usa una base SQLite temporal; con DATABASE_URL se mide contra
+esa base (p. ej. Postgres), que debe estar vacía o ser descartable.
+
+Uso (desde backend/):
+    python -m benchmarks.bench_revisions
+    python -m benchmarks.bench_revisions --procesos 8 --edits 200 --intervals 1 10 50
+"""
+import os
+import argparse
+import asyncio
+import copy
+import json
+import statistics
+import tempfile
+import time
+import zlib
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench_revisions.db"
+
+os.environ.setdefault("DB_ECHO", "false")
+
+from app.database import AsyncSessionLocal
+from app.schemas import MatrixModularCreate
+from app.services import revisions
+from app.services.matrix_service import create_modular_matrix, update_modular_matrix
+from benchmarks.synthetic import build_modular_data
+
+
+def edit(document: dict, step: int):
+    """Cambio pequeño y determinista: la evaluación o la descripción de una falla"""
+    procesos = document["data"]["procesos"]
+    proceso = procesos[step % len(procesos)]
+    subproceso = proceso["subprocesos"][step % len(proceso["subprocesos"])]
+    falla = subproceso["fallasPotenciales"][step % len(subproceso["fallasPotenciales"])]
+    if step % 2:
+        falla["descripcion"] = f"{falla['descripcion'].split(' (')[0]} (revisión {step})"
+    else:
+        evaluacion = falla["evaluacion"]
+        evaluacion["ocurrencia"] = evaluacion["ocurrencia"] % 5 + 1
+        evaluacion["rpn"] = evaluacion["severidad"] * evaluacion["detectabilidad"] * evaluacion["ocurrencia"]
+
+
+async def run(interval: int, args) -> dict:
+    revisions.REVISION_SNAPSHOT_INTERVAL = interval
+    data = build_modular_data(args.procesos, subprocesos=4, fallas=5, efectos=3)
+    data.pop("type")
+    document = {"name": f"Historial {interval}", "description": "benchmark", "data": data}
+    full_raw = full_packed = 0
+
+    async with AsyncSessionLocal() as db:
+        matrix = await create_modular_matrix(db, MatrixModularCreate.model_validate(document), user_id=1)
+        start = time.perf_counter()
+        for step in range(args.edits):
+            document = copy.deepcopy(document)
+            edit(document, step)
+            matrix = await update_modular_matrix(db, matrix, MatrixModularCreate.model_validate(document), user_id=1)
+            raw = json.dumps(revisions.revision_document(matrix), ensure_ascii=False).encode()
+            full_raw += len(raw)
+            full_packed += len(zlib.compress(raw, revisions.REVISION_COMPRESS_LEVEL))
+        write_s = time.perf_counter() - start
+
+        history = await revisions.list_revisions(db, matrix.id)
+        stored = sum(row["size"] for row in history)
+        times = []
+        for row in history:
+            start = time.perf_counter()
+            await revisions.get_revision(db, matrix.id, row["revision"])
+            times.append((time.perf_counter() - start) * 1000)
+
+    return {
+        "revisions": len(history),
+        "snapshots": sum(1 for row in history if row["kind"] == revisions.SNAPSHOT),
+        "stored": stored, "full_raw": full_raw, "full_packed": full_packed,
+        "write_ms": write_s * 1000 / args.edits,
+        "median_ms": statistics.median(times), "max_ms": max(times),
+    }
+
+
+async def main_async(args):
+    print(f"{args.procesos} procesos, {args.edits} ediciones, base: {os.environ['DATABASE_URL']}")
+    for interval in args.intervals:
+        r = await run(interval, args)
+        print(f"  intervalo={interval:<4d} {r['revisions']:4d} revisiones ({r['snapshots']} snapshots)"
+              f"  guardado {r['stored'] / 1024:8.1f} KiB  (copias completas {r['full_raw'] / 1024:8.1f} KiB,"
+              f" comprimidas {r['full_packed'] / 1024:7.1f} KiB)"
+              f"  escritura {r['write_ms']:6.2f} ms  reconstrucción mediana {r['median_ms']:6.2f} ms"
+              f"  máx {r['max_ms']:6.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--procesos", type=int, default=6)
+    parser.add_argument("--edits", type=int, default=100)
+    parser.add_argument("--intervals", type=int, nargs="+", default=[1, 10, 20, 50])
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Benchmark de la búsqueda de texto (GET /search, app/services/search.py).
+
+Carga matrices modulares sintéticas (benchmarks/synthetic.py) con
+import_modular_matrices, con un término poco frecuente en algunas fallas, y
+mide la latencia de search_fallas para consultas frecuentes, raras y sin
+resultados.
+
+Por defecto usa una base SQLite temporal (FTS5); con DATABASE_URL se mide
+contra esa base (p. ej. Postgres con el índice tsvector), que debe estar
+vacía o ser descartable.
+
+Uso (desde backend/):
+    python -m benchmarks.bench_search
+    python -m benchmarks.bench_search --matrices 2000 --repeat 50
+"""
+import os
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench_search.db"
+
+os.environ.setdefault("DB_ECHO", "false")
+
+from app.database import AsyncSessionLocal
+from app.services.matrix_import import import_modular_matrices
+from app.services.search import search_fallas
+from benchmarks.synthetic import build_modular_data
+
+RARE_EVERY = 50  # Una de cada RARE_EVERY matrices menciona el término raro
+
+QUERIES = [
+    ("frecuente", "efecto"),
+    ("raro", "extravasación"),
+    ("dos palabras", "extravasacion periférica"),
+    ("sin resultados", "inexistente"),
+]
+
+
+def build_documents(count: int, procesos: int):
+    for i in range(count):
+        data = build_modular_data(procesos, subprocesos=4, fallas=3, efectos=2)
+        data.pop("type")
+        if i % RARE_EVERY == 0:
+            data["procesos"][0]["subprocesos"][0]["fallasPotenciales"][0]["descripcion"] = \
+                "Extravasación del medicamento en vía periférica"
+        yield {"name": f"Búsqueda {i}", "description": "benchmark", "data": data}
+
+
+async def _documents(count: int, procesos: int):
+    for index, document in enumerate(build_documents(count, procesos)):
+        yield index, document
+
+
+async def main_async(args):
+    async with AsyncSessionLocal() as db:
+        report = await import_modular_matrices(db, _documents(args.matrices, args.procesos), user_id=1, batch_size=200)
+    fallas = report["imported"] * args.procesos * 4 * 3
+    print(f"{report['imported']} matrices, {fallas} fallas, base: {os.environ['DATABASE_URL']}")
+
+    async with AsyncSessionLocal() as db:
+        for label, q in QUERIES:
+            times = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                hits = await search_fallas(db, q, limit=args.limit)
+                times.append((time.perf_counter() - start) * 1000)
+            times.sort()
+            p95 = times[int(len(times) * 0.95) - 1] if len(times) >= 20 else times[-1]
+            print(f"  {label:15s} {q!r:30s} {len(hits):4d} hits  mediana {statistics.median(times):7.2f} ms"
+                  f"  p95 {p95:7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--matrices", type=int, default=1000)
+    parser.add_argument("--procesos", type=int, default=2)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=30)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark de la compresión de documentos (MATRIX_DATA_CODEC, app/services/document_codec.py).
+
+Para matrices modulares sintéticas (benchmarks/synthetic.py) de varios
+tamaños y cada códec (none, zlib y zstd si zstandard está instalado) mide:
+  - tamaño guardado de `data` por fila (SQLite: length del JSON; Postgres:
+    pg_column_size, ya con la compresión TOAST),
+  - latencia de escritura: INSERT de la fila de amfe_matrices con commit,
+  - latencia de lectura: SELECT de `data` por id en una sesión nueva, como
+    get_matrix.
+Solo se mide la fila de la matriz (sin tablas normalizadas ni resumen), que
+es lo que cambia el códec.
+
+Por defecto usa una base SQLite temporal; con DATABASE_URL se mide contra
+esa base (p. ej. Postgres), que debe estar vacía o ser descartable.
+
+Uso (desde backend/):
+    python -m benchmarks.bench_storage
+    python -m benchmarks.bench_storage --procesos 5 40 160 --repeat 20 --threshold 16384
+"""
+import os
+import argparse
+import asyncio
+import json
+import statistics
+import tempfile
+import time
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench_storage.db"
+
+os.environ.setdefault("DB_ECHO", "false")
+
+from sqlalchemy import func, select, type_coerce, Text
+
+from app.database import AsyncSessionLocal
+from app.models import AMFEMatrix
+from app.services import document_codec
+from benchmarks.synthetic import build_modular_data
+
+
+def _stored_size(dialect: str):
+    if dialect == 'postgresql':
+        return func.pg_column_size(AMFEMatrix.data)
+    return func.length(type_coerce(AMFEMatrix.data, Text))
+
+
+async def run(data: dict, codec: str, args) -> dict:
+    document_codec.MATRIX_DATA_CODEC = codec
+    document_codec.MATRIX_DATA_COMPRESS_THRESHOLD = args.threshold
+    ids, writes, reads = [], [], []
+    for i in range(args.repeat):
+        async with AsyncSessionLocal() as db:
+            start = time.perf_counter()
+            matrix = AMFEMatrix(name=f"{codec} {i}", data=data, created_by=1)
+            db.add(matrix)
+            await db.commit()
+            writes.append((time.perf_counter() - start) * 1000)
+            ids.append(matrix.id)
+    for matrix_id in ids:
+        async with AsyncSessionLocal() as db:
+            start = time.perf_counter()
+            loaded = await db.scalar(select(AMFEMatrix.data).where(AMFEMatrix.id == matrix_id))
+            reads.append((time.perf_counter() - start) * 1000)
+    assert loaded == data
+    async with AsyncSessionLocal() as db:
+        size = await db.scalar(select(_stored_size(db.bind.dialect.name)).where(AMFEMatrix.id == ids[0]))
+    return {"size": size, "write_ms": statistics.median(writes), "read_ms": statistics.median(reads)}
+
+
+async def main_async(args):
+    codecs = ['none', 'zlib'] + (['zstd'] if document_codec.zstd_available() else [])
+    print(f"códecs: {', '.join(codecs)}, umbral {args.threshold} bytes, base: {os.environ['DATABASE_URL']}")
+    for procesos in args.procesos:
+        data = build_modular_data(procesos, subprocesos=4, fallas=5, efectos=3)
+        plain = len(json.dumps(data, ensure_ascii=False))
+        print(f"  {procesos} procesos ({plain / 1024:.0f} KiB de JSON)")
+        for codec in codecs:
+            r = await run(data, codec, args)
+            print(f"    {codec:5s} guardado {r['size'] / 1024:9.1f} KiB  escritura {r['write_ms']:7.2f} ms"
+                  f"  lectura {r['read_ms']:7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--procesos", type=int, nargs="+", default=[5, 40, 160])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--threshold", type=int, default=document_codec.MATRIX_DATA_COMPRESS_THRESHOLD)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Generador de matrices AMFE sintéticas para benchmarks.
+
+Los documentos modulares cumplen MatrixModularData (app/schemas.py) y se
+envuelven en objetos con la forma de AMFEMatrix, sin base de datos.
+"""
+from datetime import datetime
+from types import SimpleNamespace
+
+PROCESO_COLORS = ["#C6E0B4", "#FFE699", "#9BC2E6", "#F8CBAD"]
+RIESGO_TIPOS = ['Crítico', 'Alto', 'Medio', 'Bajo']
+
+
+def _items(prefix: str, n: int):
+    return [{"id": f"{prefix}-{i}", "descripcion": f"{prefix} {i}"} for i in range(n)]
+
+
+def build_modular_data(num_procesos: int, subprocesos: int = 4, fallas: int = 5, efectos: int = 3) -> dict:
+    """
+    Documento modular sintético y determinista. Cada falla tiene `efectos`
+    efectos (la lista más larga), así que ocupa exactamente `efectos` filas.
+    """
+    procesos = []
+    for p in range(num_procesos):
+        subs = []
+        for s in range(subprocesos):
+            fallas_list = []
+            for f in range(fallas):
+                sev, det, ocu = (f % 5) + 1, (s % 5) + 1, (p % 5) + 1
+                fallas_list.append({
+                    "id": f"falla-{p}-{s}-{f}",
+                    "descripcion": f"Falla {p}.{s}.{f}",
+                    "efectosPotenciales": _items("efecto", efectos),
+                    "causasPotenciales": _items("causa", min(2, efectos)),
+                    "barrerasExistentes": _items("barrera", 1),
+                    "accionesRecomendadas": _items("accion", 1),
+                    "accionesTomadas": [],
+                    "responsable": "Ingeniería Biomédica",
+                    "evaluacion": {"severidad": sev, "detectabilidad": det, "ocurrencia": ocu, "rpn": sev * det * ocu},
+                })
+            subs.append({"id": f"sub-{p}-{s}", "nombre": f"Subproceso {p}.{s}", "fallasPotenciales": fallas_list})
+        procesos.append({
+            "id": f"proc-{p}",
+            "nombre": f"PROCESO {p}",
+            "color": PROCESO_COLORS[p % len(PROCESO_COLORS)],
+            "subprocesos": subs,
+        })
+
+    return {
+        "type": "modular",
+        "header": {
+            "fundacion": "Fundación Clínica Infantil Club Noel",
+            "codigo": "BENCH-001",
+            "servicio": "UCI",
+            "area": "UCI",
+            "elaboradoPor": "Benchmark",
+            "equipo": "VENTILADOR",
+            "fechaEmision": "2025-01-15",
+        },
+        "procesos": procesos,
+    }
+
+
+def build_legacy_data(rows: int) -> dict:
+    """Documento clásico (tableData) sintético con `rows` filas"""
+    table = []
+    for i in range(rows):
+        rpn = (i * 7) % 125 + 1
+        table.append([f"Proceso {i}" if i % 10 == 0 else '', "Sub", "Falla", "Efecto", 3, "Causa", 2,
+                      "Barrera", 4, rpn, RIESGO_TIPOS[i % 4], "Acción"])
+    return {"header": {"servicio": "UCI", "fechaEmision": "2025-01-15"}, "tableData": table}
+
+
+def fake_matrix(matrix_id: int, name: str, data: dict) -> SimpleNamespace:
+    """Objeto con los atributos de AMFEMatrix que usan los exportadores"""
+    now = datetime(2025, 1, 15)
+    return SimpleNamespace(id=matrix_id, name=name, description=None, data=data,
+                           created_by=None, created_at=now, updated_at=now)
+
+
+def build_modular_matrix(num_procesos: int, subprocesos: int = 4, fallas: int = 5, efectos: int = 3):
+    """Matriz modular sintética y su cantidad de filas de datos"""
+    data = build_modular_data(num_procesos, subprocesos, fallas, efectos)
+    return fake_matrix(1, "bench", data), num_procesos * subprocesos * fallas * efectos
+
+
+def build_legacy_matrix(rows: int):
+    """Matriz clásica sintética con `rows` filas de datos"""
+    return fake_matrix(2, "bench", build_legacy_data(rows)), rows
@@ -0,0 +1,31 @@
+import sys
+from sqlalchemy.orm import Session
+from app.database import engine
+from app.services.document_codec import CODECS, MATRIX_DATA_CODEC, MATRIX_DATA_COMPRESS_THRESHOLD, recompress_documents
+
+def recompress_matrices(codec: str = MATRIX_DATA_CODEC):
+    """
+    Reescribir el `data` de las matrices existentes con el códec indicado
+    (por defecto MATRIX_DATA_CODEC): comprimir los documentos grandes o,
+    con 'none', descomprimirlos todos. Uso: python recompress_matrices.py [none|zlib|zstd]
+    """
+    print(f"🔧 Recomprimiendo documentos de matrices: códec={codec}, umbral={MATRIX_DATA_COMPRESS_THRESHOLD} bytes")
+    print("=" * 50)
+
+    db = Session(bind=engine)
+    try:
+        report = recompress_documents(db, codec)
+        print(f"✅ {report['matrices']} matrices revisadas, {report['rewritten']} reescritas, "
+              f"{report['compressed']} guardadas comprimidas")
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    codec = sys.argv[1] if len(sys.argv) > 1 else MATRIX_DATA_CODEC
+    if codec not in CODECS:
+        sys.exit(f"Códec desconocido '{codec}', usar uno de: {', '.join(CODECS)}")
+    recompress_matrices(codec)
@@ -1,7 +1,7 @@
 import React, { useState, useEffect, useContext, useRef } from 'react';
 import { Link } from 'react-router-dom';
 import { AuthContext } from '../../context/AuthContext';
-import { getMatrices, deleteMatrix, downloadModularMatrixExcel } from '../../services/api';
+import { getMatrixSummaries, deleteMatrix, downloadModularMatrixExcel } from '../../services/api';
 import Header from '../Header';
 
 const MatrixList = () => {
@@ -25,7 +25,7 @@ const MatrixList = () => {
             if (isMountedRef.current) {
                 setLoading(true);
             }
-            const data = await getMatrices();
+            const data = await getMatrixSummaries();
             if (isMountedRef.current) {
                 setMatrices(data);
             }
@@ -84,26 +84,14 @@ const MatrixList = () => {
         return 'Bajo';
     };
 
-    // Obtener el RPN máximo de todas las fallas de la matriz
+    // RPN máximo de todas las fallas de la matriz (calculado por el backend)
     const getMaxRPN = (matrix) => {
-        if (!matrix.data?.procesos) return 1;
-        
-        let maxRPN = 1;
-        matrix.data.procesos.forEach(proceso => {
-            proceso.subprocesos?.forEach(subproceso => {
-                subproceso.fallasPotenciales?.forEach(falla => {
-                    if (falla.evaluacion?.rpn > maxRPN) {
-                        maxRPN = falla.evaluacion.rpn;
-                    }
-                });
-            });
-        });
-        return maxRPN;
+        return Math.max(matrix.max_rpn || 1, 1);
     };
 
     // Obtener el equipo de la matriz modular
     const getEquipo = (matrix) => {
-        return matrix.data?.header?.equipo || 'No especificado';
+        return matrix.equipo || 'No especificado';
     };
 
     const handleDownloadExcel = async (matrix) => {
@@ -29,6 +29,55 @@ api.interceptors.request.use((config) => {
     return Promise.reject(error);
 });
 
+// Cache of GET responses with an ETag: the next request for the same URL sends
+// If-None-Match and, if the server answers 304, the cached body is reused
+const ETAG_CACHE_MAX_ENTRIES = 50;
+const etagCache = new Map();
+
+const etagCacheKey = (config) => `${config.responseType || 'json'} ${api.getUri(config)}`;
+
+const isCacheableRequest = (config) => (config.method || 'get').toLowerCase() === 'get';
+
+export const clearResponseCache = () => etagCache.clear();
+
+api.interceptors.request.use((config) => {
+    if (isCacheableRequest(config)) {
+        const cached = etagCache.get(etagCacheKey(config));
+        if (cached) {
+            config.headers['If-None-Match'] = cached.etag;
+            // 304 is not an error: the response interceptor swaps in the cached body
+            config.validateStatus = (status) => (status >= 200 && status < 300) || status === 304;
+        }
+    }
+    return config;
+});
+
+api.interceptors.response.use((response) => {
+    if (!isCacheableRequest(response.config)) {
+        return response;
+    }
+    const key = etagCacheKey(response.config);
+    if (response.status === 304) {
+        const cached = etagCache.get(key);
+        if (cached) {
+            // Most recently used goes last
+            etagCache.delete(key);
+            etagCache.set(key, cached);
+            return { ...response, status: 200, data: cached.data, headers: { ...cached.headers, ...response.headers } };
+        }
+        return response;
+    }
+    const etag = response.headers?.etag;
+    if (etag) {
+        etagCache.delete(key);
+        etagCache.set(key, { etag, data: response.data, headers: response.headers });
+        if (etagCache.size > ETAG_CACHE_MAX_ENTRIES) {
+            etagCache.delete(etagCache.keys().next().value);
+        }
+    }
+    return response;
+});
+
 // Interceptor to handle token expiration
 api.interceptors.response.use(
     (response) => response,
@@ -37,6 +86,7 @@ api.interceptors.response.use(
             console.log('🚫 Token expirado o inválido, redirigiendo a login...');
             // Remove invalid token
             localStorage.removeItem('user');
+            clearResponseCache();
             // Redirect to login
             window.location.href = '/login';
         }
@@ -50,6 +100,25 @@ export const getMatrices = async () => {
     return response.data;
 };
 
+// Function to get the matrix list without the matrix documents (list view)
+export const getMatrixSummaries = async () => {
+    const response = await api.get('/matrices/summary');
+    return response.data;
+};
+
+// Function to get cross-matrix risk analytics (aggregates, RPN histogram and top fallas).
+// params: group_by ('servicio' | 'area' | 'month'), top, bucket_size, min_rpn, servicio, area, created_from, created_to
+export const getRiskAnalytics = async (params = {}) => {
+    const response = await api.get('/analytics/risk', { params });
+    return response.data;
+};
+
+// Function to search the fallas of the modular matrices (q, limit, servicio, area, created_by)
+export const searchMatrices = async (q, params = {}) => {
+    const response = await api.get('/search', { params: { q, ...params } });
+    return response.data;
+};
+
 // Function to create a new AMFE matrix
 export const createMatrix = async (matrixData) => {
     const response = await api.post('/matrices', matrixData);
@@ -68,6 +137,26 @@ export const deleteMatrix = async (id) => {
     return response.data;
 };
 
+// Function to list the revision history of a matrix (most recent first)
+export const getMatrixRevisions = async (id) => {
+    const response = await api.get(`/matrices/${id}/revisions`);
+    return response.data;
+};
+
+// Function to get the document of a matrix revision
+export const getMatrixRevision = async (id, revision) => {
+    const response = await api.get(`/matrices/${id}/revisions/${revision}`);
+    return response.data;
+};
+
+// Function to diff two revisions of a matrix (toRevision defaults to the latest)
+export const diffMatrixRevisions = async (id, fromRevision, toRevision) => {
+    const params = { from_revision: fromRevision };
+    if (toRevision !== undefined) params.to_revision = toRevision;
+    const response = await api.get(`/matrices/${id}/revisions/diff`, { params });
+    return response.data;
+};
+
 // Function to download an AMFE matrix as an Excel file
 export const downloadMatrixExcel = async (id, filename) => {
     const response = await api.get(`/matrices/${id}/export`, { responseType: 'blob' });
@@ -112,6 +201,26 @@ export const editModularMatrix = async (id, matrixData) => {
     return response.data;
 };
 
+// Function to partially update a modular AMFE matrix with JSON Patch operations.
+// etag is the ETag header of the last read; a 412 response means the matrix changed meanwhile.
+export const patchModularMatrix = async (id, operations, etag) => {
+    const response = await api.patch(`/matrices/modular/${id}`, operations, {
+        headers: { 'Content-Type': 'application/json-patch+json', 'If-Match': etag }
+    });
+    return { matrix: response.data, etag: response.headers.etag };
+};
+
+// Function to import modular AMFE matrices from a Club Noel .xlsx (one matrix per sheet) or a .zip of them.
+// Returns the import report: created ids and the errors per file/sheet.
+export const importModularMatricesExcel = async (file) => {
+    const formData = new FormData();
+    formData.append('file', file);
+    const response = await api.post('/matrices/modular/import/excel', formData, {
+        headers: { 'Content-Type': 'multipart/form-data' }
+    });
+    return response.data;
+};
+
 // Function to download a modular AMFE matrix as an Excel file
 export const downloadModularMatrixExcel = async (id, filename) => {
     const response = await api.get(`/matrices/modular/${id}/export`, { responseType: 'blob' });
@@ -1,4 +1,5 @@
 import axios from 'axios';
+import { clearResponseCache } from './api';
 
 // Use environment variable or fallback to localhost:8000
 const API_URL = process.env.REACT_APP_API_URL || 'http://localhost:8000';
@@ -28,6 +29,7 @@ export const login = async (username, password) => {
 
 export const logout = () => {
     localStorage.removeItem('user');
+    clearResponseCache();
 };
 
 export const getCurrentUser = () => {